@@ -3,22 +3,43 @@ import datetime
 import json
 from pathlib import Path
 from model import predict_triage
+from triage_rules import get_rules, get_rules_stats
+import triage_metrics
 from utils import save_patient_data
 import psycopg2
 
-# from voice_recon import transcribe_audio
+try:
+    import voice_recon
+    import voice_stream
+except Exception as e:  # whisper / sounddevice / PortAudio missing on this host
+    voice_recon = None
+    voice_stream = None
+    print(f"Voice recognition unavailable: {str(e)}")
 from db_utils import (
     check_hospital_db,
-    create_patient_entry,
+    find_patient,
     update_patient_record,
-    create_triage_record,
+    register_patient,
+    record_triage,
     get_triage_records,
+    get_pool_stats,
+    get_cache_stats,
+    get_outbox_stats,
+    get_outbox_dead_letters,
+    retry_outbox_dead_letters,
+    triage_page_cursor,
+    TRIAGE_HISTORY_COLUMNS,
+    TRIAGE_PAGE_SIZE,
 )
-from public_api import check_public_records
-from nlp_processor import process_text_to_keywords
+from public_api import DNI_PATTERN, lookup_public_records
+from nlp_processor import IncrementalKeywordExtractor, common_words_source, process_text_to_keywords, suggest_corrections
 from ticket_generator import generate_ticket
+from escpos_ticket import get_default_sink, get_print_queue, print_ticket_async
+import background_jobs
 import warnings
 import time
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from google.cloud import storage
 import os
 
@@ -64,6 +85,10 @@ PREGUNTAS_TRIAJE = [
 
 warnings.filterwarnings("ignore", message=".*torch.classes.*")
 
+# Start loading the Whisper model in the background (once per server process)
+if voice_recon is not None:
+    voice_recon.warm_up_model()
+
 
 def create_progress_bar():
     """Create a progress bar showing the current step in the process"""
@@ -86,6 +111,46 @@ def create_progress_bar():
     st.divider()
 
 
+def buscar_identidad(dni):
+    """
+    Look up a DNI in the public registry and the hospital DB at the same time.
+
+    Both lookups run in parallel, so the wait is the slower of the two rather
+    than their sum. A result is memoized per DNI for the session so reruns
+    (e.g. clicking "Crear nuevo registro") don't repeat it, but only when both
+    lookups answered: after a failure the next rerun asks again.
+
+    Returns:
+        dict: {"public": public record or None, "hospital": hospital record or None,
+               "errores": names of the lookups that failed}
+    """
+    lookups = st.session_state.setdefault("identity_lookups", {})
+    if dni in lookups:
+        return lookups[dni]
+
+    # Give the worker threads the script context so st.* calls work there
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(
+        max_workers=2, initializer=add_script_run_ctx, initargs=(None, ctx)
+    ) as executor:
+        futures = {
+            "public": executor.submit(lookup_public_records, dni),
+            "hospital": executor.submit(find_patient, dni),
+        }
+        identidad = {"errores": []}
+        for name, future in futures.items():
+            try:
+                identidad[name] = future.result()
+            except Exception as e:
+                print(f"Error in {name} lookup for {dni}: {str(e)}")  # Debug log
+                identidad[name] = None
+                identidad["errores"].append(name)
+
+    if not identidad["errores"]:
+        lookups[dni] = identidad
+    return identidad
+
+
 def mostrar_ingreso_dni():
     create_progress_bar()
 
@@ -114,16 +179,21 @@ def mostrar_ingreso_dni():
             search_submitted = st.form_submit_button("Buscar")
 
             if search_submitted and dni:
-                st.session_state.dni_input = dni
-                st.session_state.search_done = True
+                dni = dni.strip()
+                if DNI_PATTERN.match(dni):
+                    st.session_state.dni_input = dni
+                    st.session_state.search_done = True
+                else:
+                    st.error("El DNI debe contener solo números")
 
     # Handle search results and patient creation
     if st.session_state.search_done:
         dni = st.session_state.dni_input
         print(f"Processing DNI: {dni}")  # Debug log
 
-        # Buscar en base de datos pública
-        public_data = check_public_records(dni)
+        # Buscar en base de datos pública y del hospital en paralelo
+        identidad = buscar_identidad(dni)
+        public_data = identidad["public"]
         st.session_state.public_data = public_data
         print(f"Public records result: {public_data}")  # Debug log
 
@@ -133,15 +203,22 @@ def mostrar_ingreso_dni():
             st.json(public_data)
 
             # Verificar BD local
-            hospital_data = check_hospital_db(dni)
+            hospital_data = identidad["hospital"]
             print(f"Hospital DB result: {hospital_data}")  # Debug log
 
-            if not hospital_data:
+            if "hospital" in identidad["errores"]:
+                # Unknown, not absent: offering to create it could duplicate the patient
+                st.warning("No se pudo consultar la base de datos del hospital")
+                if st.button("🔄 Reintentar"):
+                    st.rerun()
+            elif not hospital_data:
                 st.warning("Paciente no encontrado en la base de datos del hospital")
                 if st.button("✅ Crear nuevo registro"):
                     try:
+                        # Acknowledged by the local outbox; synced to the server in the background
                         with st.spinner("Creando registro en la base de datos..."):
-                            new_patient = create_patient_entry(public_data)
+                            new_patient, _ = register_patient(public_data)
+                            identidad["hospital"] = new_patient
 
                         if new_patient:
                             st.success(f"""
@@ -167,8 +244,13 @@ def mostrar_ingreso_dni():
                     st.session_state.page = "sintomas"
                     st.rerun()
         else:
-            st.error("❌ No se encontró el paciente en registros públicos")
-            print("Patient not found in public records")  # Debug log
+            if "public" in identidad["errores"]:
+                st.warning("No se pudo consultar el registro público; puede reintentar o ingresar los datos")
+                if st.button("🔄 Reintentar búsqueda"):
+                    st.rerun()
+            else:
+                st.error("❌ No se encontró el paciente en registros públicos")
+                print("Patient not found in public records")  # Debug log
 
             # Show manual entry option only when public records are not found
             if st.button("📝 Ingresar datos manualmente"):
@@ -319,8 +401,14 @@ def mostrar_ingreso_dni():
                         "nacionalidad": nacionalidad,
                     }
                     try:
-                        new_patient = create_patient_entry(manual_data)
-                        st.success("✅ Paciente registrado exitosamente")
+                        new_patient, created = register_patient(manual_data)
+                        if created:
+                            st.success("✅ Paciente registrado exitosamente")
+                        elif created is None:
+                            # Server unreachable: saved locally, but new or existing is unknown
+                            st.success("✅ Registro guardado")
+                        else:
+                            st.success("✅ Paciente ya existente, datos actualizados")
                         st.session_state.patient_data = new_patient
                         st.session_state.manual_entry = False
                         time.sleep(1)
@@ -391,6 +479,34 @@ def mostrar_ingreso_sintomas():
                 st.session_state.nlp_results["conteos"]["no_urgente"],
             )
 
+    # Voice dictation: partial transcripts appear while the patient is talking
+    if voice_stream is not None:
+        st.subheader("🎤 Dictado por voz")
+        if st.button("🎤 Dictar síntomas"):
+            transcripcion = st.empty()
+            palabras_clave = st.empty()
+            transcripcion.info("Escuchando... hable ahora")
+            # Each partial transcript only extends the previous one, so the
+            # extractor only matches the newly transcribed chunk
+            extractor = IncrementalKeywordExtractor()
+
+            def mostrar_parcial(parcial):
+                transcripcion.info(f"📝 {parcial}")
+                extractor.update(parcial)
+                if extractor.keywords:
+                    palabras_clave.write("🔍 " + " | ".join(extractor.keywords))
+
+            try:
+                texto = voice_stream.stream_transcribe(on_partial=mostrar_parcial)
+                st.session_state.dictado = texto
+                if texto:
+                    transcripcion.success(f"📝 {texto}")
+                else:
+                    transcripcion.warning("No se detectó voz, intente nuevamente")
+            except Exception as e:
+                transcripcion.error(f"Error en el dictado: {str(e)}")
+                print(f"Error in voice dictation: {str(e)}")
+
     with st.form("sintomas_form"):
         st.subheader("🤒 Evaluación de Síntomas")
 
@@ -448,6 +564,7 @@ def mostrar_ingreso_sintomas():
         st.subheader("📝 Observaciones")
         observaciones = st.text_area(
             "Observaciones adicionales (opcional)",
+            value=st.session_state.get("dictado", "")[:200],
             max_chars=200,
             help="Ingrese observaciones adicionales sobre el paciente",
         )
@@ -522,6 +639,7 @@ def mostrar_ingreso_sintomas():
             try:
                 triage_result = predict_triage(symptoms_data)
                 st.session_state.triage_score = triage_result["nivel"]
+                st.session_state.symptoms_data["version_reglas"] = triage_result["version_reglas"]
 
                 # Store NLP results in session state
                 if triage_result.get("keywords"):
@@ -530,9 +648,24 @@ def mostrar_ingreso_sintomas():
                         "conteos": triage_result["conteos"],
                     }
 
-                # Show success message and display NLP results temporarily
+                # Start the ticket (PDF and thermal printer) in the background
+                # now, so the ticket page only picks up the result
+                ticket_data = {
+                    "patient": st.session_state.patient_data,
+                    "symptoms": st.session_state.symptoms_data,
+                    "triage_score": st.session_state.triage_score,
+                    "timestamp": datetime.datetime.now(),
+                    "diagnosis": "Pendiente de evaluación médica",
+                }
+                st.session_state.ticket_data = ticket_data
+                st.session_state.ticket_pdf = background_jobs.submit(
+                    "ticket_pdf", generate_ticket, ticket_data, max_attempts=1
+                )
+                sink = get_default_sink()
+                if sink is not None:
+                    st.session_state.impresion_ticket = print_ticket_async(ticket_data, sink)
+
                 st.success("Síntomas registrados correctamente")
-                time.sleep(3)  # 3 second delay
                 st.session_state.page = "ticket"
                 st.rerun()
 
@@ -543,6 +676,24 @@ def mostrar_ingreso_sintomas():
                 st.code(symptoms_data)
 
 
+# Seconds between refreshes of the print status while the job runs
+IMPRESION_POLL_S = 1.0
+
+
+def mostrar_estado_impresion(impresion, sondeando):
+    """Print job status on the ticket page; when polling ends, rerun the page once to stop the timer"""
+    if sondeando and impresion.done():
+        st.rerun()
+    if impresion.estado == background_jobs.REINTENTANDO:
+        st.info(f"🧾 Reintentando impresión (intento {impresion.intentos}): {impresion.error}")
+    elif not impresion.done():
+        st.info("🧾 Imprimiendo ticket...")
+    elif impresion.exception() is not None:
+        st.warning(f"No se pudo imprimir el ticket: {str(impresion.exception())}")
+    else:
+        st.success("🧾 Ticket impreso, retírelo de la impresora")
+
+
 def mostrar_ticket():
     create_progress_bar()
 
@@ -560,7 +711,8 @@ def mostrar_ticket():
         3. 🔄 **Generando Ticket**
         """)
 
-    ticket_data = {
+    # Queued by the symptoms page; built here only if the page was reached directly
+    ticket_data = st.session_state.get("ticket_data") or {
         "patient": st.session_state.patient_data,
         "symptoms": st.session_state.symptoms_data,
         "triage_score": st.session_state.triage_score,
@@ -569,9 +721,28 @@ def mostrar_ticket():
     }
 
     try:
-        generate_ticket(ticket_data)
+        # The background PDF is normally finished by now; if it was rejected,
+        # failed or is still queued, rendering inline is cheap (template splice)
+        trabajo_pdf = st.session_state.get("ticket_pdf")
+        if trabajo_pdf is not None and trabajo_pdf.done() and trabajo_pdf.exception() is None:
+            pdf_bytes = trabajo_pdf.result()
+        else:
+            pdf_bytes = generate_ticket(ticket_data)
         st.success("Ticket generado exitosamente")
 
+        # Thermal printer (TICKET_PRINTER): sent once per ticket by the
+        # background queue, so this rerun doesn't wait for the printer
+        sink = get_default_sink()
+        if sink is not None:
+            if "impresion_ticket" not in st.session_state:
+                st.session_state.impresion_ticket = print_ticket_async(ticket_data, sink)
+            impresion = st.session_state.impresion_ticket
+            # Refresh on its own until the job ends, so a failed print shows without user input
+            sondeando = not impresion.done()
+            st.fragment(mostrar_estado_impresion, run_every=IMPRESION_POLL_S if sondeando else None)(
+                impresion, sondeando
+            )
+
         # Display ticket information
         st.subheader("Resumen del Ticket")
         st.write(f"""
@@ -585,9 +756,7 @@ def mostrar_ticket():
         col1, col2, col3 = st.columns([1, 1, 2])
 
         with col1:
-            # Add print button with PDF download
-            with open("ticket.pdf", "rb") as pdf_file:
-                pdf_bytes = pdf_file.read()
+            # Add print button with PDF download (rendered in memory for this session only)
             st.download_button(
                 label="🖨️ Imprimir",
                 data=pdf_bytes,
@@ -602,6 +771,9 @@ def mostrar_ticket():
                 st.session_state.patient_data = None
                 st.session_state.symptoms_data = None
                 st.session_state.triage_score = None
+                st.session_state.pop("impresion_ticket", None)
+                st.session_state.pop("ticket_pdf", None)
+                st.session_state.pop("ticket_data", None)
                 st.session_state.page = "inicio"
                 st.rerun()
 
@@ -681,6 +853,13 @@ def main():
     if "page" not in st.session_state:
         st.session_state.page = "inicio"
 
+    # Pick up edits to reglas_triaje.json without restarting (one stat() per rerun)
+    try:
+        get_rules()
+    except Exception as e:
+        st.error(f"No se pudieron cargar las reglas de triaje: {str(e)}")
+        print(f"Error loading triage rules: {str(e)}")  # Debug log
+
     # Add navigation bar at the top
     create_navigation()
 
@@ -716,6 +895,120 @@ def mostrar_estadisticas():
     with col2:
         st.metric(label="Tiempo Promedio", value="12 min")
 
+    # Connection pool usage
+    st.subheader("🔌 Conexiones a la base de datos")
+    try:
+        pool_stats = get_pool_stats()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Conexiones abiertas", pool_stats["size"])
+        with col2:
+            st.metric("Checkouts", pool_stats["checkouts"])
+        with col3:
+            st.metric("Espera promedio", f"{pool_stats['wait_avg_s'] * 1000:.1f} ms")
+        st.json(pool_stats)
+    except Exception as e:
+        st.warning(f"No se pudo consultar el pool de conexiones: {str(e)}")
+
+    # Local outbox (writes waiting to reach the central database)
+    st.subheader("📤 Sincronización con la base central")
+    try:
+        outbox_stats = get_outbox_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Pendientes", outbox_stats["pendientes"])
+        with col2:
+            st.metric("Con reintentos", outbox_stats["con_reintentos"])
+        with col3:
+            st.metric("Descartados", outbox_stats["descartados"])
+        with col4:
+            st.metric("Más antiguo", f"{outbox_stats['antiguedad_max_s']:.0f} s")
+        if outbox_stats["ultimo_error"]:
+            st.warning(f"Último error de sincronización: {outbox_stats['ultimo_error']}")
+        if outbox_stats["descartados"]:
+            st.error(f"{outbox_stats['descartados']} registros no se pudieron sincronizar tras varios intentos "
+                     "y quedaron apartados en el tótem")
+            with st.expander("Registros descartados"):
+                st.json([
+                    {key: entry[key] for key in ("tipo", "dni", "clave", "fallos", "ultimo_error")}
+                    for entry in get_outbox_dead_letters()
+                ])
+            if st.button("🔁 Reintentar descartados"):
+                reintentados = retry_outbox_dead_letters()
+                st.success(f"{reintentados} registros vuelven a la cola de sincronización")
+        st.json(outbox_stats)
+    except Exception as e:
+        st.warning(f"No se pudo consultar la cola local: {str(e)}")
+
+    # Patient lookup cache usage
+    st.subheader("🗂️ Caché de búsquedas de pacientes")
+    cache_stats = get_cache_stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Aciertos", cache_stats["hits"])
+    with col2:
+        st.metric("Fallos", cache_stats["misses"])
+    with col3:
+        st.metric("Desalojos", cache_stats["evictions"])
+    st.json(cache_stats)
+
+    # Background tickets, printing and archival
+    st.subheader("🧾 Cola de tareas en segundo plano")
+    cola = background_jobs.get_queue_stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("En cola", f"{cola['en_cola']} / {cola['capacidad']}")
+    with col2:
+        st.metric("Reintentos", cola["reintentos"])
+    with col3:
+        st.metric("Fallidas", cola["terminados"][background_jobs.FALLIDO] + cola["terminados"][background_jobs.RECHAZADO])
+    with st.expander("Últimas tareas"):
+        st.json(cola["recientes"][:20])
+
+    # Thermal printer jobs (own queue, so a printer offline doesn't delay the tasks above)
+    st.subheader("🖨️ Cola de impresión")
+    impresion = get_print_queue().stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("En cola", f"{impresion['en_cola']} / {impresion['capacidad']}")
+    with col2:
+        st.metric("Reintentos", impresion["reintentos"])
+    with col3:
+        st.metric("Fallidas", impresion["terminados"][background_jobs.FALLIDO] + impresion["terminados"][background_jobs.RECHAZADO])
+    with st.expander("Últimas impresiones"):
+        st.json(impresion["recientes"][:20])
+
+    # Triage rules in use
+    st.subheader("📐 Reglas de triaje")
+    st.json(get_rules_stats())
+
+    # Frequency list that keeps ordinary words out of the typo suggestions
+    st.subheader("✏️ Sugerencias ortográficas")
+    palabras_comunes = common_words_source()
+    if palabras_comunes["fuente"] == "wordfreq":
+        st.success("Filtro de palabras comunes: wordfreq")
+    elif palabras_comunes["palabras"]:
+        st.warning(f"wordfreq no está instalado: se usa la lista incluida ({palabras_comunes['palabras']} palabras)")
+    else:
+        st.error("Sin lista de palabras comunes: las sugerencias pueden proponer cambios a palabras correctas")
+
+    # Rule hits and latencies (only collected with TRIAGE_METRICS=1)
+    st.subheader("🧮 Instrumentación del modelo")
+    if triage_metrics.enabled:
+        metricas = triage_metrics.snapshot()
+        st.metric("Predicciones instrumentadas", metricas["predictions"])
+        st.bar_chart(dict(list(metricas["rule_hits"].items())[:20]))
+        st.download_button(
+            label="⬇️ Exportar métricas (Prometheus)",
+            data=triage_metrics.export_prometheus(),
+            file_name="triage_metrics.txt",
+            mime="text/plain",
+        )
+        with st.expander("Últimas trazas"):
+            st.json(metricas["recent_traces"][-10:])
+    else:
+        st.info("Instrumentación deshabilitada (active con TRIAGE_METRICS=1)")
+
 
 def mostrar_registro_paciente():
     st.title("📋 Registro de Paciente")
@@ -762,8 +1055,10 @@ def mostrar_registro_paciente():
         nivel_triage = predict_triage(datos_paciente)
         datos_paciente["nivel_triage"] = nivel_triage
 
-        # Guardar datos
-        save_patient_data(datos_paciente)
+        # Guardar datos en segundo plano; si la cola está llena, en esta misma ejecución
+        archivo = background_jobs.submit("archivo_paciente", save_patient_data, datos_paciente)
+        if archivo.estado == background_jobs.RECHAZADO:
+            save_patient_data(datos_paciente)
 
         # Mostrar resultado
         st.success("Registro completado exitosamente")
@@ -820,6 +1115,54 @@ def upload_to_gcs(file, patient_dni):
         raise e
 
 
+def cargar_pagina_historial(historial):
+    """Fetch the next page of triage history into the session-state history"""
+    # Ask for one extra row to know whether an older page exists
+    records = get_triage_records(
+        historial["dni"],
+        limit=TRIAGE_PAGE_SIZE + 1,
+        before=historial["cursor"],
+        columns=TRIAGE_HISTORY_COLUMNS,
+    )
+    page = records[:TRIAGE_PAGE_SIZE]
+    historial["records"].extend(dict(record) for record in page)
+    historial["cursor"] = triage_page_cursor(page)
+    historial["has_more"] = len(records) > TRIAGE_PAGE_SIZE
+
+
+def mostrar_historial_triage(dni):
+    """Show the latest triage records with a control to load older pages"""
+    historial = st.session_state.get("triage_history")
+    if not historial or historial["dni"] != dni:
+        historial = {"dni": dni, "records": [], "cursor": None, "has_more": False}
+        cargar_pagina_historial(historial)
+        st.session_state.triage_history = historial
+
+    if not historial["records"]:
+        st.write("Sin registros anteriores")
+        return
+
+    st.dataframe(
+        [
+            {
+                "Fecha": record["fecha_triage"],
+                "Nivel": record["nivel_triage"],
+                "Presión": record["presion_arterial"],
+                "Temp (°C)": record["temperatura"],
+                "Pulso (bpm)": record["frecuencia_cardiaca"],
+                "O2 (%)": record["saturacion_oxigeno"],
+            }
+            for record in historial["records"]
+        ],
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    if historial["has_more"] and st.button("⏬ Cargar registros anteriores"):
+        cargar_pagina_historial(historial)
+        st.rerun()
+
+
 def mostrar_enfermeria():
     """Display nursing interface for patient assessment"""
     st.title("👩‍⚕️ Panel de Enfermería")
@@ -842,18 +1185,7 @@ def mostrar_enfermeria():
 
             # Show previous triage records in a table format
             st.subheader("📜 Registros anteriores")
-            triage_records = get_triage_records(search_dni)
-            if triage_records:
-                for record in triage_records:
-                    st.markdown(f"""
-                    **Fecha:** {record["fecha_triage"]}  
-                    **Nivel:** {record["nivel_triage"]}  
-                    **Presión:** {record["presion_arterial"]} | 
-                    **Temp:** {record["temperatura"]}°C | 
-                    **Pulso:** {record["frecuencia_cardiaca"]} bpm | 
-                    **O2:** {record["saturacion_oxigeno"]}%
-                    ---
-                    """)
+            mostrar_historial_triage(search_dni)
 
             # New triage form
             st.subheader("📋 Nuevo Registro")
@@ -917,6 +1249,16 @@ def mostrar_enfermeria():
                             ],
                         )
 
+                # Possible typos: shown for the nurse to fix, never used for the level
+                if st.session_state.get("sugerencias_nursing"):
+                    st.warning(
+                        "✏️ ¿Quiso decir? "
+                        + ", ".join(
+                            f"{s['original']} → {s['sugerencia']}"
+                            for s in st.session_state.sugerencias_nursing
+                        )
+                    )
+
                 submitted = st.form_submit_button("Guardar Registro")
 
                 if submitted:
@@ -966,9 +1308,10 @@ def mostrar_enfermeria():
                             ],  # Use the nivel value
                             "archivo_adjunto": file_url,
                             "sintomas": sintomas,
+                            "version_reglas": triage_result["version_reglas"],
                         }
 
-                        new_record = create_triage_record(
+                        new_record = record_triage(
                             st.session_state.current_patient["dni"], triage_data
                         )
 
@@ -979,6 +1322,11 @@ def mostrar_enfermeria():
                                 "conteos": triage_result["conteos"],
                             }
 
+                        st.session_state.sugerencias_nursing = suggest_corrections(notes)
+
+                        # Reload the history so the new record shows up first
+                        st.session_state.pop("triage_history", None)
+
                         st.success("✅ Registro creado exitosamente")
                         st.info(f"Nivel de triaje sugerido: {triage_result['nivel']}")
                         st.rerun()  # This will show the stored NLP results
@@ -0,0 +1,230 @@
+"""
+Bounded background queue for the work that follows a triage: rendering the
+ticket PDF, sending it to the thermal printer and archiving patient data.
+
+Jobs run on one worker thread in submission order, so tickets reach the
+printer in the same order patients finished. ``submit`` never blocks: when
+the queue is full the job comes back already marked 'rechazado' and the
+caller decides what to do (the ticket page renders the PDF inline). Jobs
+failing with a transient error (OSError by default: disk, device node,
+socket) are retried with exponential backoff. The retry waits on the
+worker, so no later job overtakes it; work on a device that may stay
+offline for a while gets a queue of its own (escpos_ticket) so it cannot
+hold up this one.
+
+Every job exposes its state, and ``stats`` summarizes the queue for the
+statistics page.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+REINTENTANDO = "reintentando"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+RECHAZADO = "rechazado"
+
+ESTADOS = (PENDIENTE, EN_CURSO, REINTENTANDO, COMPLETADO, FALLIDO, RECHAZADO)
+
+DEFAULT_MAXSIZE = int(os.environ.get("BACKGROUND_QUEUE_SIZE", 100))
+
+RECENT_JOBS = 50
+
+
+class Job:
+    """
+    One unit of background work. Polled like a concurrent.futures.Future
+    (``done``, ``result``, ``exception``) so Streamlit reruns can keep it in
+    session state and check on it.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, func, args=(), kwargs=None, max_attempts=3, backoff=0.5, retry_on=(OSError,)):
+        self.id = next(self._ids)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retry_on = retry_on
+
+        self.estado = PENDIENTE
+        self.intentos = 0
+        self.error = None
+        self._result = None
+        self._exception = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job; return its value or raise its exception"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job {self.name}#{self.id} still {self.estado}")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job {self.name}#{self.id} still {self.estado}")
+        return self._exception
+
+    def _finish(self, estado, result=None, exception=None):
+        self.estado = estado
+        self._result = result
+        self._exception = exception
+        self.error = str(exception) if exception is not None else None
+        self.finished_at = time.time()
+        self._done.set()
+
+    def status(self):
+        return {
+            "id": self.id,
+            "nombre": self.name,
+            "estado": self.estado,
+            "intentos": self.intentos,
+            "error": self.error,
+            "espera_s": (self.finished_at or time.time()) - self.submitted_at,
+        }
+
+    def __repr__(self):
+        return f"Job({self.name!r}#{self.id}, {self.estado})"
+
+
+class JobQueue:
+    """
+    Bounded FIFO of jobs served by one daemon worker thread.
+
+    Args:
+        maxsize (int): Jobs waiting before submit rejects
+        name (str): Worker thread name
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, name="background-jobs"):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive, got {maxsize}")
+        self.maxsize = maxsize
+        self.name = name
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._recent = deque(maxlen=RECENT_JOBS)
+        self._counts = dict.fromkeys(ESTADOS, 0)
+        self._retries = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def submit(self, name, func, *args, max_attempts=3, backoff=0.5, retry_on=(OSError,), **kwargs):
+        """
+        Queue func(*args, **kwargs) without blocking.
+
+        Args:
+            name (str): Label shown in the status surface
+            max_attempts (int): Runs before the job is marked 'fallido'
+            backoff (float): Seconds before the first retry, doubled on each one
+            retry_on (tuple): Exception types worth retrying
+
+        Returns:
+            Job: Already marked 'rechazado' if the queue is full
+        """
+        job = Job(name, func, args, kwargs, max_attempts, backoff, retry_on)
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            job._finish(RECHAZADO, exception=queue.Full(f"Cola de tareas llena ({self.maxsize})"))
+            self._count(job)
+            print(f"Background queue full, rejected {job!r}")  # Debug log
+        return job
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job):
+        while True:
+            job.estado = EN_CURSO
+            job.intentos += 1
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except job.retry_on as e:
+                if job.intentos < job.max_attempts:
+                    delay = job.backoff * 2 ** (job.intentos - 1)
+                    job.estado = REINTENTANDO
+                    job.error = str(e)
+                    with self._lock:
+                        self._retries += 1
+                    print(f"{job!r} attempt {job.intentos} failed, retrying in {delay:.1f}s: {str(e)}")  # Debug log
+                    # Wait here rather than requeue, so jobs submitted later keep waiting behind this one
+                    time.sleep(delay)
+                    continue
+                job._finish(FALLIDO, exception=e)
+            except Exception as e:
+                job._finish(FALLIDO, exception=e)
+            else:
+                job._finish(COMPLETADO, result=result)
+            break
+
+        if job.estado == FALLIDO:
+            print(f"{job!r} failed after {job.intentos} attempts: {job.error}")  # Debug log
+        self._count(job)
+
+    def _count(self, job):
+        with self._lock:
+            self._counts[job.estado] += 1
+            self._recent.append(job)
+
+    def join(self, timeout=None):
+        """Wait until no job is queued, running or retrying; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        """Queue depth, finished jobs per state, retries and the last jobs' status"""
+        with self._lock:
+            return {
+                "en_cola": self._queue.qsize(),
+                "capacidad": self.maxsize,
+                "terminados": dict(self._counts),
+                "reintentos": self._retries,
+                "recientes": [job.status() for job in reversed(self._recent)],
+            }
+
+
+_job_queue = JobQueue()
+
+
+def get_job_queue():
+    """Queue shared by every session of this server process"""
+    return _job_queue
+
+
+def submit(name, func, *args, **kwargs):
+    return _job_queue.submit(name, func, *args, **kwargs)
+
+
+def get_queue_stats():
+    return _job_queue.stats()
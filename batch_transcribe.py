@@ -0,0 +1,127 @@
+"""
+Re-transcribe archived kiosk audio in bulk.
+
+Audio files come from a directory (recursively) or a manifest (CSV with an
+'archivo' column, or one path per line). They are decoded and transcribed
+across a process pool where every worker keeps one resident model. One JSON
+line per file is written as soon as it finishes, with decode and inference
+timings, and optionally the keywords and triage level for the transcript.
+
+    python batch_transcribe.py audios/ -o transcripciones.jsonl --workers 4 --triage
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+AUDIO_EXTENSIONS = {".wav", ".flac", ".ogg", ".mp3", ".m4a", ".webm"}
+
+_worker_options = {}
+
+
+def list_audio_files(source):
+    """Audio paths from a directory or a manifest file"""
+    source = Path(source)
+    if source.is_dir():
+        return sorted(p for p in source.rglob("*") if p.suffix.lower() in AUDIO_EXTENSIONS)
+
+    with open(source, encoding="utf-8") as f:
+        if source.suffix.lower() == ".csv":
+            paths = [row["archivo"] for row in csv.DictReader(f)]
+        else:
+            paths = [line.strip() for line in f if line.strip()]
+    return [p if Path(p).is_absolute() else source.parent / p for p in map(Path, paths)]
+
+
+def init_worker(backend, size, threads, with_triage):
+    # Limit per-worker threads before torch/CTranslate2 are imported
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        os.environ["TRANSCRIPTION_CPU_THREADS"] = str(threads)
+
+    import voice_recon
+
+    voice_recon.get_transcriber(backend, size)
+    _worker_options.update(backend=backend, size=size, with_triage=with_triage)
+
+
+def decode(path):
+    import voice_recon
+
+    try:
+        return voice_recon.load_audio_file(path)
+    except Exception:
+        # Formats libsndfile can't read (mp3, m4a, webm) fall back to ffmpeg
+        if not voice_recon.check_ffmpeg():
+            raise
+        import whisper
+
+        return whisper.load_audio(str(path))
+
+
+def transcribe_file(path):
+    import voice_recon
+
+    result = {"archivo": str(path)}
+    try:
+        start = time.perf_counter()
+        audio = decode(path)
+        result["decode_s"] = time.perf_counter() - start
+        result["audio_s"] = len(audio) / voice_recon.WHISPER_SAMPLE_RATE
+
+        start = time.perf_counter()
+        text = voice_recon.run_transcription(
+            audio, size=_worker_options["size"], backend=_worker_options["backend"]
+        )
+        result["inference_s"] = time.perf_counter() - start
+        result["texto"] = text
+
+        if _worker_options["with_triage"]:
+            from model import predict_triage
+            from nlp_processor import process_text_to_keywords
+
+            result["keywords"] = process_text_to_keywords(text)
+            result["triage"] = predict_triage({"observaciones": text})
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcripción masiva de audios archivados")
+    parser.add_argument("source", help="Directorio de audios o manifiesto (.csv con columna 'archivo' o lista de rutas)")
+    parser.add_argument("-o", "--output", default="transcripciones.jsonl")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=2)
+    parser.add_argument("--backend", default=None, help="Motor de transcripción (por defecto TRANSCRIPTION_BACKEND)")
+    parser.add_argument("--size", default=None, help="Tamaño del modelo (por defecto WHISPER_MODEL)")
+    parser.add_argument("--triage", action="store_true", help="Agregar palabras clave y nivel de triaje")
+    args = parser.parse_args()
+
+    files = list_audio_files(args.source)
+    print(f"{len(files)} archivos a transcribir con {args.workers} procesos")
+
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    done = failed = 0
+    with context.Pool(
+        args.workers,
+        initializer=init_worker,
+        initargs=(args.backend, args.size, args.threads_per_worker, args.triage),
+    ) as pool, open(args.output, "w", encoding="utf-8") as out:
+        for result in pool.imap_unordered(transcribe_file, files):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            failed += "error" in result
+            print(f"[{done}/{len(files)}] {result['archivo']}: {result.get('texto', result.get('error'))}")
+
+    elapsed = time.perf_counter() - start
+    print(f"{done} archivos ({failed} con error) en {elapsed:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Micro-benchmark of keyword extraction per nursing note.
+
+Compares nlp_processor.process_text_to_keywords with the previous
+per-call implementation (kept below as the baseline).
+
+    python benchmark_nlp.py --repeat 2000
+"""
+import argparse
+import statistics
+import time
+
+from nlp_processor import IncrementalKeywordExtractor, process_text_to_keywords, suggest_corrections
+
+SAMPLE_NOTES = [
+    "El paciente presenta dolor en el pecho y dificultad para respirar",
+    "Refiere fiebre desde ayer, vómito y diarrea. Niega dolor abdominal.",
+    "Paciente con tos seca, cansancio y malestar general desde hace una semana",
+    "Mareos al incorporarse, náuseas, sin pérdida de conciencia",
+    "Consulta por picazón en brazos y comezón generalizada luego de comer mariscos",
+    "Convulsiones en domicilio, llega inconsciente, familiar refiere sangrado nasal",
+    "Control de presión arterial, sin síntomas actuales",
+    "Dolor de cabeza intenso, fatiga, fiebre alta y falta de aire al caminar. "
+    "Antecedentes de hipertensión y diabetes. Refiere mareo y náusea durante la noche.",
+]
+
+
+def legacy_process_text_to_keywords(text):
+    """Baseline: rebuilds the vocabularies and rescans word by word on every call"""
+    stop_words = {
+        'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', 'y', 'o', 'pero', 'si',
+        'de', 'del', 'a', 'en', 'para', 'por', 'con', 'al', 'lo', 'le', 'ha', 'he',
+        'que', 'es', 'no', 'son', 'era', 'este', 'esta', 'estos', 'estas', 'ese',
+        'esa', 'esos', 'esas', 'aquel', 'aquella', 'me', 'mi', 'tu', 'te', 'se',
+        'nos', 'su', 'sus', 'como', 'cuando', 'donde', 'quien', 'cual', 'que',
+        'mas', 'mas', 'mientras', 'antes', 'despues', 'ahora', 'durante'
+    }
+    medical_terms = {
+        'dolor': 'critico', 'pecho': 'critico', 'respirar': 'critico',
+        'dificultad': 'critico', 'inconsciente': 'critico', 'sangrado': 'critico',
+        'hemorragia': 'critico', 'convulsion': 'critico', 'convulsiones': 'critico',
+        'fiebre': 'urgente', 'vomito': 'urgente', 'vómito': 'urgente',
+        'diarrea': 'urgente', 'mareo': 'urgente', 'mareos': 'urgente',
+        'nausea': 'urgente', 'náusea': 'urgente', 'abdomen': 'urgente',
+        'tos': 'no_urgente', 'cansancio': 'no_urgente', 'fatiga': 'no_urgente',
+        'malestar': 'no_urgente', 'picazon': 'no_urgente', 'picazón': 'no_urgente',
+        'comezon': 'no_urgente', 'comezón': 'no_urgente'
+    }
+    words = text.lower().replace('.', ' ').replace(',', ' ').split()
+    keywords = []
+    for word in words:
+        if word in medical_terms and word not in stop_words and len(word) > 2:
+            keywords.append(word)
+    return keywords
+
+
+def per_note_microseconds(function, notes, repeat):
+    """Median latency per note in microseconds over `repeat` passes"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for note in notes:
+            function(note)
+        samples.append((time.perf_counter() - start) / len(notes) * 1e6)
+    return statistics.median(samples)
+
+
+def dictation_microseconds(notes, repeat, incremental):
+    """Median cost of following a dictation word by word, rescanning or incrementally"""
+    text = " ".join(notes)
+    prefixes = [text[:i] for i, c in enumerate(text) if c == " "] + [text]
+    samples = []
+    for _ in range(repeat):
+        extractor = IncrementalKeywordExtractor()
+        start = time.perf_counter()
+        for prefix in prefixes:
+            if incremental:
+                extractor.update(prefix)
+            else:
+                process_text_to_keywords(prefix)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples), len(prefixes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de extracción de palabras clave")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    candidates = {
+        "legacy (per-call dicts)": legacy_process_text_to_keywords,
+        "process_text_to_keywords": process_text_to_keywords,
+        "fuzzy=True": lambda note: process_text_to_keywords(note, fuzzy=True),
+    }
+    baseline = None
+    for name, function in candidates.items():
+        latency = per_note_microseconds(function, SAMPLE_NOTES, args.repeat)
+        baseline = baseline or latency
+        print(f"{name:<28}{latency:>8.2f} µs/nota  ({baseline / latency:.2f}x)")
+
+    note = SAMPLE_NOTES[0]
+    rescan, updates = dictation_microseconds(SAMPLE_NOTES, max(1, args.repeat // 20), incremental=False)
+    incremental, _ = dictation_microseconds(SAMPLE_NOTES, max(1, args.repeat // 20), incremental=True)
+    print(f"\nDictado palabra por palabra ({updates} actualizaciones):")
+    print(f"  re-escaneo completo {rescan:>10.0f} µs")
+    print(f"  incremental         {incremental:>10.0f} µs  ({rescan / incremental:.1f}x)")
+
+    typo_note = "Refiere diarea, convulcion y le cuesta resprar"
+    print(f"\n{typo_note}\n  exacto:      {process_text_to_keywords(typo_note)}"
+          f"\n  sugerencias: {suggest_corrections(typo_note)}")
+
+    print(f"\n{note}\n  legacy: {legacy_process_text_to_keywords(note)}\n  actual: {process_text_to_keywords(note)}")
+
+
+if __name__ == "__main__":
+    main()
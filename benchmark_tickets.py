@@ -0,0 +1,69 @@
+"""
+Tickets per second for bulk PDF generation.
+
+Compares the previous flow (reportlab canvas saved to ticket.pdf, then read
+back), a fresh canvas rendered in memory, and generate_ticket, which splices
+each ticket into the cached template.
+
+    python benchmark_tickets.py --tickets 2000
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from ticket_generator import generate_tickets, render_ticket_canvas
+
+NOMBRES = ["María González", "José Pérez", "Ana Núñez", "Carlos Fernández", "Lucía Díaz"]
+NIVELES = ["NIVEL 1 - ATENCIÓN INMEDIATA", "NIVEL 2 - ATENCIÓN PRIORITARIA", "NIVEL 4 - ATENCIÓN NORMAL"]
+
+
+def sample_tickets(n):
+    start = datetime.datetime(2026, 1, 1, 8, 0)
+    return [
+        {
+            "patient": {"nombre": NOMBRES[i % len(NOMBRES)], "dni": str(30000000 + i)},
+            "symptoms": {"sintomas": ["Fiebre", "Mareos", "Cabeza"][: 1 + i % 3]},
+            "triage_score": NIVELES[i % len(NIVELES)],
+            "timestamp": start + datetime.timedelta(minutes=i),
+            "diagnosis": "Pendiente de evaluación médica",
+        }
+        for i in range(n)
+    ]
+
+
+def legacy_via_file(tickets, directory):
+    """Previous flow: write ticket.pdf, then read it back for the download button"""
+    path = os.path.join(directory, "ticket.pdf")
+    for ticket_data in tickets:
+        render_ticket_canvas(ticket_data, path)
+        with open(path, "rb") as f:
+            f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de generación de tickets PDF")
+    parser.add_argument("--tickets", type=int, default=2000)
+    args = parser.parse_args()
+
+    tickets = sample_tickets(args.tickets)
+    generate_tickets(tickets[:1])  # build the template outside the timing
+
+    with tempfile.TemporaryDirectory() as directory:
+        candidates = {
+            "canvas -> ticket.pdf": lambda: legacy_via_file(tickets, directory),
+            "canvas en memoria": lambda: [render_ticket_canvas(t) for t in tickets],
+            "plantilla (generate_ticket)": lambda: generate_tickets(tickets),
+        }
+        baseline = None
+        for name, run in candidates.items():
+            start = time.perf_counter()
+            run()
+            rate = args.tickets / (time.perf_counter() - start)
+            baseline = baseline or rate
+            print(f"{name:<30}{rate:>10,.0f} tickets/s  ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Compare transcription backends on the local set of Spanish symptom recordings.
+
+Each backend runs in its own process so peak RSS is measured per backend.
+Reports model load time, real-time factor (inference seconds / audio seconds),
+peak RSS and word error rate against the reference texts in the manifest.
+
+    python benchmark_transcription.py --record            # record the set once
+    python benchmark_transcription.py --backends whisper faster-whisper --size base
+"""
+import argparse
+import csv
+import multiprocessing
+import resource
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent / "benchmark_data" / "sintomas_es"
+
+
+def load_manifest(data_dir):
+    with open(Path(data_dir) / "manifest.csv", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def normalize_words(text):
+    """Lowercase, drop accents and punctuation so WER only counts word differences"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = "".join(c if c.isalnum() else " " for c in text)
+    return text.split()
+
+
+def word_edit_distance(reference, hypothesis):
+    """Levenshtein distance between two word lists"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_backend(backend, size, data_dir, results):
+    import voice_recon
+
+    rows = load_manifest(data_dir)
+    clips = [(row, voice_recon.load_audio_file(Path(data_dir) / row["archivo"])) for row in rows]
+
+    start = time.perf_counter()
+    voice_recon.get_transcriber(backend, size)
+    load_seconds = time.perf_counter() - start
+
+    audio_seconds = inference_seconds = 0.0
+    errors = reference_words = 0
+    for row, audio in clips:
+        start = time.perf_counter()
+        text = voice_recon.run_transcription(audio, size=size, backend=backend)
+        inference_seconds += time.perf_counter() - start
+        audio_seconds += len(audio) / voice_recon.WHISPER_SAMPLE_RATE
+
+        reference = normalize_words(row["texto"])
+        errors += word_edit_distance(reference, normalize_words(text))
+        reference_words += len(reference)
+        print(f"[{backend}] {row['archivo']}: {text}")
+
+    results.put({
+        "backend": backend,
+        "size": size,
+        "clips": len(clips),
+        "load_s": load_seconds,
+        "rtf": inference_seconds / audio_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "wer": errors / reference_words,
+    })
+
+
+def record_set(data_dir, duration):
+    import soundfile as sf
+    import voice_recon
+
+    for row in load_manifest(data_dir):
+        input(f"\nLea en voz alta y presione Enter: «{row['texto']}»")
+        audio = voice_recon.record_audio(duration)
+        sf.write(str(Path(data_dir) / row["archivo"]), audio, voice_recon.WHISPER_SAMPLE_RATE)
+        print(f"Guardado {row['archivo']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de motores de transcripción")
+    parser.add_argument("--backends", nargs="+", default=["whisper", "faster-whisper"])
+    parser.add_argument("--size", default="base")
+    parser.add_argument("--data-dir", default=str(DATA_DIR))
+    parser.add_argument("--record", action="store_true", help="Grabar el set de audios con el micrófono")
+    parser.add_argument("--duration", type=float, default=6.0, help="Segundos por grabación con --record")
+    args = parser.parse_args()
+
+    if args.record:
+        record_set(args.data_dir, args.duration)
+        return
+
+    # A fresh process per backend keeps peak RSS from leaking between runs
+    context = multiprocessing.get_context("spawn")
+    summaries = []
+    for backend in args.backends:
+        results = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, args.size, args.data_dir, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"[{backend}] failed with exit code {process.exitcode}")
+            continue
+        summaries.append(results.get())
+
+    print(f"\n{'backend':<16}{'size':<8}{'load s':>8}{'RTF':>8}{'RSS MB':>9}{'WER':>8}")
+    for s in summaries:
+        print(
+            f"{s['backend']:<16}{s['size']:<8}{s['load_s']:>8.2f}{s['rtf']:>8.3f}"
+            f"{s['peak_rss_mb']:>9.0f}{s['wer']:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
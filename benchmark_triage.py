@@ -0,0 +1,174 @@
+"""
+Throughput of triage scoring: the previous per-call predict_triage, the
+compiled predict_triage, and predict_triage_batch over the same records.
+
+    python benchmark_triage.py --records 20000
+"""
+import argparse
+import random
+import time
+
+import triage_metrics
+from benchmark_nlp import SAMPLE_NOTES
+from model import predict_triage, predict_triage_batch
+from nlp_processor import process_text_to_keywords
+from triage_rules import get_rules
+
+
+def legacy_predict_triage(datos_paciente):
+    """Baseline: the per-call implementation that rebuilt the symptom lists on every call"""
+    # Definir niveles de gravedad de síntomas
+    sintomas_criticos = [
+        "Dificultad para respirar", "respirar", "respiración",
+        "Dolor en el pecho", "pecho", "torax",
+        "Pérdida de consciencia", "desmayo", "inconsciente"
+    ]
+    
+    sintomas_urgentes = [
+        "Dolor abdominal", "abdomen", "estómago",
+        "Fiebre", "temperatura", "calor",
+        "Taquicardia", "corazón", "palpitaciones",
+        "Baja saturación", "oxígeno"
+    ]
+    
+    sintomas_no_urgentes = [
+        "Dolor muscular", "músculo", "dolor",
+        "Mareos", "mareo", "vértigo",
+        "Náuseas", "nausea", "vómito",
+        "Diarrea", "deposición"
+    ]
+
+    # Contadores para cada nivel
+    conteo_critico = 0
+    conteo_urgente = 0
+    conteo_no_urgente = 0
+    keywords_encontradas = []
+
+    # Procesar notas si existen
+    if 'observaciones' in datos_paciente and datos_paciente['observaciones']:
+        keywords = process_text_to_keywords(datos_paciente['observaciones'])
+        
+        # Analizar keywords encontradas
+        for keyword in keywords:
+            if keyword in sintomas_criticos:
+                conteo_critico += 1
+                keywords_encontradas.append(f"🔴 {keyword}")
+            elif keyword in sintomas_urgentes:
+                conteo_urgente += 1
+                keywords_encontradas.append(f"🟡 {keyword}")
+            elif keyword in sintomas_no_urgentes:
+                conteo_no_urgente += 1
+                keywords_encontradas.append(f"🟢 {keyword}")
+
+    # Analizar síntomas presentes
+    sintomas = datos_paciente.get('sintomas', [])
+    for sintoma in sintomas:
+        if sintoma in sintomas_criticos:
+            conteo_critico += 1
+        elif sintoma in sintomas_urgentes:
+            conteo_urgente += 1
+        elif sintoma in sintomas_no_urgentes:
+            conteo_no_urgente += 1
+
+    # Analizar signos vitales si están presentes
+    if 'temperatura' in datos_paciente:
+        temp = float(datos_paciente['temperatura'])
+        if temp >= 39.0:
+            conteo_urgente += 1
+        elif temp >= 37.5:
+            conteo_no_urgente += 1
+
+    if 'saturacion_oxigeno' in datos_paciente:
+        sat_o2 = float(datos_paciente['saturacion_oxigeno'])
+        if sat_o2 < 90:
+            conteo_critico += 1
+        elif sat_o2 < 95:
+            conteo_urgente += 1
+
+    if 'frecuencia_cardiaca' in datos_paciente:
+        fc = float(datos_paciente['frecuencia_cardiaca'])
+        if fc > 120 or fc < 50:
+            conteo_urgente += 1
+        elif fc > 100 or fc < 60:
+            conteo_no_urgente += 1
+
+    # Lógica de decisión
+    if conteo_critico > 0:
+        nivel = "NIVEL 1 - ATENCIÓN INMEDIATA"
+    elif conteo_urgente >= 2 or (conteo_urgente == 1 and conteo_no_urgente >= 2):
+        nivel = "NIVEL 2 - ATENCIÓN PRIORITARIA"
+    elif conteo_urgente == 1 or conteo_no_urgente >= 2:
+        nivel = "NIVEL 3 - ATENCIÓN PREFERENTE"
+    else:
+        nivel = "NIVEL 4 - ATENCIÓN NORMAL"
+
+    return {
+        'nivel': nivel,
+        'keywords': keywords_encontradas if keywords_encontradas else None,
+        'conteos': {
+            'critico': conteo_critico,
+            'urgente': conteo_urgente,
+            'no_urgente': conteo_no_urgente
+        }
+    }
+
+
+def random_records(n, seed=0):
+    """Records shaped like the kiosk and nursing forms, with some fields missing"""
+    rng = random.Random(seed)
+    sintomas = list(get_rules().categorias) + ["Cabeza", "Espalda", "Extremidades"]
+    records = []
+    for _ in range(n):
+        record = {}
+        if rng.random() < 0.8:
+            record["temperatura"] = round(rng.uniform(35.5, 41.0), 1)
+        if rng.random() < 0.8:
+            record["saturacion_oxigeno"] = rng.randint(82, 100)
+        if rng.random() < 0.8:
+            record["frecuencia_cardiaca"] = rng.randint(45, 150)
+        if rng.random() < 0.6:
+            record["observaciones"] = rng.choice(SAMPLE_NOTES)
+        record["sintomas"] = rng.sample(sintomas, rng.randint(0, 3))
+        records.append(record)
+    return records
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de triaje")
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    records = random_records(args.records)
+    columnas = {
+        campo: [r.get(campo) for r in records]
+        for campo in ("temperatura", "saturacion_oxigeno", "frecuencia_cardiaca", "observaciones", "sintomas")
+    }
+
+    legacy, legacy_s = timed(lambda: [legacy_predict_triage(r)["nivel"] for r in records])
+    single, single_s = timed(lambda: [predict_triage(r)["nivel"] for r in records])
+    batch, batch_s = timed(lambda: predict_triage_batch(records))
+    columnar, columnar_s = timed(lambda: predict_triage_batch(**columnas))
+    triage_metrics.enable()
+    traced, traced_s = timed(lambda: [predict_triage(r)["nivel"] for r in records])
+    triage_metrics.disable()
+    assert legacy == single == batch["niveles"] == columnar["niveles"] == traced, "los niveles no coinciden"
+
+    for name, seconds in (
+        ("legacy predict_triage", legacy_s),
+        ("predict_triage", single_s),
+        ("batch (dicts)", batch_s),
+        ("batch (columnas)", columnar_s),
+        ("predict_triage + métricas", traced_s),
+    ):
+        print(f"{name:<28}{args.records / seconds:>12,.0f} registros/s  ({legacy_s / seconds:.1f}x)")
+    print(f"\n{batch['por_nivel']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import json
+from pathlib import Path
+
+from db_utils import DEFAULT_BATCH_SIZE, bulk_insert_patients, bulk_insert_triage_records
+from patient_log import iter_segment_records
+
+
+def iter_json_dumps(data_dir):
+    """Yield the dicts stored by utils.save_patient_data in data_dir
+
+    Reads the patient log segments first, then any legacy *.json files not yet migrated.
+    """
+    yield from iter_segment_records(data_dir)
+    for path in sorted(Path(data_dir).glob("*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                yield json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping unreadable file {path}: {str(e)}")
+
+
+def patient_row(datos_paciente):
+    """Map a saved registration to a patients row"""
+    return {
+        "dni": datos_paciente["dni"],
+        "nombre": datos_paciente["nombre"],
+        "fecha_nacimiento": datos_paciente.get("fecha_nacimiento") or None,
+        "telefono": datos_paciente.get("telefono") or None,
+        "direccion": datos_paciente.get("direccion") or None,
+        "genero": datos_paciente.get("genero"),
+        "grupo_sanguineo": datos_paciente.get("grupo_sanguineo"),
+        "cuit": datos_paciente.get("cuit"),
+        "nacionalidad": datos_paciente.get("nacionalidad"),
+    }
+
+
+def triage_row(datos_paciente):
+    """Map a saved registration to a triage_records row"""
+    nivel = datos_paciente.get("nivel_triage")
+    version_reglas = None
+    if isinstance(nivel, dict):
+        version_reglas = nivel.get("version_reglas")
+        nivel = nivel.get("nivel")
+
+    return {
+        "dni": datos_paciente["dni"],
+        "nivel_triage": nivel,
+        "sintomas": datos_paciente.get("sintomas", []),
+        "notas": datos_paciente.get("descripcion") or datos_paciente.get("observaciones"),
+        "temperatura": datos_paciente.get("temperatura"),
+        "frecuencia_cardiaca": datos_paciente.get("frecuencia_cardiaca"),
+        "saturacion_oxigeno": datos_paciente.get("saturacion_oxigeno"),
+        "presion_arterial": datos_paciente.get("presion_arterial"),
+        "verificado_por": datos_paciente.get("verificado_por"),
+        "fecha_triage": datos_paciente.get("fecha_registro"),
+        "version_reglas": version_reglas,
+    }
+
+
+def ingest_directory(data_dir, batch_size=DEFAULT_BATCH_SIZE, update_existing=False):
+    """
+    Load every JSON dump in data_dir into patients and triage_records
+
+    Files are streamed twice (patients first, then triage records) so memory
+    stays bounded regardless of how many dumps the directory holds. Safe to
+    re-run on the same directory: existing patients and triage records are skipped.
+    """
+    patients = (
+        patient_row(d) for d in iter_json_dumps(data_dir) if d.get("dni") and d.get("nombre")
+    )
+    patient_stats = bulk_insert_patients(patients, batch_size, update_existing)
+
+    records = (
+        triage_row(d) for d in iter_json_dumps(data_dir) if d.get("dni") and d.get("nivel_triage")
+    )
+    triage_stats = bulk_insert_triage_records(records, batch_size)
+
+    return {"patients": patient_stats, "triage_records": triage_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Carga masiva de los registros de datos_pacientes/ en PostgreSQL"
+    )
+    parser.add_argument("data_dir", nargs="?", default="datos_pacientes")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "--update-existing",
+        action="store_true",
+        help="Actualizar pacientes ya existentes en lugar de omitirlos",
+    )
+    args = parser.parse_args()
+
+    stats = ingest_directory(args.data_dir, args.batch_size, args.update_existing)
+    for table, table_stats in stats.items():
+        print(
+            f"{table}: {table_stats['rows']} filas en {table_stats['batches']} lotes, "
+            f"{table_stats['skipped']} omitidas (ya cargadas o sin paciente), "
+            f"{table_stats['seconds']:.2f}s ({table_stats['rows_per_second']:.0f} filas/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout"""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are handed out LIFO so the warmest connection is reused first.
+    On checkout a connection is discarded and replaced if it was closed by the
+    server, and pinged with ``SELECT 1`` if it sat idle longer than
+    ``ping_after`` seconds. When all ``maxconn`` connections are in use,
+    callers wait up to ``timeout`` seconds instead of failing immediately.
+
+    Args:
+        connect: Callable that returns a new psycopg2 connection
+        minconn (int): Connections opened up front and kept open
+        maxconn (int): Upper bound on open connections
+        timeout (float): Seconds to wait for a free connection
+        ping_after (float): Idle seconds after which a checkout is health-checked
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30.0, ping_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = deque()  # (connection, returned_at)
+        self._size = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._reconnects = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._size += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds for one"""
+        if self._closed:
+            raise PoolTimeout("Connection pool is closed")
+
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        waited = time.perf_counter() - start
+
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn = self._open()
+                    break
+                conn, returned_at = entry
+                if self._is_healthy(conn, time.monotonic() - returned_at):
+                    break
+                print("Discarding broken database connection")  # Debug log
+                self._discard(conn)
+                with self._lock:
+                    self._reconnects += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a borrowed connection; broken ones are closed instead of reused"""
+        try:
+            if not discard and not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        discard = True
+
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that borrows a connection and always returns it"""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "checkouts": self._checkouts,
+                "reconnects": self._reconnects,
+                "timeouts": self._timeouts,
+                "wait_total_s": self._wait_total,
+                "wait_avg_s": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "wait_max_s": self._wait_max,
+            }
+
+    def closeall(self):
+        """Close every idle connection and refuse new checkouts"""
+        self._closed = True
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
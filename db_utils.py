@@ -1,6 +1,16 @@
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 import streamlit as st
+import time
+import datetime
+import json
+import uuid
+from contextlib import contextmanager
+from itertools import islice
+
+from db_pool import ConnectionPool, PoolTimeout
+from lookup_cache import TTLCache
+from outbox import Outbox, SyncUnavailable
 
 def get_db_connection():
     """Create a database connection using streamlit secrets"""
@@ -19,9 +29,121 @@ def get_db_connection():
         print(f"Database connection error: {str(e)}")  # Debug log
         raise e
 
-def create_patient_entry(patient_data):
-    """Create a new patient entry in the database"""
-    print(f"Starting create_patient_entry with data: {patient_data}")  # Debug log
+@st.cache_resource
+def get_db_pool():
+    """Connection pool shared by every session of this Streamlit server process"""
+    return ConnectionPool(
+        get_db_connection,
+        minconn=int(st.secrets.get("DB_POOL_MIN", 1)),
+        maxconn=int(st.secrets.get("DB_POOL_MAX", 10)),
+        timeout=float(st.secrets.get("DB_POOL_TIMEOUT", 30)),
+    )
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection for the duration of a with-block"""
+    with get_db_pool().connection() as conn:
+        yield conn
+
+def get_pool_stats():
+    """Return checkout, wait time and size counters of the connection pool"""
+    return get_db_pool().stats()
+
+@st.cache_resource
+def get_lookup_cache():
+    """Patient/triage lookup cache shared by every session of this server process"""
+    return TTLCache(
+        maxsize=int(st.secrets.get("LOOKUP_CACHE_SIZE", 1024)),
+        ttl=float(st.secrets.get("LOOKUP_CACHE_TTL", 30)),
+    )
+
+def invalidate_patient_cache(dni=None):
+    """Drop cached lookups for one DNI, or for every patient if dni is None"""
+    cache = get_lookup_cache()
+    if dni is None:
+        cache.clear()
+    else:
+        cache.invalidate(dni)
+
+def get_cache_stats():
+    """Return hit, miss and eviction counters of the lookup cache"""
+    return get_lookup_cache().stats()
+
+@contextmanager
+def autocommit(conn):
+    """
+    Run a single self-contained statement without BEGIN/COMMIT round trips.
+
+    psycopg2 opens a transaction with a separate BEGIN and needs an explicit
+    COMMIT, so a lone INSERT costs three round trips. In autocommit mode the
+    server commits the statement on its own and the write costs one.
+    """
+    previous = conn.autocommit
+    conn.autocommit = True
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            conn.autocommit = previous
+
+PATIENT_FIELDS = [
+    'dni',
+    'nombre',
+    'fecha_nacimiento',
+    'telefono',
+    'direccion',
+    'genero',
+    'grupo_sanguineo',
+    'cuit',
+    'nacionalidad',
+]
+
+UPSERT_PATIENT_SQL = """
+    INSERT INTO patients (
+        dni, 
+        nombre, 
+        fecha_nacimiento, 
+        telefono, 
+        direccion, 
+        genero, 
+        grupo_sanguineo, 
+        cuit,
+        nacionalidad
+    ) VALUES (
+        %(dni)s, 
+        %(nombre)s, 
+        %(fecha_nacimiento)s, 
+        %(telefono)s, 
+        %(direccion)s, 
+        %(genero)s, 
+        %(grupo_sanguineo)s, 
+        %(cuit)s,
+        %(nacionalidad)s
+    )
+    ON CONFLICT (dni) DO UPDATE SET
+        nombre = EXCLUDED.nombre,
+        fecha_nacimiento = COALESCE(EXCLUDED.fecha_nacimiento, patients.fecha_nacimiento),
+        telefono = COALESCE(EXCLUDED.telefono, patients.telefono),
+        direccion = COALESCE(EXCLUDED.direccion, patients.direccion),
+        genero = COALESCE(EXCLUDED.genero, patients.genero),
+        grupo_sanguineo = COALESCE(EXCLUDED.grupo_sanguineo, patients.grupo_sanguineo),
+        cuit = COALESCE(EXCLUDED.cuit, patients.cuit),
+        nacionalidad = COALESCE(EXCLUDED.nacionalidad, patients.nacionalidad),
+        ultima_actualizacion = CURRENT_TIMESTAMP
+    RETURNING *, (xmax = 0) AS inserted;
+"""
+
+def upsert_patient(patient_data):
+    """
+    Insert a patient or refresh the existing row with the same DNI in one round trip
+    
+    Args:
+        patient_data (dict): Patient fields; 'dni', 'nombre' and 'fecha_nacimiento' are required
+        
+    Returns:
+        tuple: (patient dict, True if the row was created or False if it already existed)
+    """
+    print(f"Starting upsert_patient with data: {patient_data}")  # Debug log
     
     # Ensure all required fields are present
     required_fields = ['dni', 'nombre', 'fecha_nacimiento']
@@ -29,75 +151,35 @@ def create_patient_entry(patient_data):
         if field not in patient_data:
             raise ValueError(f"Missing required field: {field}")
     
-    conn = None
-    try:
-        conn = get_db_connection()
-        print("Got database connection")  # Debug log
-        
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            # Prepare the SQL query
-            sql = """
-                INSERT INTO patients (
-                    dni, 
-                    nombre, 
-                    fecha_nacimiento, 
-                    telefono, 
-                    direccion, 
-                    genero, 
-                    grupo_sanguineo, 
-                    cuit
-                ) VALUES (
-                    %(dni)s, 
-                    %(nombre)s, 
-                    %(fecha_nacimiento)s, 
-                    %(telefono)s, 
-                    %(direccion)s, 
-                    %(genero)s, 
-                    %(grupo_sanguineo)s, 
-                    %(cuit)s
-                ) RETURNING *;
-            """
-            
-            print(f"About to execute SQL with data: {patient_data}")  # Debug log
-            print(f"SQL Query: {cur.mogrify(sql, patient_data)}")  # Debug log
-            
-            cur.execute(sql, patient_data)
-            print("SQL executed successfully")  # Debug log
-            
-            new_patient = cur.fetchone()
-            print(f"Fetched result: {new_patient}")  # Debug log
-            
-            if new_patient:
-                print("Committing transaction...")  # Debug log
-                conn.commit()
-                print("Transaction committed successfully")  # Debug log
+    params = {field: patient_data.get(field) for field in PATIENT_FIELDS}
+    
+    with db_connection() as conn:
+        try:
+            with autocommit(conn), conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(UPSERT_PATIENT_SQL, params)
+                row = cur.fetchone()
                 
-                # Convert to dictionary
-                columns = [desc[0] for desc in cur.description]
-                patient_dict = dict(zip(columns, new_patient))
-                return patient_dict
-            else:
-                print("No data returned from insert")  # Debug log
-                return None
+                if not row:
+                    print("No data returned from upsert")  # Debug log
+                    return None, False
                 
-    except Exception as e:
-        print(f"Error in create_patient_entry: {str(e)}")  # Debug log
-        if conn:
-            print("Rolling back transaction...")  # Debug log
-            conn.rollback()
-        raise e
-    finally:
-        if conn:
-            print("Closing database connection...")  # Debug log
-            conn.close()
-            print("Database connection closed")  # Debug log
+                patient_dict = dict(row)
+                created = patient_dict.pop('inserted')
+                invalidate_patient_cache(patient_dict['dni'])
+                print(f"Patient {'created' if created else 'updated'}: {patient_dict}")  # Debug log
+                return patient_dict, created
+                
+        except Exception as e:
+            print(f"Error in upsert_patient: {str(e)}")  # Debug log
+            raise e
 
-def check_hospital_db(dni):
-    """Check if a patient exists in the hospital database"""
-    print(f"Checking hospital DB for DNI: {dni}")  # Debug log
-    
-    try:
-        conn = get_db_connection()
+def create_patient_entry(patient_data):
+    """Create a new patient entry in the database (or refresh it if the DNI already exists)"""
+    new_patient, _ = upsert_patient(patient_data)
+    return new_patient
+
+def _fetch_patient(dni):
+    with db_connection() as conn:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("SELECT * FROM patients WHERE dni = %s", (dni,))
             result = cur.fetchone()
@@ -109,13 +191,39 @@ def check_hospital_db(dni):
             else:
                 print("Patient not found in hospital DB")  # Debug log
                 return None
+
+def find_patient(dni):
+    """
+    Look up a patient like check_hospital_db, but let database errors propagate
+    
+    Returns:
+        dict: The patient, or None only when the DNI really is not registered
+    """
+    local = _local_patient(dni)
+    if local:
+        return local
+    
+    # "Not found" is cached too; writes for this DNI invalidate it
+    patient = get_lookup_cache().get_or_load(
+        ('patient', dni), lambda: _fetch_patient(dni), tag=dni
+    )
+    return dict(patient) if patient else None
+
+def check_hospital_db(dni):
+    """Check if a patient exists in the hospital database (served from the lookup cache when fresh)
+    
+    A registration still waiting in the local outbox is returned first, so a
+    patient registered at this totem is found before it reaches the server.
+    Database errors are logged and reported as None.
+    """
+    print(f"Checking hospital DB for DNI: {dni}")  # Debug log
+    
+    try:
+        return find_patient(dni)
                 
     except Exception as e:
         print(f"Error in check_hospital_db: {str(e)}")  # Debug log
         return None
-    finally:
-        if conn:
-            conn.close()
 
 def update_patient_record(patient_id, update_data):
     """
@@ -125,7 +233,7 @@ def update_patient_record(patient_id, update_data):
         patient_id: DNI or unique identifier of the patient
         update_data: Dictionary containing the fields to update
     """
-    with get_db_connection() as conn:
+    with db_connection() as conn:
         with conn.cursor() as cur:
             # Build the SQL update statement dynamically based on the provided fields
             update_fields = [f"{key} = %({key})s" for key in update_data.keys()]
@@ -139,98 +247,679 @@ def update_patient_record(patient_id, update_data):
             execution_data = {**update_data, 'patient_id': patient_id}
             
             cur.execute(sql, execution_data)
-            conn.commit() 
+            conn.commit()
+    
+    invalidate_patient_cache(patient_id)
 
 def create_triage_record(patient_dni, triage_data):
-    """Create a new triage record for a patient"""
+    """Create a new triage record for a patient, resolving the patient id in the same statement"""
+    # Insert triage record, looking up patient_id from dni inside the INSERT
+    sql = """
+        INSERT INTO triage_records (
+            patient_id,
+            presion_arterial,
+            temperatura,
+            frecuencia_cardiaca,
+            saturacion_oxigeno,
+            notas,
+            nivel_triage,
+            verificado_por,
+            sintomas,
+            version_reglas
+        )
+        SELECT
+            p.id,
+            %(presion_arterial)s,
+            %(temperatura)s,
+            %(frecuencia_cardiaca)s,
+            %(saturacion_oxigeno)s,
+            %(notas)s,
+            %(nivel_triage)s,
+            %(verificado_por)s,
+            %(sintomas)s,
+            %(version_reglas)s
+        FROM patients p
+        WHERE p.dni = %(dni)s
+        RETURNING *;
+    """
+    
+    # Convert symptoms to array if string or keep as is if already array
+    sintomas = triage_data.get('sintomas', [])
+    if isinstance(sintomas, str):
+        sintomas = [sintomas]
+    
+    # Prepare data for insertion
+    insert_data = {
+        'dni': patient_dni,
+        'presion_arterial': triage_data.get('presion_arterial'),
+        'temperatura': triage_data.get('temperatura'),
+        'frecuencia_cardiaca': triage_data.get('frecuencia_cardiaca'),
+        'saturacion_oxigeno': triage_data.get('saturacion_oxigeno'),
+        'notas': triage_data.get('notas'),
+        'nivel_triage': triage_data.get('nivel_triage'),
+        'verificado_por': triage_data.get('verificado_por', 'Enfermería'),
+        'sintomas': sintomas,
+        'version_reglas': triage_data.get('version_reglas')
+    }
+    
+    with db_connection() as conn:
+        try:
+            with autocommit(conn), conn.cursor(cursor_factory=DictCursor) as cur:
+                print(f"Inserting triage record with data: {insert_data}")  # Debug log
+                
+                cur.execute(sql, insert_data)
+                new_record = cur.fetchone()
+                
+                if not new_record:
+                    raise ValueError(f"Patient with DNI {patient_dni} not found")
+                
+                invalidate_patient_cache(patient_dni)
+                return new_record
+                
+        except Exception as e:
+            print(f"Error creating triage record: {str(e)}")
+            raise e
+
+TRIAGE_RECORD_COLUMNS = [
+    'id',
+    'patient_id',
+    'nivel_triage',
+    'sintomas',
+    'presion_arterial',
+    'temperatura',
+    'frecuencia_cardiaca',
+    'saturacion_oxigeno',
+    'notas',
+    'fecha_triage',
+    'verificado_por',
+    'version_reglas',
+]
+
+# Columns the nursing panel history actually renders
+TRIAGE_HISTORY_COLUMNS = [
+    'id',
+    'fecha_triage',
+    'nivel_triage',
+    'presion_arterial',
+    'temperatura',
+    'frecuencia_cardiaca',
+    'saturacion_oxigeno',
+]
+
+TRIAGE_PAGE_SIZE = 10
+
+# Stand-in id of records still in the local outbox, so they sort (and page) after every server
+# record with the same fecha_triage; the largest SERIAL value
+PENDING_TRIAGE_ID = 2 ** 31 - 1
+
+def _triage_sort_key(record):
+    return (record['fecha_triage'], PENDING_TRIAGE_ID if record['id'] is None else record['id'])
+
+def get_triage_records(patient_dni, limit=None, before=None, columns=None):
+    """
+    Get triage records for a patient, newest first
+    
+    Pagination is keyset-based on (fecha_triage, id), which the
+    idx_triage_patient_fecha index serves as a single range scan.
+    
+    Args:
+        patient_dni (str): DNI of the patient
+        limit (int): Maximum number of records to return (None for all)
+        before (tuple): (fecha_triage, id) of the last record already shown;
+                        only older records are returned
+        columns (list): Columns to select (defaults to every column);
+                        'fecha_triage' and 'id' are always included
+        
+    Returns:
+        list: DictRow records
+    """
+    columns = list(columns or TRIAGE_RECORD_COLUMNS)
+    unknown = set(columns) - set(TRIAGE_RECORD_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown triage_records columns: {sorted(unknown)}")
+    for key in ('id', 'fecha_triage'):
+        if key not in columns:
+            columns.append(key)
+    
+    sql = f"""
+        SELECT {', '.join(f'tr.{column}' for column in columns)}
+        FROM triage_records tr
+        WHERE tr.patient_id = (SELECT id FROM patients WHERE dni = %(dni)s)
+    """
+    params = {'dni': patient_dni}
+    if before is not None:
+        sql += " AND (tr.fecha_triage, tr.id) < (%(before_fecha)s, %(before_id)s)"
+        params['before_fecha'], params['before_id'] = before
+    sql += " ORDER BY tr.fecha_triage DESC, tr.id DESC"
+    if limit is not None:
+        sql += " LIMIT %(limit)s"
+        params['limit'] = limit
+    
+    def fetch():
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+    
     try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            # First get patient_id from dni
-            cur.execute("SELECT id FROM patients WHERE dni = %s", (patient_dni,))
-            patient = cur.fetchone()
-            
-            if not patient:
-                raise ValueError(f"Patient with DNI {patient_dni} not found")
-            
-            # Insert triage record
-            sql = """
-                INSERT INTO triage_records (
-                    patient_id,
-                    presion_arterial,
-                    temperatura,
-                    frecuencia_cardiaca,
-                    saturacion_oxigeno,
-                    notas,
-                    nivel_triage,
-                    verificado_por,
-                    sintomas
-                ) VALUES (
-                    %(patient_id)s,
-                    %(presion_arterial)s,
-                    %(temperatura)s,
-                    %(frecuencia_cardiaca)s,
-                    %(saturacion_oxigeno)s,
-                    %(notas)s,
-                    %(nivel_triage)s,
-                    %(verificado_por)s,
-                    %(sintomas)s
-                ) RETURNING *;
-            """
-            
-            # Convert symptoms to array if string or keep as is if already array
-            sintomas = triage_data.get('sintomas', [])
-            if isinstance(sintomas, str):
-                sintomas = [sintomas]
-            
-            # Prepare data for insertion
-            insert_data = {
-                'patient_id': patient['id'],
-                'presion_arterial': triage_data.get('presion_arterial'),
-                'temperatura': triage_data.get('temperatura'),
-                'frecuencia_cardiaca': triage_data.get('frecuencia_cardiaca'),
-                'saturacion_oxigeno': triage_data.get('saturacion_oxigeno'),
-                'notas': triage_data.get('notas'),
-                'nivel_triage': triage_data.get('nivel_triage'),
-                'verificado_por': triage_data.get('verificado_por', 'Enfermería'),
-                'sintomas': sintomas
-            }
-            
-            print(f"Inserting triage record with data: {insert_data}")  # Debug log
-            
-            cur.execute(sql, insert_data)
-            new_record = cur.fetchone()
-            conn.commit()
-            
-            return new_record
-            
+        key = ('triage', patient_dni, limit, before, tuple(columns))
+        records = get_lookup_cache().get_or_load(key, fetch, tag=patient_dni)
+        # Records still in the local outbox go wherever their fecha_triage puts them,
+        # so the limit and the next page's cursor cover both sources
+        pending = _pending_triage_records(patient_dni, columns)
+        if before is not None:
+            pending = [record for record in pending if _triage_sort_key(record) < tuple(before)]
+        if pending:
+            records = sorted(pending + list(records), key=_triage_sort_key, reverse=True)
+            if limit is not None:
+                records = records[:limit]
+        return list(records)
     except Exception as e:
-        print(f"Error creating triage record: {str(e)}")
-        if conn:
-            conn.rollback()
+        print(f"Error fetching triage records: {str(e)}")
         raise e
+
+def triage_page_cursor(records):
+    """Keyset cursor to pass as ``before`` to fetch the page after ``records``"""
+    if not records:
+        return None
+    return _triage_sort_key(records[-1])
+
+DEFAULT_BATCH_SIZE = 500
+
+def _batches(rows, batch_size):
+    """Yield lists of at most batch_size rows from any iterable without materializing it"""
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def _run_batched(label, sql, template, rows, batch_size, prepare=None):
+    """
+    Execute a multi-row VALUES statement per batch, committing once per batch
+    
+    Returns:
+        dict: rows written, rows skipped by the statement (ON CONFLICT DO NOTHING,
+              unmatched joins), batches, elapsed seconds and rows per second
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+    
+    total = 0
+    skipped = 0
+    batches = 0
+    start = time.perf_counter()
+    
+    with db_connection() as conn:
+        for batch in _batches(rows, batch_size):
+            if prepare:
+                batch = prepare(batch)
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, sql, batch, template=template, page_size=len(batch))
+                    written = cur.rowcount
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Error in {label} batch {batches + 1}: {str(e)}")  # Debug log
+                raise e
+            
+            total += written
+            skipped += len(batch) - written
+            batches += 1
+            # Bulk loads touch arbitrary DNIs, drop the whole lookup cache
+            invalidate_patient_cache()
+            elapsed = time.perf_counter() - start
+            print(f"{label}: batch {batches} committed, {total} rows ({total / elapsed:.0f} rows/s)")  # Debug log
+    
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': total,
+        'skipped': skipped,
+        'batches': batches,
+        'seconds': elapsed,
+        'rows_per_second': total / elapsed if elapsed > 0 else 0.0,
+    }
+
+def _dedupe_by_dni(batch):
+    """Keep the last row per DNI; ON CONFLICT cannot touch the same row twice in one statement"""
+    unique = {}
+    for row in batch:
+        unique[row['dni']] = {field: row.get(field) for field in PATIENT_FIELDS}
+    return list(unique.values())
+
+def bulk_insert_patients(rows, batch_size=DEFAULT_BATCH_SIZE, update_existing=False):
+    """
+    Stream patient rows into the patients table using multi-row INSERTs
+    
+    Args:
+        rows: Iterable of patient dicts (same fields as create_patient_entry)
+        batch_size (int): Rows per INSERT statement and per transaction
+        update_existing (bool): Refresh rows whose DNI already exists instead of skipping them
+        
+    Returns:
+        dict: rows written, batches, elapsed seconds and rows per second
+    """
+    sql = _bulk_patients_sql(update_existing)
+    template = "(" + ", ".join(f"%({field})s" for field in PATIENT_FIELDS) + ")"
+    return _run_batched("patients", sql, template, rows, batch_size, prepare=_dedupe_by_dni)
+
+def _bulk_patients_sql(update_existing):
+    """Multi-row patients INSERT; on a duplicate DNI either refresh the row or skip it"""
+    if update_existing:
+        conflict = """
+            DO UPDATE SET
+                nombre = EXCLUDED.nombre,
+                fecha_nacimiento = COALESCE(EXCLUDED.fecha_nacimiento, patients.fecha_nacimiento),
+                telefono = COALESCE(EXCLUDED.telefono, patients.telefono),
+                direccion = COALESCE(EXCLUDED.direccion, patients.direccion),
+                genero = COALESCE(EXCLUDED.genero, patients.genero),
+                grupo_sanguineo = COALESCE(EXCLUDED.grupo_sanguineo, patients.grupo_sanguineo),
+                cuit = COALESCE(EXCLUDED.cuit, patients.cuit),
+                nacionalidad = COALESCE(EXCLUDED.nacionalidad, patients.nacionalidad),
+                ultima_actualizacion = CURRENT_TIMESTAMP
+        """
+    else:
+        conflict = "DO NOTHING"
+    
+    return f"""
+        INSERT INTO patients ({', '.join(PATIENT_FIELDS)})
+        VALUES %s
+        ON CONFLICT (dni) {conflict};
+    """
+
+TRIAGE_FIELDS = [
+    'dni',
+    'presion_arterial',
+    'temperatura',
+    'frecuencia_cardiaca',
+    'saturacion_oxigeno',
+    'notas',
+    'nivel_triage',
+    'verificado_por',
+    'sintomas',
+    'fecha_triage',
+    'version_reglas',
+]
+
+def _prepare_triage_batch(batch):
+    prepared = []
+    for row in batch:
+        record = {field: row.get(field) for field in TRIAGE_FIELDS}
+        if isinstance(record['sintomas'], str):
+            record['sintomas'] = [record['sintomas']]
+        elif record['sintomas'] is None:
+            record['sintomas'] = []
+        prepared.append(record)
+    return prepared
+
+# Namespace of the idempotency keys derived for bulk-loaded triage records
+TRIAGE_KEY_NAMESPACE = uuid.UUID('5f0d3c1e-6b1a-4f7e-9a57-2d8c4e1b7a90')
+
+def triage_record_key(record):
+    """Deterministic clave_idempotencia of a triage record: the same source record always maps to the same key"""
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return str(uuid.uuid5(TRIAGE_KEY_NAMESPACE, payload))
+
+def _prepare_keyed_triage_batch(batch):
+    prepared = _prepare_triage_batch(batch)
+    for row, record in zip(batch, prepared):
+        record['clave_idempotencia'] = row.get('clave_idempotencia') or triage_record_key(record)
+    return prepared
+
+def bulk_insert_triage_records(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream triage records into triage_records, resolving patient ids by DNI per batch
+    
+    Rows whose DNI is not in patients are skipped, so load patients first.
+    Each row is keyed by its 'clave_idempotencia' or, by default, by
+    triage_record_key, so re-running a load (or resuming one that failed
+    partway) skips the records already inserted.
+    
+    Args:
+        rows: Iterable of dicts with 'dni' plus the create_triage_record fields
+              and an optional 'fecha_triage' (defaults to now)
+        batch_size (int): Rows per INSERT statement and per transaction
+        
+    Returns:
+        dict: rows written, rows skipped, batches, elapsed seconds and rows per second
+    """
+    # VALUES columns have no target type, so cast the ones that are not text
+    sql = """
+        INSERT INTO triage_records (
+            patient_id,
+            presion_arterial,
+            temperatura,
+            frecuencia_cardiaca,
+            saturacion_oxigeno,
+            notas,
+            nivel_triage,
+            verificado_por,
+            sintomas,
+            fecha_triage,
+            version_reglas,
+            clave_idempotencia
+        )
+        SELECT
+            p.id,
+            v.presion_arterial,
+            v.temperatura,
+            v.frecuencia_cardiaca,
+            v.saturacion_oxigeno,
+            v.notas,
+            v.nivel_triage,
+            v.verificado_por,
+            v.sintomas,
+            COALESCE(v.fecha_triage, CURRENT_TIMESTAMP),
+            v.version_reglas,
+            v.clave_idempotencia
+        FROM (VALUES %s) AS v (
+            dni,
+            presion_arterial,
+            temperatura,
+            frecuencia_cardiaca,
+            saturacion_oxigeno,
+            notas,
+            nivel_triage,
+            verificado_por,
+            sintomas,
+            fecha_triage,
+            version_reglas,
+            clave_idempotencia
+        )
+        JOIN patients p ON p.dni = v.dni
+        ON CONFLICT (clave_idempotencia) DO NOTHING;
+    """
+    template = """(
+        %(dni)s,
+        %(presion_arterial)s,
+        %(temperatura)s::numeric,
+        %(frecuencia_cardiaca)s::integer,
+        %(saturacion_oxigeno)s::integer,
+        %(notas)s,
+        %(nivel_triage)s,
+        %(verificado_por)s,
+        %(sintomas)s::text[],
+        %(fecha_triage)s::timestamp,
+        %(version_reglas)s,
+        %(clave_idempotencia)s
+    )"""
+    return _run_batched("triage_records", sql, template, rows, batch_size, prepare=_prepare_keyed_triage_batch)
+
+def iter_triage_record_chunks(columns, chunk_size=5000, since=None, until=None):
+    """
+    Stream triage_records in chunks through a server-side (named) cursor
+
+    Only ``chunk_size`` rows are held on the client at a time, so a whole
+    table can be scanned without loading it into memory. Uses its own
+    connection, outside the pool, since a scan can take minutes.
+
+    Args:
+        columns (list): Columns to select (see TRIAGE_RECORD_COLUMNS)
+        chunk_size (int): Rows fetched per round trip
+        since, until: Optional fecha_triage bounds (inclusive, exclusive)
+
+    Yields:
+        list: Tuples of the selected columns, ordered by id
+    """
+    unknown = set(columns) - set(TRIAGE_RECORD_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown triage_records columns: {sorted(unknown)}")
+
+    sql = f"SELECT {', '.join(columns)} FROM triage_records WHERE TRUE"
+    params = {}
+    if since is not None:
+        sql += " AND fecha_triage >= %(since)s"
+        params['since'] = since
+    if until is not None:
+        sql += " AND fecha_triage < %(until)s"
+        params['until'] = until
+    sql += " ORDER BY id"
+
+    conn = get_db_connection()
+    try:
+        # Named cursors live inside a transaction; keep it read-only
+        conn.set_session(readonly=True)
+        with conn.cursor(name='triage_records_scan') as cur:
+            cur.itersize = chunk_size
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        conn.rollback()
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+
+# Offline-first writes: the totem commits to a local SQLite outbox and a
+# background thread forwards the entries to PostgreSQL (see outbox.py)
 
-def get_triage_records(patient_dni):
-    """Get all triage records for a patient"""
+SYNC_TRIAGE_SQL = """
+    INSERT INTO triage_records (
+        patient_id,
+        presion_arterial,
+        temperatura,
+        frecuencia_cardiaca,
+        saturacion_oxigeno,
+        notas,
+        nivel_triage,
+        verificado_por,
+        sintomas,
+        fecha_triage,
+        version_reglas,
+        clave_idempotencia
+    )
+    SELECT
+        p.id,
+        v.presion_arterial,
+        v.temperatura,
+        v.frecuencia_cardiaca,
+        v.saturacion_oxigeno,
+        v.notas,
+        v.nivel_triage,
+        v.verificado_por,
+        v.sintomas,
+        v.fecha_triage,
+        v.version_reglas,
+        v.clave_idempotencia
+    FROM (VALUES %s) AS v (
+        dni,
+        presion_arterial,
+        temperatura,
+        frecuencia_cardiaca,
+        saturacion_oxigeno,
+        notas,
+        nivel_triage,
+        verificado_por,
+        sintomas,
+        fecha_triage,
+        version_reglas,
+        clave_idempotencia
+    )
+    JOIN patients p ON p.dni = v.dni
+    ON CONFLICT (clave_idempotencia) DO NOTHING;
+"""
+
+SYNC_TRIAGE_TEMPLATE = """(
+    %(dni)s,
+    %(presion_arterial)s,
+    %(temperatura)s::numeric,
+    %(frecuencia_cardiaca)s::integer,
+    %(saturacion_oxigeno)s::integer,
+    %(notas)s,
+    %(nivel_triage)s,
+    %(verificado_por)s,
+    %(sintomas)s::text[],
+    %(fecha_triage)s::timestamp,
+    %(version_reglas)s,
+    %(clave_idempotencia)s
+)"""
+
+def sync_outbox_batch(entries):
+    """
+    Apply a batch of outbox entries to PostgreSQL in one transaction
+    
+    Patients are upserted first so triage records of patients registered in
+    the same batch find their patient_id. Triage records are keyed by their
+    idempotency key, so re-sending a batch that was already committed is a no-op.
+    
+    Raises:
+        SyncUnavailable: The database cannot be reached
+        ValueError: Some triage record has no patient with its DNI
+    """
+    patients = [entry['datos'] for entry in entries if entry['tipo'] == 'paciente']
+    triage_rows = []
+    for entry in entries:
+        if entry['tipo'] == 'triaje':
+            row = _prepare_triage_batch([{**entry['datos'], 'dni': entry['dni']}])[0]
+            row['clave_idempotencia'] = entry['clave']
+            triage_rows.append(row)
+    
     try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            sql = """
-                SELECT tr.* 
-                FROM triage_records tr
-                JOIN patients p ON p.id = tr.patient_id
-                WHERE p.dni = %s
-                ORDER BY tr.fecha_triage DESC;
-            """
-            cur.execute(sql, (patient_dni,))
-            records = cur.fetchall()
-            return records
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    if patients:
+                        rows = _dedupe_by_dni(patients)
+                        template = "(" + ", ".join(f"%({field})s" for field in PATIENT_FIELDS) + ")"
+                        execute_values(cur, _bulk_patients_sql(True), rows, template=template, page_size=len(rows))
+                    if triage_rows:
+                        execute_values(cur, SYNC_TRIAGE_SQL, triage_rows, template=SYNC_TRIAGE_TEMPLATE,
+                                       page_size=len(triage_rows))
+                        claves = [row['clave_idempotencia'] for row in triage_rows]
+                        cur.execute(
+                            "SELECT clave_idempotencia FROM triage_records WHERE clave_idempotencia = ANY(%s)",
+                            (claves,),
+                        )
+                        missing = set(claves) - {row[0] for row in cur.fetchall()}
+                        if missing:
+                            raise ValueError(f"{len(missing)} triage records have no registered patient")
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+    except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout) as e:
+        raise SyncUnavailable(str(e)) from e
+
+def _invalidate_synced(entries):
+    """Drop cached server reads of synced DNIs; runs once the outbox no longer lists the entries as pending"""
+    for dni in {entry['dni'] for entry in entries}:
+        invalidate_patient_cache(dni)
+
+@st.cache_resource
+def get_outbox():
+    """Local outbox of this totem, with its syncer thread running"""
+    return Outbox(
+        st.secrets.get("OUTBOX_PATH", "outbox.sqlite3"),
+        sync_outbox_batch,
+        batch_size=int(st.secrets.get("OUTBOX_BATCH_SIZE", 100)),
+        max_delay=float(st.secrets.get("OUTBOX_MAX_BACKOFF", 300)),
+        max_attempts=int(st.secrets.get("OUTBOX_MAX_ATTEMPTS", 10)),
+        on_synced=_invalidate_synced,
+    ).start()
+
+def get_outbox_stats():
+    """Pending entries, retries, dead letters and last sync of the local outbox"""
+    return get_outbox().stats()
+
+def get_outbox_dead_letters(limit=50):
+    """Outbox entries set aside after repeated data errors, newest first"""
+    return get_outbox().dead_letters(limit)
+
+def retry_outbox_dead_letters():
+    """Put every dead letter back in line; returns how many"""
+    return get_outbox().retry_dead_letters()
+
+def _local_patient(dni):
+    """Newest unsynced registration of a DNI over the cached server row, or None"""
+    try:
+        pending = get_outbox().pending(dni, tipo='paciente')
     except Exception as e:
-        print(f"Error fetching triage records: {str(e)}")
-        raise e
-    finally:
-        if conn:
-            conn.close() 
\ No newline at end of file
+        print(f"Error reading local outbox: {str(e)}")  # Debug log
+        return None
+    if not pending:
+        return None
+    
+    patient = dict(get_lookup_cache().get(('patient', dni)) or {})
+    for entry in reversed(pending):  # oldest first, so the newest values win
+        patient.update({key: value for key, value in entry['datos'].items() if value is not None})
+    patient['pendiente_sincronizacion'] = True
+    return patient
+
+def register_patient(patient_data):
+    """
+    Register or refresh a patient through the local outbox, without waiting for the server
+    
+    Whether the patient is new is decided like find_patient (outbox, cache,
+    then server); if the server cannot be reached it is unknown and the
+    registration is still queued.
+    
+    Args:
+        patient_data (dict): Same fields as upsert_patient
+        
+    Returns:
+        tuple: (patient dict, created) where created is True for a new patient,
+               False for an existing one and None when the server could not tell.
+               The dict has no 'id': the server assigns or confirms it on sync.
+    """
+    for field in ['dni', 'nombre', 'fecha_nacimiento']:
+        if field not in patient_data:
+            raise ValueError(f"Missing required field: {field}")
+    
+    dni = str(patient_data['dni'])
+    try:
+        known = find_patient(dni)
+        created = known is None
+    except Exception as e:
+        print(f"Could not check whether patient {dni} exists: {str(e)}")  # Debug log
+        known, created = None, None
+    datos = {field: patient_data.get(field) for field in PATIENT_FIELDS}
+    get_outbox().enqueue('paciente', dni, datos)
+    
+    patient = {**(known or {}), **{key: value for key, value in datos.items() if value is not None}}
+    patient.pop('id', None)
+    patient['pendiente_sincronizacion'] = True
+    print(f"Patient {dni} queued in the local outbox")  # Debug log
+    return patient, created
+
+def record_triage(patient_dni, triage_data):
+    """
+    Store a triage record through the local outbox, without waiting for the server
+    
+    fecha_triage is the time of this call, not of the later sync.
+    
+    Returns:
+        dict: The record as it will be inserted, with 'id' None until synced
+    """
+    fecha_triage = datetime.datetime.now()
+    datos = {field: triage_data.get(field) for field in TRIAGE_FIELDS if field != 'dni'}
+    datos['verificado_por'] = triage_data.get('verificado_por', 'Enfermería')
+    datos['fecha_triage'] = fecha_triage.isoformat(sep=' ')
+    entry = get_outbox().enqueue('triaje', patient_dni, datos)
+    print(f"Triage record for {patient_dni} queued in the local outbox")  # Debug log
+    return {
+        **datos,
+        'id': None,
+        'fecha_triage': fecha_triage,
+        'clave_idempotencia': entry['clave'],
+        'pendiente_sincronizacion': True,
+    }
+
+def _pending_triage_records(dni, columns):
+    try:
+        pending = get_outbox().pending(dni, tipo='triaje')
+    except Exception as e:
+        print(f"Error reading local outbox: {str(e)}")  # Debug log
+        return []
+    records = []
+    for entry in pending:
+        datos = {
+            **entry['datos'],
+            'id': None,
+            'fecha_triage': datetime.datetime.fromisoformat(entry['datos']['fecha_triage']),
+        }
+        records.append({column: datos.get(column) for column in columns})
+    return records
@@ -0,0 +1,228 @@
+"""
+Raw ESC/POS rendering of triage tickets for the totem's thermal printer.
+
+``render_escpos`` turns the same ``ticket_data`` dict used for the PDF into
+the byte stream a thermal printer understands: plain text, the triage level
+in bold double size, a CODE128 barcode of the DNI and a QR code of the
+ticket id. Bytes are delivered through a sink:
+
+    FileSink("/dev/usb/lp0")           # USB printer device node (production)
+    FileSink("tickets.bin", append=True)  # stand-in for tests
+    SocketSink("192.168.0.50", 9100)   # network printer (raw TCP / JetDirect)
+
+``print_ticket_async`` renders and sends on a job queue of its own
+(background_jobs.JobQueue), retrying device and network errors, so the
+Streamlit rerun that asks for the ticket returns immediately and an
+offline printer never delays the PDF or the archival jobs.
+"""
+import os
+import socket
+import textwrap
+import unicodedata
+
+import background_jobs
+
+ESC = b"\x1b"
+GS = b"\x1d"
+
+INIT = ESC + b"@"
+CODEPAGE_WPC1252 = ESC + b"t\x10"  # accents and ñ as cp1252
+BOLD_ON, BOLD_OFF = ESC + b"E\x01", ESC + b"E\x00"
+ALIGN_LEFT, ALIGN_CENTER = ESC + b"a\x00", ESC + b"a\x01"
+SIZE_NORMAL, SIZE_DOUBLE = GS + b"!\x00", GS + b"!\x11"
+CUT = GS + b"V\x42\x03"  # feed 3 lines and partial cut
+
+# Characters per line in font A: 48 on 80 mm paper, 32 on 58 mm paper
+DEFAULT_COLUMNS = int(os.environ.get("TICKET_PRINTER_COLUMNS", 48))
+
+
+def ticket_id(ticket_data):
+    """Identifier printed in the QR code: explicit 'ticket_id' or timestamp + DNI"""
+    if ticket_data.get("ticket_id"):
+        return str(ticket_data["ticket_id"])
+    return f"{ticket_data['timestamp'].strftime('%Y%m%d%H%M%S')}-{ticket_data['patient']['dni']}"
+
+
+def _fold(char):
+    """cp1252 bytes of one character: itself, its base letter (NFKD) or '?'"""
+    for candidate in (char, "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))):
+        try:
+            if candidate:
+                return candidate.encode("cp1252")
+        except UnicodeEncodeError:
+            pass
+    return b"?"
+
+
+def _text(value):
+    text = str(value)
+    try:
+        return text.encode("cp1252")
+    except UnicodeEncodeError:
+        out = b"".join(_fold(char) for char in text)
+        print(f"Ticket text outside cp1252, printed as {out.decode('cp1252')!r}: {text!r}")  # Debug log
+        return out
+
+
+def _line(value, columns):
+    return b"".join(_text(part) + b"\n" for part in textwrap.wrap(str(value), columns) or [""])
+
+
+def barcode_code128(data, height=80, module_width=2):
+    """GS k CODE128 (code set B) with the human-readable text below"""
+    payload = b"{B" + _text(data)
+    return (
+        GS + b"h" + bytes([height])
+        + GS + b"w" + bytes([module_width])
+        + GS + b"H\x02"
+        + GS + b"k\x49" + bytes([len(payload)]) + payload
+    )
+
+
+def qr_code(data, module_size=6):
+    """GS ( k QR code, model 2, error correction M"""
+    payload = _text(data)
+    store_length = len(payload) + 3
+    return (
+        GS + b"(k\x04\x00\x31\x41\x32\x00"                   # model 2
+        + GS + b"(k\x03\x00\x31\x43" + bytes([module_size])  # module size
+        + GS + b"(k\x03\x00\x31\x45\x31"                      # error correction M
+        + GS + b"(k" + bytes([store_length % 256, store_length // 256]) + b"\x31\x50\x30" + payload
+        + GS + b"(k\x03\x00\x31\x51\x30"                      # print
+    )
+
+
+def render_escpos(ticket_data, columns=DEFAULT_COLUMNS, barcode=True, qr=True):
+    """
+    Ticket as an ESC/POS byte stream
+
+    Args:
+        ticket_data (dict): Same dict as ticket_generator.generate_ticket
+        columns (int): Characters per printed line
+        barcode (bool): Print the DNI as a CODE128 barcode
+        qr (bool): Print the ticket id as a QR code
+
+    Returns:
+        bytes: Commands ready to send to the printer
+    """
+    patient = ticket_data["patient"]
+    sintomas = ", ".join(ticket_data["symptoms"]["sintomas"][:3])
+    diagnosis = ticket_data.get("diagnosis", "Pendiente de evaluación médica")
+
+    out = [INIT, CODEPAGE_WPC1252, ALIGN_CENTER, BOLD_ON, _line("TICKET DE ATENCIÓN", columns), BOLD_OFF]
+    out.append(_line(ticket_data["timestamp"].strftime("%Y-%m-%d %H:%M:%S"), columns))
+    out.append(b"-" * columns + b"\n")
+
+    # Triage level, the one thing the patient has to read from afar
+    out += [BOLD_ON, SIZE_DOUBLE, _line(ticket_data["triage_score"], columns // 2), SIZE_NORMAL, BOLD_OFF]
+    out.append(b"-" * columns + b"\n")
+
+    out.append(ALIGN_LEFT)
+    out.append(_line(f"Paciente: {patient['nombre']}", columns))
+    out.append(_line(f"DNI: {patient['dni']}", columns))
+    out.append(_line(f"Síntomas principales: {sintomas}", columns))
+    out.append(_line(f"Diagnóstico: {diagnosis}", columns))
+
+    out.append(ALIGN_CENTER + b"\n")
+    if barcode:
+        out.append(barcode_code128(patient["dni"]) + b"\n")
+    if qr:
+        out.append(qr_code(ticket_id(ticket_data)) + b"\n")
+    out.append(_line("Por favor, espere a ser llamado", columns))
+    out.append(CUT)
+    return b"".join(out)
+
+
+class FileSink:
+    """
+    Write tickets to a path: a printer device node (/dev/usb/lp0) or, with
+    append=True, a plain file that collects them for tests and debugging.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.mode = "ab" if append else "wb"
+
+    def send(self, data):
+        with open(self.path, self.mode) as f:
+            f.write(data)
+            f.flush()
+
+    def __repr__(self):
+        return f"FileSink({self.path!r})"
+
+
+class SocketSink:
+    """
+    Send tickets over raw TCP (port 9100 on network thermal printers)
+
+    An unreachable printer fails fast on connect_timeout; once connected,
+    the printer may take up to timeout to accept the data (paper feed, cut).
+    """
+
+    def __init__(self, host, port=9100, timeout=5.0, connect_timeout=1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+
+    def send(self, data):
+        with socket.create_connection((self.host, self.port), timeout=self.connect_timeout) as conn:
+            conn.settimeout(self.timeout)
+            conn.sendall(data)
+
+    def __repr__(self):
+        return f"SocketSink({self.host!r}, {self.port})"
+
+
+def sink_from_url(url):
+    """
+    Build a sink from a config string
+
+    'tcp://host:port' -> SocketSink, 'file://path' -> FileSink appending
+    (test stand-in), any other value is taken as a device path.
+    """
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://"):].partition(":")
+        return SocketSink(host, int(port or 9100))
+    if url.startswith("file://"):
+        return FileSink(url[len("file://"):], append=True)
+    return FileSink(url)
+
+
+def get_default_sink():
+    """Sink configured with TICKET_PRINTER, or None when the totem has no printer"""
+    url = os.environ.get("TICKET_PRINTER")
+    return sink_from_url(url) if url else None
+
+
+def print_ticket(ticket_data, sink=None):
+    """Render and send a ticket synchronously"""
+    sink = sink or get_default_sink()
+    if sink is None:
+        raise RuntimeError("No hay impresora configurada (TICKET_PRINTER)")
+    data = render_escpos(ticket_data)
+    sink.send(data)
+    print(f"Ticket {ticket_id(ticket_data)} sent to {sink!r} ({len(data)} bytes)")  # Debug log
+    return len(data)
+
+
+_print_queue = background_jobs.JobQueue(name="ticket-printer")
+
+
+def get_print_queue():
+    """Queue of the printer jobs, separate from background_jobs so printer retries wait only on each other"""
+    return _print_queue
+
+
+def print_ticket_async(ticket_data, sink=None, max_attempts=3):
+    """
+    Queue a ticket for the printer worker, which prints jobs in order.
+
+    OSError (printer offline, paper door open, device node busy) is retried
+    with backoff up to max_attempts times.
+
+    Returns:
+        background_jobs.Job: Polled like a Future; its result is the bytes sent
+    """
+    return _print_queue.submit("impresion_ticket", print_ticket, dict(ticket_data), sink, max_attempts=max_attempts)
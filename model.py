@@ -1,101 +1,323 @@
+import time
+
+import numpy as np
+
+import triage_metrics
 from nlp_processor import process_text_to_keywords
+from triage_rules import CATEGORIAS, get_rules
+
+# Las listas de síntomas por gravedad, los umbrales de signos vitales y el
+# vocabulario médico viven en reglas_triaje.json (ver triage_rules). Los
+# síntomas se comparan tal cual (con mayúsculas y acentos) contra los del
+# formulario y las palabras clave de las observaciones.
+MARCAS = {"critico": "🔴", "urgente": "🟡", "no_urgente": "🟢"}
+
+NIVELES = (
+    "NIVEL 1 - ATENCIÓN INMEDIATA",
+    "NIVEL 2 - ATENCIÓN PRIORITARIA",
+    "NIVEL 3 - ATENCIÓN PREFERENTE",
+    "NIVEL 4 - ATENCIÓN NORMAL",
+)
+
+SIGNOS_VITALES = ("temperatura", "saturacion_oxigeno", "frecuencia_cardiaca")
+
+
+def decidir_nivel(conteo_critico, conteo_urgente, conteo_no_urgente):
+    """Lógica de decisión: nivel de triaje a partir de los conteos"""
+    if conteo_critico > 0:
+        return NIVELES[0]
+    if conteo_urgente >= 2 or (conteo_urgente == 1 and conteo_no_urgente >= 2):
+        return NIVELES[1]
+    if conteo_urgente == 1 or conteo_no_urgente >= 2:
+        return NIVELES[2]
+    return NIVELES[3]
 
-def predict_triage(datos_paciente):
+
+def regla_decision(conteo_critico, conteo_urgente, conteo_no_urgente):
+    """Name of the decidir_nivel branch that applies, for traces"""
+    if conteo_critico > 0:
+        return "decision:critico>0"
+    if conteo_urgente >= 2:
+        return "decision:urgente>=2"
+    if conteo_urgente == 1 and conteo_no_urgente >= 2:
+        return "decision:urgente=1,no_urgente>=2"
+    if conteo_urgente == 1:
+        return "decision:urgente=1"
+    if conteo_no_urgente >= 2:
+        return "decision:no_urgente>=2"
+    return "decision:sin_hallazgos"
+
+
+def _hit(hits, regla, categoria, **detalle):
+    hits.append({"regla": regla, "categoria": CATEGORIAS[categoria], **detalle})
+
+
+def contar_texto(observaciones, reglas, hits=None):
     """
-    Función para simular la predicción del modelo de triaje.
-    Considera múltiples síntomas y signos vitales para determinar el nivel.
+    Conteos por categoría de las palabras clave de un texto libre.
+
+    Returns:
+        tuple: ([critico, urgente, no_urgente], palabras clave marcadas)
     """
-    # Definir niveles de gravedad de síntomas
-    sintomas_criticos = [
-        "Dificultad para respirar", "respirar", "respiración",
-        "Dolor en el pecho", "pecho", "torax",
-        "Pérdida de consciencia", "desmayo", "inconsciente"
-    ]
-    
-    sintomas_urgentes = [
-        "Dolor abdominal", "abdomen", "estómago",
-        "Fiebre", "temperatura", "calor",
-        "Taquicardia", "corazón", "palpitaciones",
-        "Baja saturación", "oxígeno"
-    ]
-    
-    sintomas_no_urgentes = [
-        "Dolor muscular", "músculo", "dolor",
-        "Mareos", "mareo", "vértigo",
-        "Náuseas", "nausea", "vómito",
-        "Diarrea", "deposición"
-    ]
-
-    # Contadores para cada nivel
-    conteo_critico = 0
-    conteo_urgente = 0
-    conteo_no_urgente = 0
+    conteos = [0, 0, 0]
     keywords_encontradas = []
+    if observaciones:
+        for keyword in process_text_to_keywords(observaciones, vocabulary=reglas.vocabulary):
+            categoria = reglas.categorias.get(keyword)
+            if categoria is not None:
+                conteos[categoria] += 1
+                keywords_encontradas.append(f"{MARCAS[CATEGORIAS[categoria]]} {keyword}")
+                if hits is not None:
+                    _hit(hits, f"palabra_clave:{keyword}", categoria)
+    return conteos, keywords_encontradas
+
 
-    # Procesar notas si existen
-    if 'observaciones' in datos_paciente and datos_paciente['observaciones']:
-        keywords = process_text_to_keywords(datos_paciente['observaciones'])
-        
-        # Analizar keywords encontradas
-        for keyword in keywords:
-            if keyword in sintomas_criticos:
-                conteo_critico += 1
-                keywords_encontradas.append(f"🔴 {keyword}")
-            elif keyword in sintomas_urgentes:
-                conteo_urgente += 1
-                keywords_encontradas.append(f"🟡 {keyword}")
-            elif keyword in sintomas_no_urgentes:
-                conteo_no_urgente += 1
-                keywords_encontradas.append(f"🟢 {keyword}")
-
-    # Analizar síntomas presentes
-    sintomas = datos_paciente.get('sintomas', [])
+def contar_sintomas(sintomas, conteos, categorias, hits=None):
+    """Suma a conteos los síntomas seleccionados en el formulario (o palabras clave ya extraídas)"""
     for sintoma in sintomas:
-        if sintoma in sintomas_criticos:
-            conteo_critico += 1
-        elif sintoma in sintomas_urgentes:
-            conteo_urgente += 1
-        elif sintoma in sintomas_no_urgentes:
-            conteo_no_urgente += 1
-
-    # Analizar signos vitales si están presentes
+        categoria = categorias.get(sintoma)
+        if categoria is not None:
+            conteos[categoria] += 1
+            if hits is not None:
+                _hit(hits, f"sintoma:{sintoma}", categoria)
+
+
+def contar_signos_vitales(datos_paciente, conteos, umbrales, hits=None):
+    """Suma a conteos los signos vitales fuera de rango (hits, si se pasa, recibe cada umbral superado)"""
     if 'temperatura' in datos_paciente:
         temp = float(datos_paciente['temperatura'])
-        if temp >= 39.0:
-            conteo_urgente += 1
-        elif temp >= 37.5:
-            conteo_no_urgente += 1
+        if temp >= umbrales['temperatura_urgente']:
+            conteos[1] += 1
+            if hits is not None:
+                _hit(hits, "temperatura_urgente", 1, valor=temp, umbral=umbrales['temperatura_urgente'])
+        elif temp >= umbrales['temperatura_no_urgente']:
+            conteos[2] += 1
+            if hits is not None:
+                _hit(hits, "temperatura_no_urgente", 2, valor=temp, umbral=umbrales['temperatura_no_urgente'])
 
     if 'saturacion_oxigeno' in datos_paciente:
         sat_o2 = float(datos_paciente['saturacion_oxigeno'])
-        if sat_o2 < 90:
-            conteo_critico += 1
-        elif sat_o2 < 95:
-            conteo_urgente += 1
+        if sat_o2 < umbrales['saturacion_critica']:
+            conteos[0] += 1
+            if hits is not None:
+                _hit(hits, "saturacion_critica", 0, valor=sat_o2, umbral=umbrales['saturacion_critica'])
+        elif sat_o2 < umbrales['saturacion_urgente']:
+            conteos[1] += 1
+            if hits is not None:
+                _hit(hits, "saturacion_urgente", 1, valor=sat_o2, umbral=umbrales['saturacion_urgente'])
 
     if 'frecuencia_cardiaca' in datos_paciente:
         fc = float(datos_paciente['frecuencia_cardiaca'])
-        if fc > 120 or fc < 50:
-            conteo_urgente += 1
-        elif fc > 100 or fc < 60:
-            conteo_no_urgente += 1
+        if fc > umbrales['fc_urgente_alta'] or fc < umbrales['fc_urgente_baja']:
+            conteos[1] += 1
+            if hits is not None:
+                _hit(hits, "fc_urgente", 1, valor=fc,
+                     umbral=[umbrales['fc_urgente_baja'], umbrales['fc_urgente_alta']])
+        elif fc > umbrales['fc_no_urgente_alta'] or fc < umbrales['fc_no_urgente_baja']:
+            conteos[2] += 1
+            if hits is not None:
+                _hit(hits, "fc_no_urgente", 2, valor=fc,
+                     umbral=[umbrales['fc_no_urgente_baja'], umbrales['fc_no_urgente_alta']])
 
-    # Lógica de decisión
-    if conteo_critico > 0:
-        nivel = "NIVEL 1 - ATENCIÓN INMEDIATA"
-    elif conteo_urgente >= 2 or (conteo_urgente == 1 and conteo_no_urgente >= 2):
-        nivel = "NIVEL 2 - ATENCIÓN PRIORITARIA"
-    elif conteo_urgente == 1 or conteo_no_urgente >= 2:
-        nivel = "NIVEL 3 - ATENCIÓN PREFERENTE"
-    else:
-        nivel = "NIVEL 4 - ATENCIÓN NORMAL"
+
+def contar_signos_vitales_vectorizado(temp, sat_o2, fc, umbrales, hits=None):
+    """
+    contar_signos_vitales over float arrays (NaN = not measured).
+
+    Args:
+        hits (list): If given, receives one entry per threshold with the
+                     number of records that crossed it ('veces')
+
+    Returns:
+        np.ndarray: (3, n) counts per category
+    """
+    temp_urgente = temp >= umbrales['temperatura_urgente']
+    temp_no_urgente = ~temp_urgente & (temp >= umbrales['temperatura_no_urgente'])
+    sat_critica = sat_o2 < umbrales['saturacion_critica']
+    sat_urgente = ~sat_critica & (sat_o2 < umbrales['saturacion_urgente'])
+    fc_urgente = (fc > umbrales['fc_urgente_alta']) | (fc < umbrales['fc_urgente_baja'])
+    fc_no_urgente = ~fc_urgente & ((fc > umbrales['fc_no_urgente_alta']) | (fc < umbrales['fc_no_urgente_baja']))
+
+    conteos = np.zeros((3, len(temp)), dtype=np.int64)
+    conteos[0] += sat_critica
+    conteos[1] += temp_urgente
+    conteos[1] += sat_urgente
+    conteos[1] += fc_urgente
+    conteos[2] += temp_no_urgente
+    conteos[2] += fc_no_urgente
+
+    if hits is not None:
+        for regla, categoria, mascara in (
+            ("temperatura_urgente", 1, temp_urgente),
+            ("temperatura_no_urgente", 2, temp_no_urgente),
+            ("saturacion_critica", 0, sat_critica),
+            ("saturacion_urgente", 1, sat_urgente),
+            ("fc_urgente", 1, fc_urgente),
+            ("fc_no_urgente", 2, fc_no_urgente),
+        ):
+            veces = int(np.count_nonzero(mascara))
+            if veces:
+                _hit(hits, regla, categoria, veces=veces)
+    return conteos
+
+
+def predict_triage(datos_paciente, trace=False):
+    """
+    Función para simular la predicción del modelo de triaje.
+    Considera múltiples síntomas y signos vitales para determinar el nivel.
+
+    Con trace=True (o con triage_metrics habilitado) el resultado incluye
+    'traza': las reglas exactas que se cumplieron, con la decisión final.
+    """
+    if trace or triage_metrics.enabled:
+        return _predict_triage_traced(datos_paciente)
+
+    reglas = get_rules()
+    conteos, keywords_encontradas = contar_texto(datos_paciente.get('observaciones'), reglas)
+    contar_sintomas(datos_paciente.get('sintomas', []), conteos, reglas.categorias)
+    contar_signos_vitales(datos_paciente, conteos, reglas.umbrales)
+
+    return {
+        'nivel': decidir_nivel(*conteos),
+        'keywords': keywords_encontradas if keywords_encontradas else None,
+        'conteos': dict(zip(CATEGORIAS, conteos)),
+        'version_reglas': reglas.version
+    }
+
+
+def _predict_triage_traced(datos_paciente):
+    """predict_triage recording the rules hit and the time spent per stage"""
+    inicio = time.perf_counter()
+    reglas = get_rules()
+    traza = []
+
+    t0 = time.perf_counter()
+    conteos, keywords_encontradas = contar_texto(datos_paciente.get('observaciones'), reglas, traza)
+    t1 = time.perf_counter()
+    contar_sintomas(datos_paciente.get('sintomas', []), conteos, reglas.categorias, traza)
+    t2 = time.perf_counter()
+    contar_signos_vitales(datos_paciente, conteos, reglas.umbrales, traza)
+    t3 = time.perf_counter()
+    nivel = decidir_nivel(*conteos)
+    traza.append({"regla": regla_decision(*conteos), "nivel": nivel})
+    fin = time.perf_counter()
+
+    etapas = {"reglas": t0 - inicio, "nlp": t1 - t0, "sintomas": t2 - t1, "signos_vitales": t3 - t2, "decision": fin - t3}
+    if triage_metrics.enabled:
+        triage_metrics.METRICS.record(traza, {**etapas, "total": fin - inicio}, fin - inicio)
 
     return {
         'nivel': nivel,
         'keywords': keywords_encontradas if keywords_encontradas else None,
-        'conteos': {
-            'critico': conteo_critico,
-            'urgente': conteo_urgente,
-            'no_urgente': conteo_no_urgente
+        'conteos': dict(zip(CATEGORIAS, conteos)),
+        'version_reglas': reglas.version,
+        'traza': traza,
+    }
+
+
+def niveles_vectorizados(critico, urgente, no_urgente):
+    """decidir_nivel sobre arrays de conteos; devuelve el índice en NIVELES"""
+    critico, urgente, no_urgente = map(np.asarray, (critico, urgente, no_urgente))
+    return np.select(
+        [
+            critico > 0,
+            (urgente >= 2) | ((urgente == 1) & (no_urgente >= 2)),
+            (urgente == 1) | (no_urgente >= 2),
+        ],
+        [0, 1, 2],
+        default=3,
+    )
+
+
+def _columna(valores, n):
+    """Float column of n values; None (or a missing column) becomes NaN, which no threshold matches"""
+    if valores is None:
+        return np.full(n, np.nan)
+    return np.array([np.nan if v is None else v for v in valores], dtype=float)
+
+
+def predict_triage_batch(pacientes=None, *, temperatura=None, saturacion_oxigeno=None,
+                         frecuencia_cardiaca=None, observaciones=None, sintomas=None):
+    """
+    Triaje de muchos pacientes a la vez.
+
+    Acepta una lista de diccionarios como los de ``predict_triage`` o bien
+    columnas (listas o arrays de igual largo) con los signos vitales, las
+    observaciones y las listas de síntomas. Los signos vitales se evalúan
+    vectorizados con NumPy; un valor faltante (None/NaN) no suma puntos.
+    El nivel de cada paciente es el mismo que daría ``predict_triage``.
+
+    Returns:
+        dict: 'niveles' (lista), 'conteos' (un array por categoría),
+              'por_nivel' (cantidad de pacientes en cada nivel) y
+              'version_reglas'
+
+    Con triage_metrics habilitado se registran los tiempos por etapa del
+    lote y cuántos registros superaron cada umbral de signos vitales.
+    """
+    instrumentado = triage_metrics.enabled
+    inicio = time.perf_counter()
+    reglas = get_rules()
+    if pacientes is not None:
+        pacientes = list(pacientes)
+        n = len(pacientes)
+        columnas = {
+            campo: [float(p[campo]) if campo in p else None for p in pacientes]
+            for campo in SIGNOS_VITALES
         }
-    } 
\ No newline at end of file
+        observaciones = [p.get('observaciones') for p in pacientes]
+        sintomas = [p.get('sintomas', []) for p in pacientes]
+    else:
+        columnas = {
+            'temperatura': temperatura,
+            'saturacion_oxigeno': saturacion_oxigeno,
+            'frecuencia_cardiaca': frecuencia_cardiaca,
+        }
+        n = max((len(c) for c in (temperatura, saturacion_oxigeno, frecuencia_cardiaca,
+                                 observaciones, sintomas) if c is not None), default=0)
+
+    # Texto y síntomas: per-record dict lookups; repeated texts are scanned once
+    por_texto = {}
+    filas = []
+    for i in range(n):
+        texto = observaciones[i] if observaciones is not None else None
+        if texto:
+            if texto not in por_texto:
+                por_texto[texto] = contar_texto(texto, reglas)[0]
+            fila = list(por_texto[texto])
+        else:
+            fila = [0, 0, 0]
+        if sintomas is not None and sintomas[i]:
+            contar_sintomas(sintomas[i], fila, reglas.categorias)
+        filas.append(fila)
+    conteos = np.array(filas, dtype=np.int64).reshape(n, 3).T
+    t_texto = time.perf_counter()
+
+    # Signos vitales: vectorized thresholds
+    traza = [] if instrumentado else None
+    conteos += contar_signos_vitales_vectorizado(
+        _columna(columnas['temperatura'], n),
+        _columna(columnas['saturacion_oxigeno'], n),
+        _columna(columnas['frecuencia_cardiaca'], n),
+        reglas.umbrales,
+        traza,
+    )
+    t_signos = time.perf_counter()
+
+    indices = niveles_vectorizados(*conteos)
+
+    if instrumentado:
+        fin = time.perf_counter()
+        etapas = {
+            "batch_texto_sintomas": t_texto - inicio,
+            "batch_signos_vitales": t_signos - t_texto,
+            "batch_decision": fin - t_signos,
+            "batch_total": fin - inicio,
+        }
+        triage_metrics.METRICS.record(traza, etapas, fin - inicio, predictions=n)
+    return {
+        'niveles': [NIVELES[i] for i in indices],
+        'conteos': dict(zip(CATEGORIAS, conteos)),
+        'por_nivel': dict(zip(NIVELES, np.bincount(indices, minlength=len(NIVELES)).tolist())),
+        'version_reglas': reglas.version,
+    }
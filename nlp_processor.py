@@ -1,61 +1,586 @@
-def process_text_to_keywords(text):
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    from wordfreq import zipf_frequency
+except ImportError:  # falls back to the bundled list, see is_common_word
+    zipf_frequency = None
+
+# Spanish stopwords (common words to filter out)
+STOP_WORDS = frozenset({
+    'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', 'y', 'o', 'pero', 'si',
+    'de', 'del', 'a', 'en', 'para', 'por', 'con', 'al', 'lo', 'le', 'ha', 'he',
+    'que', 'es', 'no', 'son', 'era', 'este', 'esta', 'estos', 'estas', 'ese',
+    'esa', 'esos', 'esas', 'aquel', 'aquella', 'me', 'mi', 'tu', 'te', 'se',
+    'nos', 'su', 'sus', 'como', 'cuando', 'donde', 'quien', 'cual', 'que',
+    'mas', 'mas', 'mientras', 'antes', 'despues', 'ahora', 'durante'
+})
+
+# Medical terms to specifically look for (single words and phrases).
+# Matching runs on normalized forms, so accents, plurals and case variants
+# ('vomitos', 'Náuseas', 'convulsiones') don't need their own entries.
+MEDICAL_TERMS = {
+    # Síntomas críticos
+    'dolor': 'critico', 'pecho': 'critico', 'respirar': 'critico',
+    'dificultad': 'critico', 'inconsciente': 'critico', 'sangrado': 'critico',
+    'hemorragia': 'critico', 'convulsion': 'critico',
+    'dolor en el pecho': 'critico', 'dificultad para respirar': 'critico',
+    'falta de aire': 'critico', 'pérdida de conciencia': 'critico',
+    'pérdida de consciencia': 'critico',
+
+    # Síntomas urgentes
+    'fiebre': 'urgente', 'vómito': 'urgente', 'diarrea': 'urgente',
+    'mareo': 'urgente', 'nausea': 'urgente', 'abdomen': 'urgente',
+    'dolor abdominal': 'urgente', 'fiebre alta': 'urgente',
+
+    # Síntomas no urgentes
+    'tos': 'no_urgente', 'cansancio': 'no_urgente', 'fatiga': 'no_urgente',
+    'malestar': 'no_urgente', 'picazón': 'no_urgente', 'comezón': 'no_urgente',
+    'dolor de cabeza': 'no_urgente', 'dolor muscular': 'no_urgente'
+}
+
+# Letters and digits; everything else (punctuation, symbols, '_') separates words
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# Distinct raw tokens kept in the normalization cache
+TOKEN_CACHE_SIZE = 4096
+
+
+def fold_diacritics(word):
+    """Remove accents and other combining marks ('náusea' -> 'nausea')"""
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(word):
+    """
+    Light Spanish stemmer that only removes plural endings.
+
+    Drops a final 's' and then a final 'e' after a consonant, so singular and
+    plural share a form: 'mareos'/'mareo' -> 'mareo',
+    'convulsiones'/'convulsion' -> 'convulsion', 'fiebres'/'fiebre' -> 'fiebr'.
+    """
+    if len(word) > 3 and word.endswith('s'):
+        word = word[:-1]
+    if len(word) >= 4 and word.endswith('e') and word[-2] not in 'aeiou':
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def normalize_token(token):
+    """Normal forms of one lowercase whitespace-delimited token (punctuation can split it in several)"""
+    return tuple(stem(word) for word in _WORD_RE.findall(fold_diacritics(token)))
+
+
+def normalize_text(text):
+    """Split text into normalized words: folded accents, no punctuation, light stemming"""
+    return [word for token in text.lower().split() for word in normalize_token(token)]
+
+class KeywordMatcher:
+    """
+    Word-level Aho–Corasick automaton over a vocabulary of single- and multi-word terms.
+
+    Built once and flattened into a full transition table, so ``find``
+    reports every vocabulary term (overlapping ones included, e.g. 'dolor',
+    'dolor en el pecho' and 'pecho') in a single left-to-right pass with one
+    dict lookup per token.
+
+    Args:
+        terms: Iterable of terms; each is split into words with ``tokenize``
+        tokenize: Function turning a term (and later the text) into words
+    """
+
+    def __init__(self, terms, tokenize=normalize_text):
+        self._goto = [{}]  # state -> {token: next state}
+        self._fail = [0]
+        self._output = [()]  # state -> terms ending here, longest first
+        self.term_lengths = {}  # term -> number of words
+
+        for term in terms:
+            state = 0
+            words = tokenize(term)
+            self.term_lengths.setdefault(term, len(words))
+            for token in words:
+                next_state = self._goto[state].get(token)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][token] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            if state and term not in self._output[state]:
+                self._output[state] += (term,)
+
+        # Breadth-first pass: failure links and inherited outputs
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for token, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(token, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] += self._output[self._fail[child]]
+
+        # Resolve failure links ahead of time: _delta[state][token] is the next
+        # state for every vocabulary token; any other token goes back to the root
+        vocabulary = {token for transitions in self._goto for token in transitions}
+        self._delta = []
+        for state in range(len(self._goto)):
+            transitions = {}
+            for token in vocabulary:
+                fallback = state
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(token, 0)
+                if target:
+                    transitions[token] = target
+            self._delta.append(transitions)
+
+    def step(self, state, token):
+        """Advance the automaton by one token; returns (new state, terms ending at this token)"""
+        state = self._delta[state].get(token, 0)
+        return state, self._output[state]
+
+    def find(self, tokens):
+        """Return (token index, term) for every vocabulary term ending at each token"""
+        delta = self._delta
+        output = self._output
+        state = 0
+        found = []
+        for index, token in enumerate(tokens):
+            state = delta[state].get(token, 0)
+            if output[state]:
+                found.extend((index, term) for term in output[state])
+        return found
+
+    def find_terms(self, tokens):
+        """Like ``find`` but returns only the terms"""
+        delta = self._delta
+        output = self._output
+        state = 0
+        found = []
+        for token in tokens:
+            state = delta[state].get(token, 0)
+            if output[state]:
+                found.extend(output[state])
+        return found
+
+
+# Zipf frequency (log10 per billion words) from which a word counts as real
+# Spanish: 'esperar' 5.0, 'diaria' 4.2, 'medicacion' 2.4; typos like 'diarea' 0.
+COMMON_WORD_ZIPF = 1.5
+
+# The 20,000 most frequent Spanish words (down to zipf ~3.4), for totems without wordfreq
+COMMON_WORDS_PATH = Path(__file__).with_name("palabras_comunes_es.txt")
+
+
+@lru_cache(maxsize=1)
+def bundled_common_words():
+    """Words of COMMON_WORDS_PATH, or an empty set if the file is missing"""
+    try:
+        with open(COMMON_WORDS_PATH, encoding="utf-8") as f:
+            return frozenset(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    except OSError as e:
+        print(f"Common word list unavailable, typo suggestions are not filtered: {str(e)}")  # Debug log
+        return frozenset()
+
+
+def is_common_word(word):
+    """
+    True if a lowercase word is in the general Spanish frequency list (wordfreq).
+
+    Such words are never treated as typos of a medical term ('esperar' is not
+    'respirar'). Without wordfreq the shorter bundled list is used; a word in
+    neither stays a correction candidate.
+    """
+    if zipf_frequency is None:
+        return word in bundled_common_words()
+    return zipf_frequency(word, 'es') >= COMMON_WORD_ZIPF
+
+
+def common_words_source():
+    """Which frequency list filters typo suggestions, for the statistics page"""
+    if zipf_frequency is not None:
+        return {"fuente": "wordfreq", "palabras": None}
+    return {"fuente": "lista incluida", "palabras": len(bundled_common_words())}
+
+
+def edit_distance(a, b, limit):
+    """Optimal-string-alignment distance between a and b, or limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    """
+    SymSpell-style deletion index for typo-tolerant lookup of vocabulary words.
+
+    Every vocabulary word is stored under all the strings obtained by
+    deleting up to ``max_distance`` characters. A query only generates its
+    own deletions and looks them up, so candidates are found without
+    scanning the vocabulary; they are then verified with the real
+    (Damerau) edit distance.
+
+    Args:
+        words: Vocabulary words (already normalized)
+        max_distance (int): Largest edit distance supported
+    """
+
+    def __init__(self, words, max_distance=2):
+        self.max_distance = max_distance
+        self.words = frozenset(words)
+        self._deletes = {}
+        for word in self.words:
+            for variant in self._variants(word, max_distance):
+                self._deletes.setdefault(variant, set()).add(word)
+
+    @staticmethod
+    def _variants(word, distance):
+        variants = {word}
+        frontier = {word}
+        for _ in range(distance):
+            frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+            variants |= frontier
+        return variants
+
+    def lookup(self, word, max_distance=None):
+        """
+        Closest vocabulary word within max_distance edits.
+
+        Returns:
+            tuple: (vocabulary word, distance), or None if nothing is close enough
+        """
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        if word in self.words:
+            return word, 0
+
+        candidates = set()
+        for variant in self._variants(word, limit):
+            candidates |= self._deletes.get(variant, set())
+
+        best = None
+        for candidate in sorted(candidates):
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit and (best is None or distance < best[1]):
+                best = (candidate, distance)
+        return best
+
+
+def allowed_distance(word):
+    """Typos tolerated for a word of this length: none below 4 letters, 1 up to 5, else 2"""
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+_NORMALIZED_STOP_WORDS = frozenset(stem(fold_diacritics(word)) for word in STOP_WORDS)
+
+
+class Vocabulary:
+    """
+    Medical vocabulary compiled for matching: keyword automaton, typo index
+    and the per-token correction caches that depend on them.
+
+    Typo correction only considers words missing from the general Spanish
+    frequency list (see is_common_word), and is opt-in: triage scoring
+    matches exact words, and corrections are offered as suggestions
+    (``suggest_corrections``).
+
+    Instances are immutable once built, so a new vocabulary (e.g. from an
+    updated rules file) is compiled aside and installed with
+    ``set_vocabulary`` in a single assignment.
+
+    Args:
+        terms (dict): term or phrase -> category ('critico', 'urgente', 'no_urgente')
+        version (str): Label of where the terms came from
+    """
+
+    def __init__(self, terms, version=None):
+        self.terms = dict(terms)
+        self.version = version
+        # Same filter the per-call version applied: no stopwords, no words of <= 2 letters
+        self.matcher = KeywordMatcher(
+            [term for term in self.terms if ' ' in term or (term not in STOP_WORDS and len(term) > 2)],
+            tokenize=normalize_text,
+        )
+        self.fuzzy_index = FuzzyIndex(
+            word
+            for term in self.matcher.term_lengths
+            for word in normalize_text(term)
+            if len(word) >= 4 and word not in _NORMALIZED_STOP_WORDS
+        )
+        # Normalized vocabulary word -> how it is written in the terms, for suggestions
+        self.spelling = {}
+        for term in self.terms:
+            for word in _WORD_RE.findall(term.lower()):
+                self.spelling.setdefault(stem(fold_diacritics(word)), word)
+        self.correct_word = lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._correct_word)
+        self.normalize_token = lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._normalize_token)
+
+    def _correct_word(self, word):
+        """
+        Map a lowercase word (as written) to the vocabulary word it is a typo of.
+
+        Returns:
+            tuple: (normalized word to match on, edit distance); the word's own
+                   normal form and 0 when no correction applies
+        """
+        normal = stem(fold_diacritics(word))
+        if (normal in self.fuzzy_index.words or normal in _NORMALIZED_STOP_WORDS
+                or not normal.isalpha() or is_common_word(word)):
+            return normal, 0
+        limit = allowed_distance(normal)
+        match = self.fuzzy_index.lookup(normal, limit) if limit else None
+        return match if match else (normal, 0)
+
+    def _normalize_token(self, token):
+        """normalize_token with typo correction of each word"""
+        return tuple(self.correct_word(word)[0] for word in _WORD_RE.findall(unicodedata.normalize('NFC', token)))
+
+    def normalize_text(self, text):
+        """normalize_text with typos in medical words corrected ('resprar' -> 'respirar')"""
+        return [word for token in text.lower().split() for word in self.normalize_token(token)]
+
+
+DEFAULT_VOCABULARY = Vocabulary(MEDICAL_TERMS, version='nlp_processor')
+_vocabulary = DEFAULT_VOCABULARY
+
+
+def get_vocabulary():
+    """Vocabulary used when none is passed explicitly"""
+    return _vocabulary
+
+
+def set_vocabulary(vocabulary):
+    """Install a compiled Vocabulary for every later call (atomic: one assignment)"""
+    global _vocabulary
+    _vocabulary = vocabulary
+
+
+def process_text_to_keywords(text, fuzzy=False, vocabulary=None):
     """
     Process text to extract keywords using a simple rule-based approach
-    
+
     Args:
         text (str): Input text to process
-        
+        fuzzy (bool): Also match misspelled medical words ('diarea', 'convulcion');
+                      off for triage scoring, see suggest_corrections
+        vocabulary (Vocabulary): Terms to look for (defaults to get_vocabulary())
+
     Returns:
-        list: Extracted keywords
+        list: Every vocabulary term found, as spelled in the vocabulary, in the
+              order they end in the text (longer first when several end on the
+              same word). Phrases and the words inside them are all reported,
+              so 'dolor en el pecho' gives ['dolor', 'dolor en el pecho', 'pecho'];
+              inflected forms give the vocabulary term ('Vómitos' -> 'vómito').
+              Before the phrase vocabulary this returned only single words, as
+              written in the text; callers that count keywords count phrases too.
     """
     try:
-        # Spanish stopwords (common words to filter out)
-        stop_words = {
-            'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', 'y', 'o', 'pero', 'si',
-            'de', 'del', 'a', 'en', 'para', 'por', 'con', 'al', 'lo', 'le', 'ha', 'he',
-            'que', 'es', 'no', 'son', 'era', 'este', 'esta', 'estos', 'estas', 'ese',
-            'esa', 'esos', 'esas', 'aquel', 'aquella', 'me', 'mi', 'tu', 'te', 'se',
-            'nos', 'su', 'sus', 'como', 'cuando', 'donde', 'quien', 'cual', 'que',
-            'mas', 'mas', 'mientras', 'antes', 'despues', 'ahora', 'durante'
-        }
-
-        # Medical terms to specifically look for
-        medical_terms = {
-            # Síntomas críticos
-            'dolor': 'critico', 'pecho': 'critico', 'respirar': 'critico',
-            'dificultad': 'critico', 'inconsciente': 'critico', 'sangrado': 'critico',
-            'hemorragia': 'critico', 'convulsion': 'critico', 'convulsiones': 'critico',
-            
-            # Síntomas urgentes
-            'fiebre': 'urgente', 'vomito': 'urgente', 'vómito': 'urgente',
-            'diarrea': 'urgente', 'mareo': 'urgente', 'mareos': 'urgente',
-            'nausea': 'urgente', 'náusea': 'urgente', 'abdomen': 'urgente',
-            
-            # Síntomas no urgentes
-            'tos': 'no_urgente', 'cansancio': 'no_urgente', 'fatiga': 'no_urgente',
-            'malestar': 'no_urgente', 'picazon': 'no_urgente', 'picazón': 'no_urgente',
-            'comezon': 'no_urgente', 'comezón': 'no_urgente'
-        }
-
-        # Normalize text: lowercase and split into words
-        words = text.lower().replace('.', ' ').replace(',', ' ').split()
-        
-        # Filter out stopwords and short words, keep medical terms
-        keywords = []
-        for word in words:
-            if (word in medical_terms and 
-                word not in stop_words and 
-                len(word) > 2):
-                keywords.append(word)
-
-        return keywords
+        vocabulary = vocabulary or _vocabulary
+        words = vocabulary.normalize_text(text) if fuzzy else normalize_text(text)
+        return vocabulary.matcher.find_terms(words)
 
     except Exception as e:
         print(f"Error processing text: {str(e)}")
         return []
 
+
+def extract_keywords(text, fuzzy=False, vocabulary=None):
+    """
+    Keywords with the text they were found in and any typo corrections applied
+
+    Returns:
+        list: dicts with 'keyword', 'categoria', 'texto' (words as written) and
+              'correcciones' (list of {'original', 'corregido', 'distancia'})
+    """
+    vocabulary = vocabulary or _vocabulary
+    matcher = vocabulary.matcher
+    surface = []
+    words = []
+    corrections = []
+    for token in text.split():
+        for original in _WORD_RE.findall(token):
+            if fuzzy:
+                corrected, distance = vocabulary.correct_word(original.lower())
+            else:
+                corrected, distance = stem(fold_diacritics(original.lower())), 0
+            surface.append(original)
+            words.append(corrected)
+            corrections.append(
+                {'original': original, 'corregido': corrected, 'distancia': distance} if distance else None
+            )
+
+    results = []
+    for end, term in matcher.find(words):
+        start = end - matcher.term_lengths[term] + 1
+        results.append({
+            'keyword': term,
+            'categoria': vocabulary.terms[term],
+            'texto': ' '.join(surface[start:end + 1]),
+            'correcciones': [c for c in corrections[start:end + 1] if c],
+        })
+    return results
+
+def suggest_corrections(text, vocabulary=None):
+    """
+    Words that look like misspelled medical terms, to show as "did you mean"
+
+    Never changes any keyword or triage level; only words that are not
+    ordinary Spanish words are considered.
+
+    Returns:
+        list: dicts with 'original' (as written), 'sugerencia' and 'distancia'
+    """
+    vocabulary = vocabulary or _vocabulary
+    suggestions = []
+    seen = set()
+    for original in _WORD_RE.findall(unicodedata.normalize('NFC', text or '')):
+        lower = original.lower()
+        if lower in seen:
+            continue
+        seen.add(lower)
+        corrected, distance = vocabulary.correct_word(lower)
+        if distance:
+            suggestions.append({
+                'original': original,
+                'sugerencia': vocabulary.spelling.get(corrected, corrected),
+                'distancia': distance,
+            })
+    return suggestions
+
+
+class IncrementalKeywordExtractor:
+    """
+    Keyword extraction over text that arrives in pieces (typing, dictation).
+
+    Keeps the automaton state and the word position between calls, so each
+    ``feed`` only tokenizes and matches the new text and returns only the
+    keywords it completed. A word cut at the end of a piece ('...en el pe')
+    is held back until the next piece or ``flush`` shows whether it goes on.
+    Feeding a text in any number of pieces and then flushing finds the same
+    keywords as ``process_text_to_keywords`` on the whole text.
+
+    Args:
+        fuzzy (bool): Correct misspelled medical words, as in process_text_to_keywords
+        vocabulary (Vocabulary): Terms to look for (defaults to get_vocabulary() at creation)
+    """
+
+    def __init__(self, fuzzy=False, vocabulary=None):
+        self.fuzzy = fuzzy
+        self.vocabulary = vocabulary or _vocabulary
+        self.matcher = self.vocabulary.matcher
+        self.reset()
+
+    def reset(self):
+        """Forget everything fed so far"""
+        self.text = ''
+        self.keywords = []
+        self.conteos = {'critico': 0, 'urgente': 0, 'no_urgente': 0}
+        self._state = 0
+        self._pending = ''  # trailing token that may continue in the next piece
+        self._provisional = None  # state before update() matched the last word
+
+    def _match(self, tokens):
+        normalize = self.vocabulary.normalize_token if self.fuzzy else normalize_token
+        found = []
+        state = self._state
+        for token in tokens:
+            for word in normalize(token):
+                state, terms = self.matcher.step(state, word)
+                found.extend(terms)
+        self._state = state
+        for term in found:
+            self.keywords.append(term)
+            category = self.vocabulary.terms.get(term)
+            if category in self.conteos:
+                self.conteos[category] += 1
+        return found
+
+    def feed(self, text):
+        """
+        Append text and match it.
+
+        Returns:
+            list: Keywords completed by this piece of text
+        """
+        self._provisional = None
+        if not text:
+            return []
+        self.text += text
+        tokens = (self._pending + text).lower().split()
+        if text[-1].isspace():
+            self._pending = ''
+        else:
+            self._pending = tokens.pop() if tokens else ''
+        return self._match(tokens)
+
+    def flush(self):
+        """Match the held-back last word (call when the text is complete)"""
+        tokens, self._pending = [self._pending.lower()] if self._pending else [], ''
+        return self._match(tokens)
+
+    def update(self, text):
+        """
+        Bring the extractor up to date with the full current text.
+
+        When ``text`` extends what was seen before only the new part is
+        processed; after any other edit the text is scanned again from the
+        start. The last word is matched provisionally and re-matched if the
+        next call shows it was still being written.
+
+        Returns:
+            list: Keywords found since the previous call
+        """
+        reported = len(self.keywords)
+        provisional = []
+        if self._provisional and text.startswith(self.text):
+            # Undo the provisional match of the last word
+            self._state, reported, self.conteos, self._pending = self._provisional
+            provisional = self.keywords[reported:]
+            del self.keywords[reported:]
+            self.feed(text[len(self.text):])
+        elif text.startswith(self.text):
+            self.feed(text[len(self.text):])
+        else:
+            self.reset()
+            reported = 0
+            self.feed(text)
+
+        self._provisional = (self._state, len(self.keywords), dict(self.conteos), self._pending)
+        self.flush()
+        # Provisional hits that the longer text still produces were already returned
+        if self.keywords[reported:reported + len(provisional)] == provisional:
+            reported += len(provisional)
+        return self.keywords[reported:]
+
 if __name__ == "__main__":
     # Test the processor
     test_text = "El paciente presenta dolor en el pecho y dificultad para respirar"
     print(f"Testing with text: {test_text}")
-    print(f"Keywords: {process_text_to_keywords(test_text)}") 
+    print(f"Keywords: {process_text_to_keywords(test_text)}")
+
+    typo_text = "Refiere diarea y convulciones, le cuesta resprar"
+    print(f"Testing with text: {typo_text}")
+    for match in extract_keywords(typo_text):
+        print(f"  {match}")
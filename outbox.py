@@ -0,0 +1,377 @@
+"""
+Local durable outbox for the totem's writes to the central database.
+
+Patient registrations and triage records are committed to an embedded
+SQLite database (WAL mode) and acknowledged at once; a background syncer
+thread sends them to PostgreSQL in batches. Every entry carries an
+idempotency key, so a batch that is re-sent after a crash or a lost reply
+is applied only once. When the central database is unreachable the syncer
+backs off exponentially (with jitter) and the entries wait on disk.
+
+The outbox knows nothing about PostgreSQL: it calls ``sync_batch(entries)``
+(see db_utils.sync_outbox_batch), which must apply all of them or raise, and
+``on_synced(entries)`` once they are marked synced here (e.g. to drop cached
+server reads, which would otherwise be merged with the still-pending rows).
+Raising SyncUnavailable means "the destination is down": the whole batch
+backs off. Any other error is treated as a problem with the data, and the
+entries are retried one by one so a single bad entry cannot hold up the rest.
+An entry that keeps failing that way is set aside after ``max_attempts``
+(dead letter, 'descartado'): it stays on disk, shows up in ``stats`` and
+``dead_letters``, and ``retry_dead_letters`` puts it back in line once the
+cause (e.g. a missing migration on the server) is fixed.
+
+Entries for the same DNI are always sent in the order they were written.
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clave TEXT UNIQUE NOT NULL,
+    tipo TEXT NOT NULL,
+    dni TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    creado REAL NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    fallos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento REAL NOT NULL DEFAULT 0,
+    ultimo_error TEXT,
+    sincronizado REAL,
+    descartado REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pendientes ON outbox(sincronizado, proximo_intento, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_dni ON outbox(dni, id);
+"""
+
+# Columns added after the first release, for outbox files created before them
+MIGRATIONS = {
+    "fallos": "ALTER TABLE outbox ADD COLUMN fallos INTEGER NOT NULL DEFAULT 0",
+    "descartado": "ALTER TABLE outbox ADD COLUMN descartado REAL",
+}
+
+# Due entries, oldest first, skipping those behind an older entry of the same DNI that is backing off
+# (a dead letter no longer holds up the entries after it)
+DUE_SQL = """
+    SELECT id, clave, tipo, dni, datos, creado, intentos, fallos FROM outbox o
+    WHERE o.sincronizado IS NULL AND o.descartado IS NULL AND o.proximo_intento <= :ahora
+      AND NOT EXISTS (
+          SELECT 1 FROM outbox o2
+          WHERE o2.dni = o.dni AND o2.sincronizado IS NULL AND o2.descartado IS NULL
+            AND o2.id < o.id AND o2.proximo_intento > :ahora
+      )
+    ORDER BY o.id
+    LIMIT :limite
+"""
+
+PURGE_EVERY = 3600.0
+
+
+class SyncUnavailable(Exception):
+    """The destination database cannot be reached; retry the whole batch later"""
+
+
+class Outbox:
+    """
+    SQLite-backed outbox plus its syncer thread.
+
+    Args:
+        path (str): SQLite database file
+        sync_batch (callable): Applies a list of entries to the destination or raises
+        batch_size (int): Entries per sync_batch call
+        base_delay (float): First backoff after a failure, in seconds
+        max_delay (float): Backoff ceiling, in seconds
+        idle_interval (float): Seconds between polls when nothing is due
+        retention_days (float): How long synced entries are kept before being purged
+        max_attempts (int): Data errors before an entry is set aside as a dead letter
+        on_synced (callable): Called with the entries after they are marked synced
+    """
+
+    def __init__(self, path, sync_batch, batch_size=100, base_delay=1.0, max_delay=300.0,
+                 idle_interval=5.0, retention_days=7.0, max_attempts=10, on_synced=None):
+        self.path = path
+        self.sync_batch = sync_batch
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_interval = idle_interval
+        self.retention = retention_days * 86400
+        self.max_attempts = max_attempts
+        self.on_synced = on_synced
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._failures = 0  # consecutive SyncUnavailable, drives the shared backoff
+        self._paused_until = 0.0  # no batch is sent before this while the destination is down
+        self._next_purge = 0.0
+
+        self.synced = 0
+        self.last_sync = None
+        self.last_error = None
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # an acknowledged entry survives power loss
+        self._db.executescript(SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        for column, ddl in MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(ddl)
+
+    def enqueue(self, tipo, dni, datos, clave=None):
+        """
+        Store an entry durably and wake the syncer.
+
+        Args:
+            tipo (str): 'paciente' or 'triaje'
+            dni (str): Patient the entry belongs to
+            datos (dict): JSON-serializable payload
+            clave (str): Idempotency key (a new UUID by default)
+
+        Returns:
+            dict: The stored entry
+        """
+        entry = {
+            "clave": clave or str(uuid.uuid4()),
+            "tipo": tipo,
+            "dni": str(dni),
+            "datos": datos,
+            "creado": time.time(),
+        }
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO outbox (clave, tipo, dni, datos, creado) VALUES (?, ?, ?, ?, ?)",
+                (entry["clave"], tipo, entry["dni"], json.dumps(datos, ensure_ascii=False, default=str),
+                 entry["creado"]),
+            )
+        self._wakeup.set()
+        return entry
+
+    def pending(self, dni, tipo=None):
+        """Unsynced entries of a DNI (dead letters included), newest first"""
+        sql = "SELECT clave, tipo, dni, datos, creado, intentos, ultimo_error, descartado FROM outbox " \
+              "WHERE dni = ? AND sincronizado IS NULL"
+        params = [str(dni)]
+        if tipo is not None:
+            sql += " AND tipo = ?"
+            params.append(tipo)
+        sql += " ORDER BY id DESC"
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row):
+        entry = dict(row)
+        entry["datos"] = json.loads(entry["datos"])
+        return entry
+
+    def _delay(self, attempts):
+        return min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0)) * random.uniform(0.5, 1.0)
+
+    def sync_once(self):
+        """
+        Send one batch of due entries.
+
+        Returns:
+            int: Entries synced (0 if nothing was due or the destination is down)
+        """
+        now = time.time()
+        if now < self._paused_until:
+            return 0
+        with self._lock:
+            rows = self._db.execute(DUE_SQL, {"ahora": now, "limite": self.batch_size}).fetchall()
+        entries = [self._entry(row) for row in rows]
+        if not entries:
+            return 0
+
+        try:
+            self.sync_batch(entries)
+            done = entries
+        except SyncUnavailable as e:
+            self._backoff_all(entries, e)
+            return 0
+        except Exception as e:
+            if len(entries) == 1:
+                self._backoff_entry(entries[0], e)
+                return 0
+            # Find the bad entries without holding up the good ones
+            done = []
+            failed_dnis = set()
+            for position, entry in enumerate(entries):
+                if entry["dni"] in failed_dnis:
+                    continue  # keeps waiting behind the failed entry of its DNI
+                try:
+                    self.sync_batch([entry])
+                    done.append(entry)
+                except SyncUnavailable as e:
+                    self._backoff_all(entries[position:], e)
+                    break
+                except Exception as e:
+                    self._backoff_entry(entry, e)
+                    failed_dnis.add(entry["dni"])
+
+        self._mark_synced(done)
+        return len(done)
+
+    def _mark_synced(self, entries):
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE outbox SET sincronizado = ?, ultimo_error = NULL WHERE clave = ?",
+                [(now, entry["clave"]) for entry in entries],
+            )
+        self._failures = 0
+        self.synced += len(entries)
+        self.last_sync = now
+        print(f"Outbox: {len(entries)} entries synced")  # Debug log
+        if self.on_synced is not None:
+            try:
+                self.on_synced(entries)
+            except Exception as e:
+                print(f"Outbox: on_synced failed: {str(e)}")  # Debug log
+
+    def _backoff_all(self, entries, error):
+        self._failures += 1
+        retry_at = time.time() + self._delay(self._failures)
+        self._paused_until = retry_at
+        with self._lock:
+            self._db.executemany(
+                "UPDATE outbox SET intentos = intentos + 1, proximo_intento = ?, ultimo_error = ? WHERE clave = ?",
+                [(retry_at, str(error), entry["clave"]) for entry in entries],
+            )
+        self.last_error = str(error)
+        print(f"Outbox: destination unavailable, {len(entries)} entries retry in "
+              f"{retry_at - time.time():.1f}s: {str(error)}")  # Debug log
+
+    def _backoff_entry(self, entry, error):
+        # Only data errors count towards max_attempts: an outage must not turn good entries into dead letters
+        failures = entry["fallos"] + 1
+        now = time.time()
+        retry_at = now + self._delay(failures)
+        discarded = now if failures >= self.max_attempts else None
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET intentos = intentos + 1, fallos = ?, proximo_intento = ?, ultimo_error = ?, "
+                "descartado = ? WHERE clave = ?",
+                (failures, retry_at, str(error), discarded, entry["clave"]),
+            )
+        self.last_error = str(error)
+        if discarded is not None:
+            print(f"Outbox: entry {entry['tipo']} {entry['clave']} set aside after {failures} failures: "
+                  f"{str(error)}")  # Debug log
+        else:
+            print(f"Outbox: entry {entry['tipo']} {entry['clave']} failed (attempt {failures}): "
+                  f"{str(error)}")  # Debug log
+
+    def dead_letters(self, limit=50):
+        """Entries set aside after max_attempts, newest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT clave, tipo, dni, datos, creado, intentos, fallos, ultimo_error, descartado FROM outbox "
+                "WHERE sincronizado IS NULL AND descartado IS NOT NULL ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def retry_dead_letters(self, claves=None):
+        """
+        Put dead letters back in line with a fresh attempt count.
+
+        Args:
+            claves (list): Keys to retry (every dead letter by default)
+
+        Returns:
+            int: Entries put back
+        """
+        sql = "UPDATE outbox SET descartado = NULL, fallos = 0, proximo_intento = 0 " \
+              "WHERE sincronizado IS NULL AND descartado IS NOT NULL"
+        params = []
+        if claves is not None:
+            if not claves:
+                return 0
+            sql += f" AND clave IN ({', '.join('?' * len(claves))})"
+            params = list(claves)
+        with self._lock:
+            count = self._db.execute(sql, params).rowcount
+        if count:
+            self._wakeup.set()
+            print(f"Outbox: {count} dead letters put back in line")  # Debug log
+        return count
+
+    def purge(self):
+        """Delete entries synced more than retention_days ago"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM outbox WHERE sincronizado IS NOT NULL AND sincronizado < ?",
+                (time.time() - self.retention,),
+            )
+        return cursor.rowcount
+
+    def _seconds_until_due(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(proximo_intento) FROM outbox WHERE sincronizado IS NULL AND descartado IS NULL"
+            ).fetchone()
+        if row[0] is None:
+            return self.idle_interval
+        due = max(row[0], self._paused_until)
+        return min(self.idle_interval, max(due - time.time(), 0.0))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while self.sync_once() and not self._stop.is_set():
+                    pass
+                if time.time() >= self._next_purge:
+                    self.purge()
+                    self._next_purge = time.time() + PURGE_EVERY
+                timeout = self._seconds_until_due()
+            except Exception as e:  # never let the syncer die (e.g. disk full)
+                print(f"Outbox syncer error: {str(e)}")  # Debug log
+                timeout = self.idle_interval
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the syncer thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="outbox-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Pending/failing/dead-letter counts, age of the oldest pending entry and sync counters"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT SUM(descartado IS NULL), SUM(descartado IS NULL AND intentos > 0), "
+                "MIN(CASE WHEN descartado IS NULL THEN creado END), SUM(descartado IS NOT NULL) "
+                "FROM outbox WHERE sincronizado IS NULL"
+            ).fetchone()
+        pending, failing, oldest, discarded = row[0] or 0, row[1] or 0, row[2], row[3] or 0
+        return {
+            "pendientes": pending,
+            "con_reintentos": failing,
+            "descartados": discarded,
+            "antiguedad_max_s": time.time() - oldest if oldest else 0.0,
+            "sincronizados": self.synced,
+            "ultimo_sync": self.last_sync,
+            "ultimo_error": self.last_error,
+            "fallas_consecutivas": self._failures,
+        }
@@ -0,0 +1,555 @@
+"""
+Append-only patient log stored as rotating JSONL segments.
+
+Replaces the two small files per registration that utils.save_patient_data
+used to write (paciente_<dni>_<fecha>.txt and .txt.json). Every record is
+one JSON line appended to the active segment (segmento_000001.jsonl, ...);
+when it reaches ``segment_bytes`` it is sealed and a new one is started, so
+the directory holds a few large files no matter how many patients register.
+
+Writes are fsynced in batches: after ``fsync_every`` records or
+``fsync_interval`` seconds, whichever comes first. A crash loses at most
+that window; a half-written last line is cut off on the next open.
+
+An in-memory index maps each DNI to the (segment, offset) of its latest
+record, so ``get`` is one seek and one line read. Sealed segments keep their
+part of the index next to them (segmento_000001.idx), so opening the log
+only re-reads the active segment.
+
+Command line:
+
+    python patient_log.py migrar           # import the old .txt/.json files once
+    python patient_log.py buscar 30123456  # latest record of a DNI
+    python patient_log.py exportar -o registros.jsonl --desde 2024-01-01
+    python patient_log.py compactar        # merge segments, drop duplicates (app stopped)
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process writer lock
+    fcntl = None
+
+LOG_DIR = Path(os.environ.get("PATIENT_LOG_DIR", "datos_pacientes"))
+SEGMENT_BYTES = int(float(os.environ.get("PATIENT_LOG_SEGMENT_MB", 64)) * 1024 * 1024)
+FSYNC_EVERY = int(os.environ.get("PATIENT_LOG_FSYNC_RECORDS", 32))
+FSYNC_INTERVAL = float(os.environ.get("PATIENT_LOG_FSYNC_INTERVAL", 1.0))
+
+SEGMENT_PATTERN = re.compile(r"^segmento_(\d{6})\.jsonl$")
+LOCK_FILE = "registro.lock"
+
+
+class PatientLogError(RuntimeError):
+    """The log cannot be opened or modified (e.g. another process is writing it)"""
+
+
+def segment_path(directory, number):
+    return Path(directory) / f"segmento_{number:06d}.jsonl"
+
+
+def index_path(directory, number):
+    return Path(directory) / f"segmento_{number:06d}.idx"
+
+
+def list_segments(directory):
+    """Segment numbers present in directory, oldest first"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    numbers = []
+    for path in directory.iterdir():
+        match = SEGMENT_PATTERN.match(path.name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def encode_record(record):
+    return (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def scan_segment(path):
+    """
+    Yield (offset, record) for every complete line of a segment.
+
+    A trailing line without newline (interrupted write) is not yielded;
+    corrupt lines in the middle are reported and skipped.
+    """
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                yield offset, json.loads(line)
+            except ValueError:
+                print(f"Skipping corrupt line at {path}:{offset}")
+            offset += len(line)
+
+
+def _complete_length(path):
+    """Bytes of the segment up to its last newline"""
+    length = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            length += len(line)
+    return length
+
+
+def iter_segment_records(directory):
+    """Every record in the log, in append order (read-only; safe while the app writes)"""
+    for number in list_segments(directory):
+        for _, record in scan_segment(segment_path(directory, number)):
+            yield record
+
+
+def _fsync_directory(directory):
+    # Make a new or renamed file's directory entry durable (no-op where unsupported)
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class PatientLog:
+    """
+    Writer and reader of one log directory. Thread-safe; one writer process at a time.
+
+    Args:
+        directory (str | Path): Where the segments live
+        segment_bytes (int): Size at which the active segment is sealed
+        fsync_every (int): Records written before forcing an fsync
+        fsync_interval (float): Seconds an unsynced record may wait for its fsync
+    """
+
+    def __init__(self, directory=LOG_DIR, segment_bytes=SEGMENT_BYTES, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.RLock()
+        self._timer = None
+        self._pending = 0
+        self._index = {}          # dni -> (segment, offset) of its latest record
+        self._active_index = {}   # dni -> offset within the active segment
+        self._active_records = 0
+        self.records = 0
+        self.fsyncs = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.directory / LOCK_FILE, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise PatientLogError(f"El registro {self.directory} está abierto por otro proceso")
+        self._open()
+
+    def _open(self):
+        numbers = list_segments(self.directory)
+        for number in numbers[:-1]:
+            self._load_sealed_index(number)
+
+        self._segment = numbers[-1] if numbers else 1
+        path = segment_path(self.directory, self._segment)
+        if path.exists():
+            for offset, record in scan_segment(path):
+                self._add_to_index(record, offset)
+            size = _complete_length(path)
+            if size != path.stat().st_size:
+                print(f"Truncating interrupted write at the end of {path}")  # Debug log
+                os.truncate(path, size)
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        _fsync_directory(self.directory)
+        print(f"Patient log {self.directory}: {self.records} records, {len(self._index)} DNIs, "
+              f"active segment {self._segment}")  # Debug log
+
+    def _load_sealed_index(self, number):
+        idx = index_path(self.directory, number)
+        try:
+            with open(idx, encoding="utf-8") as f:
+                offsets = json.load(f)
+            self.records += offsets.pop("_registros", 0)
+        except (OSError, ValueError):
+            offsets = {}
+            records = 0
+            for offset, record in scan_segment(segment_path(self.directory, number)):
+                records += 1
+                if record.get("dni"):
+                    offsets[str(record["dni"])] = offset
+            self.records += records
+            self._write_sealed_index(number, offsets, records)
+        for dni, offset in offsets.items():
+            self._index[dni] = (number, offset)
+
+    def _write_sealed_index(self, number, offsets, records):
+        tmp = index_path(self.directory, number).with_suffix(".idx.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**offsets, "_registros": records}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, index_path(self.directory, number))
+
+    def _add_to_index(self, record, offset):
+        self.records += 1
+        self._active_records += 1
+        dni = record.get("dni")
+        if dni:
+            dni = str(dni)
+            self._index[dni] = (self._segment, offset)
+            self._active_index[dni] = offset
+
+    def append(self, record):
+        """
+        Append a record (a dict with at least 'dni').
+
+        Returns:
+            tuple: (segment, offset) where it was written
+        """
+        line = encode_record(record)
+        with self._lock:
+            if self._size and self._size + len(line) > self.segment_bytes:
+                self._rotate()
+            offset = self._size
+            self._file.write(line)
+            self._size += len(line)
+            self._add_to_index(record, offset)
+
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                self._sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.fsync_interval, self._sync_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            return self._segment, offset
+
+    def _sync(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+            self.fsyncs += 1
+
+    def _sync_on_timer(self):
+        with self._lock:
+            self._timer = None
+            if not self._file.closed:
+                self._sync()
+
+    def flush(self):
+        """Write and fsync everything appended so far"""
+        with self._lock:
+            self._sync()
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        self._write_sealed_index(self._segment, self._active_index, self._active_records)
+        self._segment += 1
+        self._active_index = {}
+        self._active_records = 0
+        self._file = open(segment_path(self.directory, self._segment), "ab")
+        self._size = 0
+        _fsync_directory(self.directory)
+        print(f"Patient log rotated to segment {self._segment}")  # Debug log
+
+    def get(self, dni):
+        """Latest record stored for a DNI, or None"""
+        with self._lock:
+            location = self._index.get(str(dni))
+            if location is None:
+                return None
+            segment, offset = location
+            if segment == self._segment:
+                self._file.flush()  # make buffered appends visible to the reader below
+        with open(segment_path(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __contains__(self, dni):
+        return str(dni) in self._index
+
+    def __iter__(self):
+        self.flush()
+        return iter_segment_records(self.directory)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "directorio": str(self.directory),
+                "registros": self.records,
+                "dnis": len(self._index),
+                "segmentos": self._segment,
+                "segmento_activo_bytes": self._size,
+                "pendientes_fsync": self._pending,
+                "fsyncs": self.fsyncs,
+            }
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+            self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_patient_log():
+    """Log of this server process, opened on first use"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = PatientLog()
+        return _log
+
+
+def export(directory, output, desde=None, hasta=None):
+    """
+    Write the records of a log to one JSONL file, optionally by fecha_registro.
+
+    Args:
+        desde (str): Minimum fecha_registro (YYYY-MM-DD), inclusive
+        hasta (str): Maximum fecha_registro (YYYY-MM-DD), exclusive
+
+    Returns:
+        int: Records written
+    """
+    written = 0
+    with open(output, "wb") as f:
+        for record in iter_segment_records(directory):
+            fecha = str(record.get("fecha_registro", ""))
+            if (desde and fecha < desde) or (hasta and fecha >= hasta):
+                continue
+            f.write(encode_record(record))
+            written += 1
+    return written
+
+
+def compact(directory, latest_only=False, segment_bytes=SEGMENT_BYTES, keep_backup=True):
+    """
+    Rewrite the log into full-size segments, dropping exact duplicate records
+    (e.g. re-queued writes) or, with latest_only, everything but each DNI's
+    latest record.
+
+    Needs the log closed: it takes the writer lock and fails while the app runs.
+    The old segments are moved to a backup directory (respaldo_<fecha>) inside
+    the log directory, which is left in place unless keep_backup is False:
+    after migrar they may be the only copy of the original records.
+
+    Returns:
+        dict: 'antes' and 'despues' record counts and 'respaldo' (backup path or None)
+    """
+    directory = Path(directory)
+    with PatientLog(directory) as log:
+        keep = set(log._index.values()) if latest_only else None
+        numbers = list_segments(directory)
+        work = directory / "compactando"
+        shutil.rmtree(work, ignore_errors=True)
+        work.mkdir()
+
+        seen = set()
+        before = after = 0
+        with PatientLog(work, segment_bytes=segment_bytes, fsync_every=1000) as out:
+            for number in numbers:
+                for offset, record in scan_segment(segment_path(directory, number)):
+                    before += 1
+                    if keep is not None and record.get("dni") and (number, offset) not in keep:
+                        continue
+                    digest = hashlib.blake2b(encode_record(record), digest_size=16).digest()
+                    if digest in seen:
+                        continue
+                    seen.add(digest)
+                    out.append(record)
+                    after += 1
+
+        backup = directory / f"respaldo_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        backup.mkdir()
+        for number in numbers:
+            for path in (segment_path(directory, number), index_path(directory, number)):
+                if path.exists():
+                    os.replace(path, backup / path.name)
+        for number in list_segments(work):
+            for path in (segment_path(work, number), index_path(work, number)):
+                if path.exists():
+                    os.replace(path, directory / path.name)
+        _fsync_directory(directory)
+        shutil.rmtree(work)
+        if not keep_backup:
+            shutil.rmtree(backup)
+            backup = None
+        log._file.close()  # its segment was replaced; reopening happens on the next PatientLog
+
+    return {"antes": before, "despues": after, "respaldo": str(backup) if backup else None}
+
+
+# Labels of the legacy .txt layout, for registrations whose .json is missing
+_TXT_FIELDS = {
+    "Nombre": "nombre",
+    "DNI": "dni",
+    "Fecha de nacimiento": "fecha_nacimiento",
+    "Teléfono": "telefono",
+    "Dirección": "direccion",
+    "Síntomas": "sintomas",
+    "Descripción adicional": "descripcion",
+    "Nivel de Triaje": "nivel_triage",
+    "Fecha y hora de registro": "fecha_registro",
+}
+
+_LEGACY_NAME = re.compile(r"^paciente_(.+)_(\d{8}_\d{6})\.txt$")
+
+
+def parse_legacy_text(path):
+    """Rebuild a registration dict from a legacy .txt file"""
+    datos = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            label, sep, value = line.strip().partition(": ")
+            if sep and label in _TXT_FIELDS:
+                datos[_TXT_FIELDS[label]] = value
+    datos["sintomas"] = [s for s in datos.get("sintomas", "").split(", ") if s]
+    return datos
+
+
+def migrate_legacy(directory=LOG_DIR, log=None, keep_files=False):
+    """
+    One-shot import of the paciente_*.txt / .txt.json files into the log.
+
+    Records are appended in registration order. The .json is used when
+    present, the .txt otherwise. Unless keep_files, the old files are then
+    packed into one legacy_<fecha>.tar.gz and deleted (running it again
+    with keep_files would import them twice).
+
+    Returns:
+        dict: 'migrados', 'solo_texto' (rebuilt from the .txt), 'errores', 'archivo'
+    """
+    directory = Path(directory)
+    legacy = []
+    for path in directory.glob("paciente_*.txt"):
+        match = _LEGACY_NAME.match(path.name)
+        stamp = match.group(2) if match else ""
+        legacy.append((stamp, path.name, path))
+    legacy.sort()
+
+    own_log = log is None
+    log = log or PatientLog(directory)
+    migrated = text_only = errors = 0
+    done = []
+    try:
+        for _, _, txt in legacy:
+            json_path = txt.with_name(txt.name + ".json")
+            try:
+                if json_path.exists():
+                    with open(json_path, encoding="utf-8") as f:
+                        datos = json.load(f)
+                else:
+                    datos = parse_legacy_text(txt)
+                    text_only += 1
+            except (OSError, ValueError) as e:
+                errors += 1
+                print(f"Skipping unreadable file {txt}: {str(e)}")
+                continue
+            log.append(datos)
+            migrated += 1
+            done += [p for p in (txt, json_path) if p.exists()]
+        log.flush()
+    finally:
+        if own_log:
+            log.close()
+
+    archive = None
+    if done and not keep_files:
+        archive = directory / f"legacy_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.tar.gz"
+        with tarfile.open(archive, "w:gz") as tar:
+            for path in done:
+                tar.add(path, arcname=path.name)
+        for path in done:
+            path.unlink()
+    return {"migrados": migrated, "solo_texto": text_only, "errores": errors, "archivo": archive}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro de pacientes en segmentos JSONL")
+    parser.add_argument("--dir", default=str(LOG_DIR), help="Directorio del registro")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    migrar = sub.add_parser("migrar", help="Importar los archivos .txt/.json anteriores")
+    migrar.add_argument("--conservar", action="store_true", help="No empaquetar ni borrar los archivos originales")
+
+    buscar = sub.add_parser("buscar", help="Último registro de un DNI")
+    buscar.add_argument("dni")
+
+    exportar = sub.add_parser("exportar", help="Exportar los registros a un archivo JSONL")
+    exportar.add_argument("-o", "--output", default="registros_pacientes.jsonl")
+    exportar.add_argument("--desde", default=None, help="Fecha mínima de registro (YYYY-MM-DD)")
+    exportar.add_argument("--hasta", default=None, help="Fecha máxima de registro, excluida (YYYY-MM-DD)")
+
+    compactar = sub.add_parser("compactar", help="Unir segmentos y quitar duplicados (con la aplicación detenida)")
+    compactar.add_argument("--solo-ultimo", action="store_true", help="Conservar solo el último registro de cada DNI")
+    compactar.add_argument("--sin-respaldo", action="store_true",
+                           help="Borrar los segmentos anteriores en lugar de conservarlos en respaldo_<fecha>")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    if args.comando == "migrar":
+        resultado = migrate_legacy(args.dir, keep_files=args.conservar)
+        print(f"{resultado['migrados']} registros migrados ({resultado['solo_texto']} desde .txt), "
+              f"{resultado['errores']} errores")
+        if resultado["archivo"]:
+            print(f"Archivos originales empaquetados en {resultado['archivo']}")
+    elif args.comando == "buscar":
+        with PatientLog(args.dir) as log:
+            datos = log.get(args.dni)
+        if datos is None:
+            print(f"No hay registros para el DNI {args.dni}")
+        else:
+            print(json.dumps(datos, ensure_ascii=False, indent=2, default=str))
+    elif args.comando == "exportar":
+        escritos = export(args.dir, args.output, args.desde, args.hasta)
+        print(f"{escritos} registros exportados a {args.output}")
+    elif args.comando == "compactar":
+        resultado = compact(args.dir, latest_only=args.solo_ultimo, keep_backup=not args.sin_respaldo)
+        print(f"{resultado['antes']} registros -> {resultado['despues']}")
+        if resultado["respaldo"]:
+            print(f"Segmentos anteriores conservados en {resultado['respaldo']}")
+
+    print(f"({time.perf_counter() - start:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,384 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+import httpx
+import streamlit as st
+
+from lookup_cache import TTLCache
+
+# Mock database of test DNIs served by the local stand-in registry
+MOCK_RECORDS = {
+    "12345678": {
+        "dni": "12345678",
+        "nombre": "Juan Pérez",
+        "fecha_nacimiento": "1980-05-15",
+        "telefono": "600123456",
+        "direccion": "Calle Principal 123",
+        "genero": "M",
+        "grupo_sanguineo": "A+",
+        "cuit": "20-12345678-9",
+        "nacionalidad": "Argentina"
+    },
+    "87654321": {
+        "dni": "87654321",
+        "nombre": "María García",
+        "fecha_nacimiento": "1992-09-23",
+        "telefono": "600789012",
+        "direccion": "Avenida Central 456",
+        "genero": "F",
+        "grupo_sanguineo": "O-",
+        "cuit": "27-87654321-4",
+        "nacionalidad": "Argentina"
+    },
+    "11111111": {
+        "dni": "11111111",
+        "nombre": "Carlos Rodríguez",
+        "fecha_nacimiento": "1975-12-01",
+        "telefono": "600345678",
+        "direccion": "Plaza Mayor 789",
+        "genero": "M",
+        "grupo_sanguineo": "B+",
+        "cuit": "20-11111111-1",
+        "nacionalidad": "Argentina"
+    },
+    "99999999": {
+        "dni": "99999999",
+        "nombre": "Pedro Gómez",
+        "fecha_nacimiento": "1985-07-10",
+        "telefono": "600987654",
+        "direccion": "Avenida Libertador 321",
+        "genero": "M",
+        "grupo_sanguineo": "AB+",
+        "cuit": "20-99999999-0",
+        "nacionalidad": "Argentina"
+    },
+    "1234567890": {
+        "dni": "1234567890",
+        "nombre": "Ana López",
+        "fecha_nacimiento": "1990-03-15",
+        "telefono": "600567890",
+        "direccion": "Plaza de la Libertad 123",
+        "genero": "F",
+        "grupo_sanguineo": "O+",
+        "cuit": "27-12345678-9",
+        "nacionalidad": "Paraguay"
+    }
+}
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+DNI_PATTERN = re.compile(r"^\d{1,15}$")
+
+
+class PublicRecordsError(Exception):
+    """Raised when the public registry cannot be reached or gives an unusable answer"""
+
+
+def validate_dni(dni):
+    """Return the DNI stripped of surrounding blanks; PublicRecordsError unless it is digits only"""
+    dni = str(dni).strip()
+    if not DNI_PATTERN.match(dni):
+        raise PublicRecordsError(f"Invalid DNI: {dni!r}")
+    return dni
+
+
+class StubRegistry:
+    """
+    Local stand-in for the government registry API.
+
+    Serves ``GET /personas/<dni>`` from ``records`` with a simulated latency
+    and a configurable share of injected 503 errors. It can be plugged into
+    PublicRecordsClient in-process (``transport()``) or run as a real HTTP
+    server (``serve()``) to exercise the network path.
+
+    Args:
+        records (dict): DNI -> record served by the stub (defaults to MOCK_RECORDS)
+        latency (float): Seconds to wait before answering
+        jitter (float): Extra random latency, uniformly drawn from [0, jitter]
+        error_rate (float): Probability of answering 503 instead of the record
+        seed (int): Seed for the error/jitter random generator
+    """
+
+    def __init__(self, records=None, latency=1.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.records = MOCK_RECORDS if records is None else records
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def _delay(self):
+        return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _respond(self, path):
+        prefix = "/personas/"
+        if not path.startswith(prefix):
+            return 404, {"error": "not found"}
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 503, {"error": "injected failure"}
+        record = self.records.get(path[len(prefix):])
+        if record is None:
+            return 404, {"error": "not found"}
+        return 200, record
+
+    def transport(self):
+        """httpx transport answering from this stub without opening sockets"""
+
+        async def handler(request):
+            await asyncio.sleep(self._delay())
+            status, body = self._respond(request.url.path)
+            return httpx.Response(status, json=body)
+
+        return httpx.MockTransport(handler)
+
+    def serve(self, host="127.0.0.1", port=8800):
+        """Run the stub as a blocking HTTP server"""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(stub._delay())
+                status, body = stub._respond(self.path)
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        print(f"Stub public registry listening on http://{host}:{port}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class PublicRecordsClient:
+    """
+    Pooled async client for the public registry API.
+
+    Requests share one ``httpx.AsyncClient`` (keep-alive connection pool)
+    driven by a private event loop thread, so synchronous callers such as the
+    Streamlit script thread can use ``lookup``/``lookup_many`` without
+    managing asyncio themselves. Found records are cached for ``cache_ttl``
+    seconds and "not found" answers for ``negative_ttl`` seconds; failures
+    are never cached.
+
+    Args:
+        base_url (str): Registry base URL
+        transport: Optional httpx transport (e.g. ``StubRegistry().transport()``)
+        timeout (float): Default seconds allowed per attempt
+        retries (int): Extra attempts after a timeout, connection error or 5xx/429
+        backoff (float): Base delay between attempts, doubled each retry
+        cache_ttl (float): Seconds a found record stays cached
+        negative_ttl (float): Seconds a "not found" answer stays cached
+        cache_size (int): Maximum cached DNIs per cache
+        max_concurrency (int): Concurrent requests allowed in batch lookups
+    """
+
+    def __init__(
+        self,
+        base_url="http://registro.local",
+        transport=None,
+        timeout=3.0,
+        retries=2,
+        backoff=0.2,
+        cache_ttl=600.0,
+        negative_ttl=60.0,
+        cache_size=4096,
+        max_concurrency=8,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self._found = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._not_found = TTLCache(maxsize=cache_size, ttl=negative_ttl)
+        self._requests = 0
+        self._retried = 0
+        self._failures = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="public-records-client", daemon=True
+        )
+        self._thread.start()
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _fetch(self, dni, timeout):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._retried += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            self._requests += 1
+            try:
+                response = await asyncio.wait_for(self._client.get(f"/personas/{quote(dni, safe='')}"), timeout)
+            except (asyncio.TimeoutError, httpx.TransportError) as e:
+                last_error = e
+                continue
+            if response.status_code == 404:
+                return None
+            if response.status_code in RETRYABLE_STATUS:
+                last_error = PublicRecordsError(f"HTTP {response.status_code}")
+                continue
+            try:
+                response.raise_for_status()
+                record = response.json()
+            except (httpx.HTTPStatusError, ValueError) as e:  # 4xx, or a body that isn't JSON
+                self._failures += 1
+                raise PublicRecordsError(f"Public registry lookup for {dni} failed: {e!r}") from e
+            if not isinstance(record, dict):
+                self._failures += 1
+                raise PublicRecordsError(f"Public registry lookup for {dni} returned {type(record).__name__}")
+            return record
+
+        self._failures += 1
+        raise PublicRecordsError(
+            f"Public registry lookup for {dni} failed after {self.retries + 1} attempts: {last_error!r}"
+        )
+
+    async def alookup(self, dni, timeout=None):
+        """Async lookup of one DNI; returns the record or None if it does not exist"""
+        dni = validate_dni(dni)
+        record = self._found.get(dni)
+        if record is not None:
+            return dict(record)
+        if self._not_found.get(dni):
+            return None
+
+        record = await self._fetch(dni, timeout or self.timeout)
+        if record is None:
+            self._not_found.set(dni, True)
+            return None
+        self._found.set(dni, record)
+        return dict(record)
+
+    async def alookup_many(self, dnis, timeout=None):
+        """Async lookup of many DNIs with bounded concurrency; failed lookups map to the exception"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        unique = list(dict.fromkeys(dnis))
+
+        async def one(dni):
+            async with semaphore:
+                try:
+                    return await self.alookup(dni, timeout)
+                except PublicRecordsError as e:
+                    return e
+
+        results = await asyncio.gather(*(one(dni) for dni in unique))
+        return dict(zip(unique, results))
+
+    def lookup(self, dni, timeout=None):
+        """Blocking wrapper around alookup, safe to call from any thread"""
+        return self._run(self.alookup(dni, timeout))
+
+    def lookup_many(self, dnis, timeout=None):
+        """Blocking wrapper around alookup_many, safe to call from any thread"""
+        return self._run(self.alookup_many(dnis, timeout))
+
+    def stats(self):
+        """Request, retry and cache counters"""
+        return {
+            "requests": self._requests,
+            "retries": self._retried,
+            "failures": self._failures,
+            "found_cache": self._found.stats(),
+            "not_found_cache": self._not_found.stats(),
+        }
+
+    def close(self):
+        """Close pooled connections and stop the event loop thread"""
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+@st.cache_resource
+def get_public_records_client():
+    """Registry client shared by every session of this Streamlit server process"""
+    base_url = st.secrets.get("PUBLIC_API_URL")
+    transport = None
+    if not base_url:
+        # No real registry configured: answer from the in-process stand-in
+        base_url = "http://registro.local"
+        transport = StubRegistry(latency=float(st.secrets.get("PUBLIC_API_STUB_LATENCY", 1.0))).transport()
+
+    return PublicRecordsClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=float(st.secrets.get("PUBLIC_API_TIMEOUT", 3.0)),
+        retries=int(st.secrets.get("PUBLIC_API_RETRIES", 2)),
+        cache_ttl=float(st.secrets.get("PUBLIC_API_CACHE_TTL", 600)),
+        negative_ttl=float(st.secrets.get("PUBLIC_API_NEGATIVE_TTL", 60)),
+    )
+
+
+def lookup_public_records(dni):
+    """Like check_public_records, but raise PublicRecordsError when the lookup fails"""
+    return get_public_records_client().lookup(dni)
+
+
 def check_public_records(dni):
     """
-    Mock function to simulate checking public records.
-    In production, this would connect to actual government APIs.
+    Check the public registry for a DNI.
+
+    Uses the registry configured as PUBLIC_API_URL in secrets, or the local
+    stand-in registry when none is configured.
     
     Args:
         dni (str): DNI/NIE number to check
         
     Returns:
-        dict: Mock patient data if DNI matches test cases, None otherwise
+        dict: Patient data if the DNI exists, None if it does not or the registry is unreachable
     """
-    # Mock database of test DNIs
-    mock_records = {
-        "12345678": {
-            "dni": "12345678",
-            "nombre": "Juan Pérez",
-            "fecha_nacimiento": "1980-05-15",
-            "telefono": "600123456",
-            "direccion": "Calle Principal 123",
-            "genero": "M",
-            "grupo_sanguineo": "A+",
-            "cuit": "20-12345678-9",
-            "nacionalidad": "Argentina"
-        },
-        "87654321": {
-            "dni": "87654321",
-            "nombre": "María García",
-            "fecha_nacimiento": "1992-09-23",
-            "telefono": "600789012",
-            "direccion": "Avenida Central 456",
-            "genero": "F",
-            "grupo_sanguineo": "O-",
-            "cuit": "27-87654321-4",
-            "nacionalidad": "Argentina"
-        },
-        "11111111": {
-            "dni": "11111111",
-            "nombre": "Carlos Rodríguez",
-            "fecha_nacimiento": "1975-12-01",
-            "telefono": "600345678",
-            "direccion": "Plaza Mayor 789",
-            "genero": "M",
-            "grupo_sanguineo": "B+",
-            "cuit": "20-11111111-1",
-            "nacionalidad": "Argentina"
-        },
-        "99999999": {
-            "dni": "99999999",
-            "nombre": "Pedro Gómez",
-            "fecha_nacimiento": "1985-07-10",
-            "telefono": "600987654",
-            "direccion": "Avenida Libertador 321",
-            "genero": "M",
-            "grupo_sanguineo": "AB+",
-            "cuit": "20-99999999-0",
-            "nacionalidad": "Argentina"
-        },
-        "1234567890": {
-            "dni": "1234567890",
-            "nombre": "Ana López",
-            "fecha_nacimiento": "1990-03-15",
-            "telefono": "600567890",
-            "direccion": "Plaza de la Libertad 123",
-            "genero": "F",
-            "grupo_sanguineo": "O+",
-            "cuit": "27-12345678-9",
-            "nacionalidad": "Paraguay"
-        }
-    }
-    
-    # Simulate API delay
-    import time
-    time.sleep(1)
-    
-    # Return mock data if DNI exists in our test cases
-    return mock_records.get(dni) 
\ No newline at end of file
+    try:
+        return lookup_public_records(dni)
+    except PublicRecordsError as e:
+        print(f"Error in check_public_records: {str(e)}")  # Debug log
+        return None
+
+
+def check_public_records_batch(dnis):
+    """
+    Check many DNIs at once, e.g. when registering a group of patients.
+
+    Returns:
+        dict: DNI -> patient data, or None if not found or the lookup failed
+    """
+    results = get_public_records_client().lookup_many(dnis)
+    for dni, result in results.items():
+        if isinstance(result, PublicRecordsError):
+            print(f"Error in check_public_records_batch for {dni}: {str(result)}")  # Debug log
+            results[dni] = None
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Registro público simulado para pruebas locales")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=1.0, help="Segundos de demora por respuesta")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Demora aleatoria adicional máxima")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proporción de respuestas 503")
+    args = parser.parse_args()
+
+    StubRegistry(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate
+    ).serve(args.host, args.port)
@@ -0,0 +1,150 @@
+"""
+Re-score historical triage records under a modified rule set.
+
+Streams triage_records from PostgreSQL in chunks (server-side cursor), scores
+every chunk under the current rules and under the new ones with vectorized
+vital-sign thresholds, and reports how many records would move between
+levels. The ids of the records whose level changes are written to a CSV.
+
+The new rules are a full rules file (see reglas_triaje.json) or a JSON file
+overriding only part of the current ones:
+
+    {
+        "version": "borrador-saturacion",
+        "umbrales": {"saturacion_critica": 92, "temperatura_urgente": 38.5},
+        "sintomas": {"critico": ["respirar", "pecho", "inconsciente"]}
+    }
+
+    python rescore_triage.py reglas_nuevas.json --desde 2024-01-01 -o cambios.csv
+"""
+import argparse
+import csv
+import json
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from db_utils import iter_triage_record_chunks
+from model import NIVELES, contar_signos_vitales_vectorizado, contar_sintomas, niveles_vectorizados
+from nlp_processor import process_text_to_keywords
+from triage_rules import CATEGORIAS, get_rules
+
+COLUMNAS = ['id', 'nivel_triage', 'temperatura', 'saturacion_oxigeno', 'frecuencia_cardiaca', 'notas', 'sintomas']
+
+
+def cargar_reglas(path=None):
+    """The current RuleSet, with the contents of a JSON file applied over it if a path is given"""
+    reglas = get_rules()
+    if path:
+        with open(path, encoding='utf-8') as f:
+            reglas = reglas.with_overrides(json.load(f))
+    return reglas
+
+
+@lru_cache(maxsize=8192)
+def palabras_clave(notas, vocabulary):
+    # Extracted once per distinct note; shared by both rule sets when their vocabulary is the same
+    return tuple(process_text_to_keywords(notas, vocabulary=vocabulary))
+
+
+def puntuar(reglas, notas, sintomas, temp, sat_o2, fc):
+    """Level index (into NIVELES) of every record of a chunk under one rule set"""
+    categorias = reglas.categorias
+    filas = []
+    for texto, lista in zip(notas, sintomas):
+        fila = [0, 0, 0]
+        if texto:
+            contar_sintomas(palabras_clave(texto, reglas.vocabulary), fila, categorias)
+        contar_sintomas(lista, fila, categorias)
+        filas.append(fila)
+    conteos = np.array(filas, dtype=np.int64).reshape(len(filas), len(CATEGORIAS)).T
+    conteos = conteos + contar_signos_vitales_vectorizado(temp, sat_o2, fc, reglas.umbrales)
+    return niveles_vectorizados(*conteos)
+
+
+def rescore(reglas_anteriores, reglas_nuevas, salida, chunk_size=5000, desde=None, hasta=None):
+    """
+    Compare both rule sets over every triage record in the date range.
+
+    Returns:
+        dict: 'transiciones' (matrix [anterior][nuevo] of record counts),
+              'registros', 'cambiados', 'difiere_guardado' (records whose stored
+              level differs from the one the current rules give) and 'seconds'
+    """
+    n = len(NIVELES)
+    transiciones = np.zeros((n, n), dtype=np.int64)
+    registros = cambiados = difiere_guardado = 0
+    start = time.perf_counter()
+
+    with open(salida, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'nivel_anterior', 'nivel_nuevo'])
+
+        for rows in iter_triage_record_chunks(COLUMNAS, chunk_size, desde, hasta):
+            ids, guardados, temp, sat_o2, fc, notas, sintomas = zip(*rows)
+            sintomas = [lista or () for lista in sintomas]
+            temp, sat_o2, fc = (np.array(columna, dtype=float) for columna in (temp, sat_o2, fc))
+
+            anterior = puntuar(reglas_anteriores, notas, sintomas, temp, sat_o2, fc)
+            nuevo = puntuar(reglas_nuevas, notas, sintomas, temp, sat_o2, fc)
+
+            transiciones += np.bincount(anterior * n + nuevo, minlength=n * n).reshape(n, n)
+            cambio = np.flatnonzero(anterior != nuevo)
+            writer.writerows((ids[i], NIVELES[anterior[i]], NIVELES[nuevo[i]]) for i in cambio)
+
+            registros += len(rows)
+            cambiados += len(cambio)
+            difiere_guardado += sum(g != NIVELES[a] for g, a in zip(guardados, anterior))
+            print(f"{registros} registros procesados, {cambiados} cambian de nivel")  # Debug log
+
+    return {
+        'version_anterior': reglas_anteriores.version,
+        'version_nueva': reglas_nuevas.version,
+        'transiciones': transiciones,
+        'registros': registros,
+        'cambiados': cambiados,
+        'difiere_guardado': difiere_guardado,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def imprimir_transiciones(transiciones):
+    etiquetas = [nivel.split(' - ')[0] for nivel in NIVELES]
+    encabezado = "anterior \\ nuevo"
+    print(f"\n{encabezado:<18}" + "".join(f"{e:>10}" for e in etiquetas))
+    for etiqueta, fila in zip(etiquetas, transiciones):
+        print(f"{etiqueta:<18}" + "".join(f"{v:>10}" for v in fila))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-evaluar registros históricos de triaje con reglas nuevas")
+    parser.add_argument("reglas_nuevas", help="JSON con los umbrales/síntomas modificados")
+    parser.add_argument("--reglas-anteriores", default=None, help="JSON de referencia (por defecto, reglas_triaje.json)")
+    parser.add_argument("-o", "--output", default="cambios_triage.csv", help="CSV con los ids que cambian de nivel")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--desde", default=None, help="Fecha mínima de triaje (YYYY-MM-DD)")
+    parser.add_argument("--hasta", default=None, help="Fecha máxima de triaje, excluida (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    resultado = rescore(
+        cargar_reglas(args.reglas_anteriores),
+        cargar_reglas(args.reglas_nuevas),
+        args.output,
+        chunk_size=args.chunk_size,
+        desde=args.desde,
+        hasta=args.hasta,
+    )
+
+    print(f"Reglas {resultado['version_anterior']} -> {resultado['version_nueva']}")
+    imprimir_transiciones(resultado['transiciones'])
+    print(
+        f"\n{resultado['cambiados']} de {resultado['registros']} registros cambian de nivel "
+        f"({resultado['seconds']:.1f}s) -> {args.output}"
+    )
+    if resultado['difiere_guardado']:
+        print(f"{resultado['difiere_guardado']} registros ya tenían guardado un nivel distinto al de las reglas actuales")
+
+
+if __name__ == "__main__":
+    main()
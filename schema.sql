@@ -1,3 +1,6 @@
+-- Every statement is idempotent: setup_database.py runs this file in one transaction on new and
+-- existing databases alike, so a single failing statement would roll back the migrations below.
+
 -- Create patients table
 CREATE TABLE IF NOT EXISTS patients (
     id SERIAL PRIMARY KEY,
@@ -27,10 +30,20 @@ CREATE TABLE IF NOT EXISTS triage_records (
     notas TEXT,
     fecha_triage TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     verificado_por VARCHAR(100),
+    version_reglas VARCHAR(50),
+    clave_idempotencia VARCHAR(36),
     FOREIGN KEY (patient_id) REFERENCES patients(id)
 );
 
+-- Rule-set version (reglas_triaje.json) that produced nivel_triage; for databases created before it
+ALTER TABLE triage_records ADD COLUMN IF NOT EXISTS version_reglas VARCHAR(50);
+
+-- Key of the totem outbox entry (outbox.py) that created the record; makes re-sent batches no-ops
+ALTER TABLE triage_records ADD COLUMN IF NOT EXISTS clave_idempotencia VARCHAR(36);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_triage_clave_idempotencia ON triage_records(clave_idempotencia);
+
 -- Add some indexes for better performance
-CREATE INDEX idx_patients_dni ON patients(dni);
-CREATE INDEX idx_triage_patient_id ON triage_records(patient_id);
-CREATE INDEX idx_triage_fecha ON triage_records(fecha_triage); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_patients_dni ON patients(dni);
+-- Serves per-patient history pages (keyset on fecha_triage, id) as one index range scan
+CREATE INDEX IF NOT EXISTS idx_triage_patient_fecha ON triage_records(patient_id, fecha_triage DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_triage_fecha ON triage_records(fecha_triage); 
\ No newline at end of file
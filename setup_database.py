@@ -8,6 +8,7 @@ def setup_database():
         sql_commands = file.read()
 
     # Connect to the database
+    conn = None
     try:
         conn = psycopg2.connect(
             dbname=secrets.DB_NAME,
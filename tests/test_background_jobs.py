@@ -0,0 +1,21 @@
+from background_jobs import COMPLETADO, JobQueue
+
+
+def test_retried_job_keeps_its_place():
+    done = []
+    failures = {"primero": 2}
+
+    def run(name):
+        if failures.get(name):
+            failures[name] -= 1
+            raise OSError("printer offline")
+        done.append(name)
+
+    jobs = JobQueue(maxsize=10, name="test-jobs")
+    first = jobs.submit("ticket", run, "primero", backoff=0.01)
+    second = jobs.submit("ticket", run, "segundo", backoff=0.01)
+
+    assert jobs.join(timeout=5)
+    assert done == ["primero", "segundo"]
+    assert first.estado == second.estado == COMPLETADO
+    assert first.intentos == 3
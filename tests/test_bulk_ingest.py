@@ -0,0 +1,28 @@
+from bulk_ingest import triage_row
+from db_utils import _prepare_keyed_triage_batch
+
+REGISTRO = {
+    "dni": "30123456",
+    "nivel_triage": {"nivel": "NIVEL 3 - Urgencia", "version_reglas": "2026.1"},
+    "sintomas": ["fiebre", "tos"],
+    "temperatura": 38.5,
+    "fecha_registro": "2026-01-02 03:04:05",
+}
+
+
+def test_same_source_record_gets_the_same_key():
+    first = _prepare_keyed_triage_batch([triage_row(REGISTRO)])
+    again = _prepare_keyed_triage_batch([triage_row(dict(REGISTRO))])
+    assert first[0]["clave_idempotencia"] == again[0]["clave_idempotencia"]
+    assert len(first[0]["clave_idempotencia"]) == 36  # fits clave_idempotencia VARCHAR(36)
+
+
+def test_different_records_get_different_keys():
+    later = dict(REGISTRO, fecha_registro="2026-01-02 03:04:06")
+    keys = {row["clave_idempotencia"] for row in _prepare_keyed_triage_batch([triage_row(REGISTRO), triage_row(later)])}
+    assert len(keys) == 2
+
+
+def test_explicit_key_is_kept():
+    row = dict(triage_row(REGISTRO), clave_idempotencia="k-1")
+    assert _prepare_keyed_triage_batch([row])[0]["clave_idempotencia"] == "k-1"
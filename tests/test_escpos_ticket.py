@@ -0,0 +1,29 @@
+import socket
+import threading
+
+from escpos_ticket import SocketSink, _text
+
+
+def test_text_outside_cp1252_keeps_base_letters(capsys):
+    assert _text("Muñoz") == "Muñoz".encode("cp1252")
+    assert _text("Ōsaka Łukasz 王") == b"Osaka ?ukasz ?"
+    assert "outside cp1252" in capsys.readouterr().out
+
+
+def test_socket_sink_sends_with_separate_timeouts():
+    server = socket.create_server(("127.0.0.1", 0))
+    received = []
+
+    def accept():
+        conn, _ = server.accept()
+        with conn:
+            received.append(conn.recv(1024))
+
+    thread = threading.Thread(target=accept)
+    thread.start()
+    sink = SocketSink("127.0.0.1", server.getsockname()[1], timeout=2.0, connect_timeout=0.5)
+    sink.send(b"\x1b@hola")
+    thread.join(2)
+    server.close()
+
+    assert received == [b"\x1b@hola"]
@@ -0,0 +1,66 @@
+import pytest
+
+from model import NIVELES, predict_triage
+from nlp_processor import process_text_to_keywords, suggest_corrections
+
+# Ordinary Spanish sentences that fuzzy correction used to turn into medical terms
+FRASES_COMUNES = [
+    ("Paciente tranquilo, puede esperar en la sala", "respirar"),
+    ("debe respetar la dieta", "respirar"),
+    ("toma su medicación diaria", "diarrea"),
+    ("respira bien", "respirar"),
+]
+
+
+@pytest.mark.parametrize("texto,termino", FRASES_COMUNES)
+def test_common_words_are_not_keywords(texto, termino):
+    assert termino not in process_text_to_keywords(texto)
+
+
+@pytest.mark.parametrize("texto,termino", FRASES_COMUNES)
+def test_common_words_do_not_raise_triage_level(texto, termino):
+    resultado = predict_triage({"observaciones": texto, "sintomas": []})
+    assert resultado["nivel"] == NIVELES[-1]
+    assert resultado["conteos"] == {"critico": 0, "urgente": 0, "no_urgente": 0}
+
+
+@pytest.mark.parametrize("texto,termino", FRASES_COMUNES)
+def test_common_words_get_no_suggestions(texto, termino):
+    assert suggest_corrections(texto) == []
+
+
+def test_exact_terms_still_match():
+    assert process_text_to_keywords("Tiene fiebre y vómitos") == ["fiebre", "vómito"]
+
+
+def test_typos_are_only_suggested():
+    pytest.importorskip("wordfreq")
+    texto = "Refiere diarea y le cuesta resprar"
+    assert process_text_to_keywords(texto) == []
+    sugerencias = {s["original"]: s["sugerencia"] for s in suggest_corrections(texto)}
+    assert sugerencias == {"diarea": "diarrea", "resprar": "respirar"}
+
+
+def test_without_wordfreq_bundled_list_filters_suggestions(monkeypatch):
+    import nlp_processor
+
+    monkeypatch.setattr(nlp_processor, "zipf_frequency", None)
+    vocabulario = nlp_processor.Vocabulary(nlp_processor.MEDICAL_TERMS)
+    assert nlp_processor.common_words_source()["fuente"] == "lista incluida"
+
+    for texto, _ in FRASES_COMUNES:
+        assert suggest_corrections(texto, vocabulario) == []
+    sugerencias = {s["original"]: s["sugerencia"]
+                   for s in suggest_corrections("Refiere diarea y le cuesta resprar", vocabulario)}
+    assert sugerencias == {"diarea": "diarrea", "resprar": "respirar"}
+
+
+def test_keywords_include_phrases_and_their_words():
+    texto = "El paciente presenta dolor en el pecho y dificultad para respirar"
+    assert process_text_to_keywords(texto) == [
+        "dolor", "dolor en el pecho", "pecho", "dificultad", "dificultad para respirar", "respirar",
+    ]
+
+
+def test_keywords_are_spelled_as_in_the_vocabulary():
+    assert process_text_to_keywords("Vómitos, NÁUSEAS y convulsiones. Tos") == ["vómito", "nausea", "convulsion", "tos"]
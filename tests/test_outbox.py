@@ -0,0 +1,79 @@
+import sqlite3
+
+from outbox import Outbox, SyncUnavailable
+
+
+def failing_sync(entries):
+    raise ValueError("column clave_idempotencia does not exist")
+
+
+def test_data_errors_end_in_dead_letter(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"), failing_sync, base_delay=0, max_attempts=3)
+    outbox.enqueue("triaje", "30123456", {"notas": "fiebre"})
+
+    for _ in range(5):
+        outbox.sync_once()
+
+    stats = outbox.stats()
+    assert stats["pendientes"] == 0
+    assert stats["descartados"] == 1
+    [entry] = outbox.dead_letters()
+    assert entry["fallos"] == 3
+    assert "clave_idempotencia" in entry["ultimo_error"]
+
+
+def test_outage_does_not_count_towards_dead_letter(tmp_path):
+    def unavailable(entries):
+        raise SyncUnavailable("connection refused")
+
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"), unavailable, base_delay=0, max_delay=0, max_attempts=2)
+    outbox.enqueue("paciente", "30123456", {"nombre": "Ana"})
+
+    for _ in range(4):
+        outbox.sync_once()
+
+    stats = outbox.stats()
+    assert stats["descartados"] == 0
+    assert stats["con_reintentos"] == 1
+
+
+def test_retry_dead_letters_puts_entries_back(tmp_path):
+    synced = []
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"), failing_sync, base_delay=0, max_attempts=1)
+    outbox.enqueue("triaje", "30123456", {"notas": "fiebre"})
+    outbox.sync_once()
+    assert outbox.stats()["descartados"] == 1
+
+    outbox.sync_batch = synced.extend
+    assert outbox.retry_dead_letters() == 1
+    assert outbox.sync_once() == 1
+    assert outbox.stats()["descartados"] == 0
+    assert len(synced) == 1
+
+
+def test_migrates_outbox_files_without_dead_letter_columns(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, clave TEXT UNIQUE NOT NULL, "
+        "tipo TEXT NOT NULL, dni TEXT NOT NULL, datos TEXT NOT NULL, creado REAL NOT NULL, "
+        "intentos INTEGER NOT NULL DEFAULT 0, proximo_intento REAL NOT NULL DEFAULT 0, "
+        "ultimo_error TEXT, sincronizado REAL)"
+    )
+    db.execute("INSERT INTO outbox (clave, tipo, dni, datos, creado) VALUES ('k', 'paciente', '1', '{}', 0)")
+    db.commit()
+    db.close()
+
+    outbox = Outbox(path, failing_sync, base_delay=0, max_attempts=1)
+    outbox.sync_once()
+    assert outbox.stats()["descartados"] == 1
+
+
+def test_on_synced_runs_after_entries_leave_pending(tmp_path):
+    seen = []
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"), lambda entries: None,
+                    on_synced=lambda entries: seen.append(outbox.pending("30123456")))
+    outbox.enqueue("triaje", "30123456", {"notas": "fiebre"})
+
+    assert outbox.sync_once() == 1
+    assert seen == [[]]
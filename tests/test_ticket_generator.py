@@ -0,0 +1,30 @@
+import datetime
+
+import pytest
+
+from ticket_generator import generate_ticket, generate_tickets, render_ticket_canvas
+
+
+def ticket(nombre):
+    return {
+        "patient": {"nombre": nombre, "dni": "30123456"},
+        "symptoms": {"sintomas": ["fiebre", "dolor de cabeza", "vómito", "tos"]},
+        "triage_score": "NIVEL 2 - Emergencia",
+        "timestamp": datetime.datetime(2026, 1, 2, 3, 4, 5),
+        "diagnosis": "Pendiente de evaluación médica",
+    }
+
+
+@pytest.mark.parametrize("nombre", [
+    "Ana Pérez",
+    "José Muñoz (hijo) \\ Ñandú",
+    "Łukasz Wójcik",
+    "王小明",
+])
+def test_template_matches_canvas(nombre):
+    assert generate_ticket(ticket(nombre)) == render_ticket_canvas(ticket(nombre))
+
+
+def test_bulk_rendering_matches_single():
+    tickets = [ticket("Ana Pérez"), ticket("Łukasz Wójcik")]
+    assert generate_tickets(tickets) == [generate_ticket(data) for data in tickets]
@@ -1,28 +1,165 @@
 from reportlab.pdfgen import canvas
 import datetime
+import io
+import re
+from functools import lru_cache
 
-def generate_ticket(ticket_data):
-    """Generate a PDF ticket with patient and triage information"""
-    c = canvas.Canvas("ticket.pdf")
-    c.setFont("Helvetica", 12)
-    
-    # Header
-    c.drawString(100, 750, "TICKET DE ATENCIÓN")
-    c.drawString(100, 725, f"Fecha: {ticket_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    # Patient info
-    c.drawString(100, 700, f"Paciente: {ticket_data['patient']['nombre']}")
-    c.drawString(100, 675, f"DNI: {ticket_data['patient']['dni']}")
-    
-    # Triage info
-    c.drawString(100, 650, f"Nivel de Triaje: {ticket_data['triage_score']}")
-    c.drawString(100, 625, f"Síntomas principales: {', '.join(ticket_data['symptoms']['sintomas'][:3])}")
-    
-    # Diagnosis (if available)
+FONT = "Helvetica"
+FONT_SIZE = 12
+TITLE = "Ticket de atención"
+
+# Invariant text, drawn once into the cached template
+STATIC_LINES = [
+    (100, 750, "TICKET DE ATENCIÓN"),
+    (100, 50, "Por favor, espere a ser llamado"),
+]
+
+
+def ticket_lines(ticket_data):
+    """Per-patient text lines as (x, y, text)"""
     diagnosis = ticket_data.get('diagnosis', 'Pendiente de evaluación médica')
-    c.drawString(100, 600, f"Diagnóstico: {diagnosis}")
-    
-    # Footer
-    c.drawString(100, 50, "Por favor, espere a ser llamado")
-    
-    c.save() 
\ No newline at end of file
+    return [
+        (100, 725, f"Fecha: {ticket_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}"),
+        # Patient info
+        (100, 700, f"Paciente: {ticket_data['patient']['nombre']}"),
+        (100, 675, f"DNI: {ticket_data['patient']['dni']}"),
+        # Triage info
+        (100, 650, f"Nivel de Triaje: {ticket_data['triage_score']}"),
+        (100, 625, f"Síntomas principales: {', '.join(ticket_data['symptoms']['sintomas'][:3])}"),
+        # Diagnosis (if available)
+        (100, 600, f"Diagnóstico: {diagnosis}"),
+    ]
+
+
+def render_ticket_canvas(ticket_data, output=None):
+    """
+    Draw the ticket with a fresh reportlab canvas (the original, slower path)
+
+    Args:
+        output: File path or binary file object (defaults to an in-memory buffer)
+
+    Returns:
+        bytes: The PDF when output is None, else None
+    """
+    buffer = io.BytesIO() if output is None else output
+    c = canvas.Canvas(buffer, pageCompression=0, invariant=1)
+    c.setTitle(TITLE)
+    c.setFont(FONT, FONT_SIZE)
+    for x, y, text in STATIC_LINES + ticket_lines(ticket_data):
+        c.drawString(x, y, text)
+    c.save()
+    return buffer.getvalue() if output is None else None
+
+
+class TicketTemplate:
+    """
+    A one-page PDF built once by reportlab (catalog, page tree, font, header
+    and footer) with room to splice in each ticket's text.
+
+    Per ticket only the page content stream is produced: the patient lines
+    are appended to the static drawing operators, the stream length and the
+    cross-reference offsets after it are adjusted, and everything else is
+    reused byte for byte.
+    """
+
+    def __init__(self):
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pageCompression=0, invariant=1)
+        c.setTitle(TITLE)
+        c.setFont(FONT, FONT_SIZE)
+        for x, y, text in STATIC_LINES:
+            c.drawString(x, y, text)
+        c.save()
+        pdf = buffer.getvalue()
+
+        contents = int(re.search(rb"/Contents (\d+) 0 R", pdf).group(1))
+        obj = re.search(rb"\n%d 0 obj\n<<\n/Length (\d+)\n>>\nstream\r?\n" % contents, pdf)
+        stream_start = obj.end()
+        stream_end = stream_start + int(obj.group(1))
+        xref_start = pdf.index(b"\nxref\n") + 1
+        trailer_start = pdf.index(b"trailer\n", xref_start)
+
+        self._head = pdf[:obj.start(1)]            # ... up to the stream /Length value
+        self._stream_open = pdf[obj.end(1):stream_start]
+        static_ops = pdf[stream_start:stream_end]
+        # Keep the trailing whitespace after the last operator for the spliced lines
+        self._static_ops = static_ops.rstrip()
+        self._static_tail = static_ops[len(self._static_ops):]
+        self._between = pdf[stream_end:xref_start]  # endstream ... endobj ... (later objects)
+        self._trailer = pdf[trailer_start:pdf.rindex(b"startxref")]
+        self._stream_offset = stream_start
+        self._body_length = xref_start
+
+        # xref entries: objects located after the content stream move with its length
+        lines = pdf[xref_start:trailer_start].split(b"\n")
+        self._xref_header = lines[:2]
+        self._xref_entries = [(int(line[:10]), line[10:]) for line in lines[2:] if line]
+
+        # Same operators reportlab's drawString emits for a text line
+        self._line_format = b"\nBT 1 0 0 1 %s %s Tm (%s) Tj T* ET"
+
+    @staticmethod
+    def _escape(text):
+        # reportlab encodes the standard fonts as WinAnsi and writes non-ASCII bytes as octal;
+        # text outside cp1252 raises UnicodeEncodeError (see _render)
+        raw = text.encode("cp1252")
+        out = bytearray()
+        for byte in raw:
+            if byte in b"()\\":
+                out += b"\\" + bytes([byte])
+            elif byte < 32 or byte > 126:
+                out += b"\\%03o" % byte
+            else:
+                out.append(byte)
+        return bytes(out)
+
+    def render(self, lines):
+        """PDF bytes for the template plus the given (x, y, text) lines"""
+        ops = self._static_ops + b"".join(
+            self._line_format % (str(x).encode(), str(y).encode(), self._escape(text))
+            for x, y, text in lines
+        ) + self._static_tail
+        length = str(len(ops)).encode()
+
+        body = b"".join((self._head, length, self._stream_open, ops, self._between))
+        delta = len(body) - self._body_length
+        xref = b"\n".join(
+            self._xref_header + [
+                b"%010d%s" % (offset + delta if offset > self._stream_offset else offset, rest)
+                for offset, rest in self._xref_entries
+            ]
+        ) + b"\n"
+        return body + xref + self._trailer + b"startxref\n%d\n%%%%EOF\n" % len(body)
+
+
+@lru_cache(maxsize=1)
+def get_ticket_template():
+    """Template shared by every ticket rendered in this process"""
+    return TicketTemplate()
+
+
+def _render(template, ticket_data):
+    try:
+        return template.render(ticket_lines(ticket_data))
+    except UnicodeEncodeError as e:
+        # e.g. 'Łukasz' or CJK names: reportlab's canvas switches fonts for them instead of printing '?'
+        print(f"Ticket text outside cp1252 ({str(e)}), rendering with the canvas")  # Debug log
+        return render_ticket_canvas(ticket_data)
+
+
+def generate_ticket(ticket_data):
+    """Generate a PDF ticket with patient and triage information
+
+    Rendered in memory from the cached template (or the canvas, for text the
+    template's WinAnsi font can't show); nothing is written to disk.
+
+    Returns:
+        bytes: The PDF document
+    """
+    return _render(get_ticket_template(), ticket_data)
+
+
+def generate_tickets(tickets):
+    """Render many tickets (e.g. reprints or bulk exports); returns a list of PDF bytes"""
+    template = get_ticket_template()
+    return [_render(template, ticket_data) for ticket_data in tickets]
@@ -0,0 +1,164 @@
+"""
+Opt-in instrumentation of the triage model.
+
+Disabled by default. ``model.predict_triage`` then only checks ``enabled``
+and runs unchanged. When enabled (``enable()`` or TRIAGE_METRICS=1), every
+prediction:
+- carries a ``traza`` listing the exact rules that fired;
+- feeds process-wide counters per rule;
+- feeds latency histograms per stage and per deciding rule.
+
+``snapshot`` returns everything as a dict; ``export_prometheus`` renders
+the same data in the Prometheus text format for dashboards.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+enabled = os.environ.get("TRIAGE_METRICS", "").lower() in ("1", "true", "yes")
+
+# Histogram bucket upper bounds in seconds (10 µs .. 100 ms)
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 1e-1)
+
+RECENT_TRACES = 100
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (cumulative on export, like Prometheus)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot: above the largest bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"count": self.count, "sum_s": self.sum, "buckets": cumulative}
+
+
+class TriageMetrics:
+    """Process-wide rule counters, latency histograms and the last few traces"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.predictions = 0
+            self.rule_hits = {}
+            self.stage_latency = {}
+            self.decision_latency = {}
+            self.recent = deque(maxlen=RECENT_TRACES)
+
+    def record(self, trace, stages, total_seconds, predictions=1):
+        """
+        Add one prediction (or one batch) to the metrics.
+
+        Args:
+            trace (list): Rule hits, dicts with at least 'regla'
+            stages (dict): stage name -> seconds
+            total_seconds (float): Whole prediction latency
+            predictions (int): Records scored (batches count each one)
+        """
+        with self._lock:
+            self.predictions += predictions
+            decision = None
+            for hit in trace:
+                regla = hit["regla"]
+                self.rule_hits[regla] = self.rule_hits.get(regla, 0) + hit.get("veces", 1)
+                if regla.startswith("decision:"):
+                    decision = regla
+            for stage, seconds in stages.items():
+                self._histogram(self.stage_latency, stage).observe(seconds)
+            if decision is not None:
+                self._histogram(self.decision_latency, decision).observe(total_seconds)
+            if predictions == 1:
+                self.recent.append({"timestamp": time.time(), "traza": trace, "etapas": stages})
+
+    @staticmethod
+    def _histogram(histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        return histogram
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "enabled": enabled,
+                "predictions": self.predictions,
+                "rule_hits": dict(sorted(self.rule_hits.items(), key=lambda item: -item[1])),
+                "stage_latency": {name: h.snapshot() for name, h in self.stage_latency.items()},
+                "decision_latency": {name: h.snapshot() for name, h in self.decision_latency.items()},
+                "recent_traces": list(self.recent),
+            }
+
+
+METRICS = TriageMetrics()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def snapshot():
+    """Counters, histograms and recent traces as a JSON-serializable dict"""
+    return METRICS.snapshot()
+
+
+def reset():
+    METRICS.reset()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def export_prometheus():
+    """Metrics in the Prometheus text exposition format"""
+    data = METRICS.snapshot()
+    lines = [
+        "# HELP triage_predictions_total Records scored while instrumentation was enabled",
+        "# TYPE triage_predictions_total counter",
+        f"triage_predictions_total {data['predictions']}",
+        "# HELP triage_rule_hits_total Times each triage rule fired",
+        "# TYPE triage_rule_hits_total counter",
+    ]
+    for regla, count in data["rule_hits"].items():
+        lines.append(f'triage_rule_hits_total{{regla="{_label(regla)}"}} {count}')
+
+    for metric, key, label in (
+        ("triage_stage_seconds", "stage_latency", "etapa"),
+        ("triage_decision_seconds", "decision_latency", "regla"),
+    ):
+        lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in data[key].items():
+            for bound, count in histogram["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{{label}="{_label(name)}",le="{le}"}} {count}')
+            lines.append(f'{metric}_sum{{{label}="{_label(name)}"}} {histogram["sum_s"]}')
+            lines.append(f'{metric}_count{{{label}="{_label(name)}"}} {histogram["count"]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,202 @@
+"""
+Versioned triage rules loaded from a JSON file and reloaded when it changes.
+
+The rules file (reglas_triaje.json, or TRIAGE_RULES_PATH) holds the symptom
+lists per severity class, the vital-sign cut-offs and the medical vocabulary
+the NLP step looks for. It is compiled once into a RuleSet (dict lookups, a
+keyword automaton and a typo index). ``get_rules`` only stats the file;
+when its mtime or size changes the file is re-read. If the content hash
+changed too, a new RuleSet is compiled aside and swapped in with one
+assignment. A file that fails to load or validate is reported and the rules
+in use are kept.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from nlp_processor import Vocabulary, set_vocabulary
+
+RULES_PATH = Path(os.environ.get("TRIAGE_RULES_PATH", Path(__file__).with_name("reglas_triaje.json")))
+
+CATEGORIAS = ("critico", "urgente", "no_urgente")
+
+UMBRALES_REQUERIDOS = (
+    "temperatura_urgente",
+    "temperatura_no_urgente",
+    "saturacion_critica",
+    "saturacion_urgente",
+    "fc_urgente_alta",
+    "fc_urgente_baja",
+    "fc_no_urgente_alta",
+    "fc_no_urgente_baja",
+)
+
+
+class RulesError(ValueError):
+    """The rules file is malformed or incomplete"""
+
+
+def compilar_categorias(criticos, urgentes, no_urgentes):
+    """Síntoma -> index in CATEGORIAS; a síntoma in several lists takes the most severe one"""
+    categorias = {}
+    for indice, sintomas in enumerate((criticos, urgentes, no_urgentes)):
+        for sintoma in sintomas:
+            categorias.setdefault(sintoma, indice)
+    return categorias
+
+
+class RuleSet:
+    """
+    One compiled version of the rules. Never modified after construction.
+
+    Args:
+        data (dict): Parsed rules file
+        digest (str): sha256 of the file contents
+        vocabulary (Vocabulary): Reuse an already compiled vocabulary for the same terms
+    """
+
+    def __init__(self, data, digest=None, vocabulary=None):
+        validar_reglas(data)
+        self.data = data
+        self.version = str(data["version"])
+        self.digest = digest
+        self.umbrales = {clave: float(data["umbrales"][clave]) for clave in UMBRALES_REQUERIDOS}
+        self.sintomas = {categoria: tuple(data["sintomas"][categoria]) for categoria in CATEGORIAS}
+        self.categorias = compilar_categorias(*(self.sintomas[c] for c in CATEGORIAS))
+        self.vocabulary = vocabulary or Vocabulary(data["terminos_medicos"], version=self.version)
+
+    def with_overrides(self, cambios):
+        """
+        New RuleSet with some thresholds, symptom lists or terms replaced.
+
+        The vocabulary is reused unless ``terminos_medicos`` changes.
+        """
+        data = {**self.data, "version": cambios.get("version", f"{self.version}+cambios")}
+        data["umbrales"] = {**self.data["umbrales"], **cambios.get("umbrales", {})}
+        data["sintomas"] = {**self.data["sintomas"], **cambios.get("sintomas", {})}
+        vocabulary = self.vocabulary
+        if "terminos_medicos" in cambios:
+            data["terminos_medicos"] = cambios["terminos_medicos"]
+            vocabulary = None
+        return RuleSet(data, vocabulary=vocabulary)
+
+
+def validar_reglas(data):
+    """Raise RulesError unless data has a version, every threshold and valid classes"""
+    if not isinstance(data, dict) or not data.get("version"):
+        raise RulesError("Falta 'version' en el archivo de reglas")
+
+    umbrales = data.get("umbrales", {})
+    faltantes = [clave for clave in UMBRALES_REQUERIDOS if clave not in umbrales]
+    if faltantes:
+        raise RulesError(f"Faltan umbrales: {faltantes}")
+    desconocidos = set(umbrales) - set(UMBRALES_REQUERIDOS)
+    if desconocidos:
+        raise RulesError(f"Umbrales desconocidos: {sorted(desconocidos)}")
+    for clave, valor in umbrales.items():
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+            raise RulesError(f"El umbral '{clave}' debe ser numérico")
+
+    sintomas = data.get("sintomas", {})
+    if set(sintomas) != set(CATEGORIAS):
+        raise RulesError(f"'sintomas' debe tener exactamente las categorías {list(CATEGORIAS)}")
+
+    terminos = data.get("terminos_medicos")
+    if not terminos:
+        raise RulesError("Falta 'terminos_medicos' en el archivo de reglas")
+    invalidas = {termino: categoria for termino, categoria in terminos.items() if categoria not in CATEGORIAS}
+    if invalidas:
+        raise RulesError(f"Categorías inválidas en terminos_medicos: {invalidas}")
+
+
+def load_rules(path):
+    """Read, validate and compile a rules file"""
+    raw = Path(path).read_bytes()
+    return RuleSet(json.loads(raw), digest=hashlib.sha256(raw).hexdigest())
+
+
+class RulesFile:
+    """
+    Holds the RuleSet compiled from one file and reloads it when the file changes.
+
+    While the file is unchanged ``current`` costs at most one ``os.stat``
+    per ``check_interval`` seconds, so it can be called on every Streamlit
+    rerun and every prediction.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._rules = None
+        self._stat = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.errors = 0
+
+    def current(self):
+        now = time.monotonic()
+        if self._rules is not None and now < self._next_check:
+            return self._rules
+        self._next_check = now + self.check_interval
+
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            if self._rules is None:
+                raise
+            return self._rules  # file being replaced or removed: keep what we have
+
+        if key != self._stat:
+            with self._lock:
+                if key != self._stat:
+                    self._reload(key)
+        return self._rules
+
+    def _reload(self, key):
+        try:
+            raw = self.path.read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()
+            if self._rules is None or digest != self._rules.digest:
+                rules = RuleSet(json.loads(raw), digest=digest)
+                self._install(rules)
+        except (OSError, ValueError) as e:  # json.JSONDecodeError and RulesError are ValueErrors
+            if self._rules is None:
+                raise
+            self.errors += 1
+            print(f"Error loading triage rules from {self.path}, keeping version {self._rules.version}: {str(e)}")
+        self._stat = key
+
+    def _install(self, rules):
+        # Callers that don't pass a vocabulary (live dictation keywords) follow the file too
+        set_vocabulary(rules.vocabulary)
+        self._rules = rules
+        self.reloads += 1
+        print(f"Triage rules version {rules.version} loaded from {self.path}")  # Debug log
+
+    def stats(self):
+        rules = self._rules
+        return {
+            "path": str(self.path),
+            "version": rules.version if rules else None,
+            "digest": rules.digest[:12] if rules and rules.digest else None,
+            "reloads": self.reloads,
+            "errors": self.errors,
+        }
+
+
+_rules_file = RulesFile(RULES_PATH, check_interval=float(os.environ.get("TRIAGE_RULES_CHECK_INTERVAL", 1.0)))
+
+
+def get_rules():
+    """Current RuleSet, reloading the rules file first if it changed"""
+    return _rules_file.current()
+
+
+def get_rules_stats():
+    """Version, reload and error counters of the rules file"""
+    return _rules_file.stats()
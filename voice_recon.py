@@ -1,16 +1,146 @@
-import whisper
-import sounddevice as sd
-import soundfile as sf
-from pathlib import Path
+try:
+    import sounddevice as sd
+except (ImportError, OSError):  # no PortAudio: file transcription still works
+    sd = None
 import time
 import numpy as np
-import tempfile
 import subprocess
 import sys
 import platform
+import os
+import threading
+from functools import lru_cache
 
+# Whisper works on 16 kHz mono float32
+WHISPER_SAMPLE_RATE = 16000
+
+# Whisper model size ("tiny", "base", "small", ...), overridable with WHISPER_MODEL
+DEFAULT_MODEL_SIZE = os.environ.get("WHISPER_MODEL", "base")
+
+# Transcription engine (see BACKENDS), overridable with TRANSCRIPTION_BACKEND
+DEFAULT_BACKEND = os.environ.get("TRANSCRIPTION_BACKEND", "whisper")
+
+class WhisperBackend:
+    """openai-whisper on PyTorch, float32 on CPU"""
+
+    name = "whisper"
+
+    def __init__(self, size):
+        import whisper
+
+        self.model = whisper.load_model(size)
+
+    def transcribe(self, audio):
+        result = self.model.transcribe(audio, fp16=False)
+        return result["text"].strip()
+
+class FasterWhisperBackend:
+    """CTranslate2 Whisper (faster-whisper) with int8-quantized weights, for CPU-only totems"""
+
+    name = "faster-whisper"
+
+    def __init__(self, size, compute_type=None, cpu_threads=None):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            size,
+            device="cpu",
+            compute_type=compute_type or os.environ.get("TRANSCRIPTION_COMPUTE_TYPE", "int8"),
+            cpu_threads=int(cpu_threads or os.environ.get("TRANSCRIPTION_CPU_THREADS", 0)),
+        )
+
+    def transcribe(self, audio):
+        segments, _ = self.model.transcribe(audio)
+        # segments is a generator: decoding happens while it is consumed
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+_models = {}
+_models_lock = threading.Lock()
+_inference_locks = {}
+_warmup_thread = None
+_stats_lock = threading.Lock()
+_stats = {
+    "load_seconds": {},
+    "transcriptions": 0,
+    "inference_total_seconds": 0.0,
+    "inference_last_seconds": None,
+}
+
+def get_transcriber(backend=None, size=None):
+    """
+    Return the transcription backend for (backend, size), loading it once per process.
+
+    Concurrent callers wait for the first load instead of loading it again.
+    """
+    key = (backend or DEFAULT_BACKEND, size or DEFAULT_MODEL_SIZE)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        if key not in _models:
+            if key[0] not in BACKENDS:
+                raise ValueError(f"Unknown transcription backend '{key[0]}', expected one of {sorted(BACKENDS)}")
+
+            print(f"Loading {key[0]} model '{key[1]}'...")
+            start = time.perf_counter()
+            _models[key] = BACKENDS[key[0]](key[1])
+            _inference_locks[key] = threading.Lock()
+            elapsed = time.perf_counter() - start
+            with _stats_lock:
+                _stats["load_seconds"][f"{key[0]}:{key[1]}"] = elapsed
+            print(f"{key[0]} model '{key[1]}' loaded in {elapsed:.2f}s")
+    return _models[key]
+
+def warm_up_model(size=None, backend=None):
+    """Load the transcription model in a background thread so the first patient doesn't wait for it"""
+    global _warmup_thread
+    with _stats_lock:
+        if _warmup_thread is None:
+            def load():
+                try:
+                    get_transcriber(backend, size)
+                except Exception as e:
+                    print(f"Error warming up transcription model: {str(e)}")
+
+            _warmup_thread = threading.Thread(target=load, name="whisper-warmup", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+def run_transcription(audio, size=None, backend=None):
+    """Transcribe a file path or 16 kHz audio array with the resident model, timing inference only"""
+    key = (backend or DEFAULT_BACKEND, size or DEFAULT_MODEL_SIZE)
+    model = get_transcriber(*key)
+
+    # Whisper installs per-call hooks on the model, so one decode at a time
+    with _inference_locks[key]:
+        start = time.perf_counter()
+        text = model.transcribe(audio)
+        elapsed = time.perf_counter() - start
+
+    with _stats_lock:
+        _stats["transcriptions"] += 1
+        _stats["inference_total_seconds"] += elapsed
+        _stats["inference_last_seconds"] = elapsed
+    print(f"Transcription inference took {elapsed:.2f}s")
+    return text
+
+def get_transcription_stats():
+    """Model load times and inference timings, reported separately"""
+    with _stats_lock:
+        stats = dict(_stats, load_seconds=dict(_stats["load_seconds"]))
+    count = stats["transcriptions"]
+    stats["inference_avg_seconds"] = stats["inference_total_seconds"] / count if count else None
+    return stats
+
+@lru_cache(maxsize=None)
 def check_ffmpeg():
-    """Check if ffmpeg is installed and accessible"""
+    """Check once per process if ffmpeg is installed (only needed to decode audio files)"""
     try:
         subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return True
@@ -24,71 +154,131 @@ def check_ffmpeg():
             print("Please download ffmpeg from https://www.gyan.dev/ffmpeg/builds/ and add it to your PATH")
         return False
 
-def transcribe_audio(duration=5, sample_rate=44100):
+@lru_cache(maxsize=None)
+def find_input_device():
     """
-    Record audio from microphone and transcribe it using Whisper.
+    Pick the input device and capture rate once per process.
+
+    Prefers PulseAudio, then any device with input channels. Captures at
+    16 kHz directly when the device accepts it, otherwise at its native rate.
+
+    Returns:
+        tuple: (device index, sample rate)
     """
+    if sd is None:
+        raise RuntimeError("sounddevice/PortAudio is not available on this host")
+
+    devices = sd.query_devices()
+    input_device = None
+    
+    # First try to find PulseAudio
+    for device in devices:
+        if 'pulse' in str(device['name']).lower():
+            input_device = device['index']
+            break
+    
+    # If no PulseAudio, try any input device
+    if input_device is None:
+        for device in devices:
+            if device['max_input_channels'] > 0:
+                input_device = device['index']
+                break
+            
+    if input_device is None:
+        raise RuntimeError("No input device found")
+
     try:
-        # Check for ffmpeg first
-        if not check_ffmpeg():
-            raise RuntimeError("ffmpeg is required but not installed. Please install ffmpeg first.")
+        sd.check_input_settings(device=input_device, channels=1, dtype='float32',
+                                samplerate=WHISPER_SAMPLE_RATE)
+        sample_rate = WHISPER_SAMPLE_RATE
+    except Exception:
+        # Get device info to use its native sample rate
+        device_info = sd.query_devices(input_device, 'input')
+        sample_rate = int(device_info['default_samplerate'])
+
+    print(f"Using input device {input_device} at {sample_rate}Hz")
+    return input_device, sample_rate
+
+@lru_cache(maxsize=8)
+def _lowpass_kernel(ratio, taps=63):
+    """Hann-windowed sinc low-pass for downsampling by ``ratio`` (target/source rate)"""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = ratio * np.sinc(ratio * n) * np.hanning(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+def resample_to_16k(audio, sample_rate):
+    """Resample mono float32 audio to Whisper's 16 kHz in-process (anti-alias filter + interpolation)"""
+    if sample_rate == WHISPER_SAMPLE_RATE:
+        return np.asarray(audio, dtype=np.float32)
+
+    ratio = WHISPER_SAMPLE_RATE / sample_rate
+    if ratio < 1:
+        audio = np.convolve(audio, _lowpass_kernel(round(ratio, 6)), mode='same')
+    n_out = int(round(len(audio) * ratio))
+    positions = np.arange(n_out, dtype=np.float64) / ratio
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+_capture_lock = threading.Lock()
+_capture_buffer = np.empty(0, dtype=np.float32)
+
+def record_audio(duration=5):
+    """
+    Record mono audio from the microphone into a reused float32 buffer.
+
+    Returns:
+        np.ndarray: 16 kHz float32 samples clipped to [-1, 1], owned by the caller
+    """
+    global _capture_buffer
+    input_device, sample_rate = find_input_device()
+    frames = int(duration * sample_rate)
+
+    with _capture_lock:
+        if len(_capture_buffer) < frames:
+            _capture_buffer = np.empty(frames, dtype=np.float32)
+        buffer = _capture_buffer[:frames]
+
+        print(f"Recording for {duration} seconds using device {input_device} at {sample_rate}Hz...")
+        sd.rec(
+            frames,
+            samplerate=sample_rate,
+            channels=1,
+            dtype='float32',
+            device=input_device,
+            out=buffer.reshape(-1, 1),
+            blocking=True
+        )
+        np.clip(buffer, -1, 1, out=buffer)
 
-        # Try to use PulseAudio by default
+        # Resampling returns a new array; at 16 kHz copy out of the shared buffer
+        if sample_rate == WHISPER_SAMPLE_RATE:
+            return buffer.copy()
+        return resample_to_16k(buffer, sample_rate)
+
+def load_audio_file(path):
+    """Decode an audio file (WAV, FLAC, OGG...) to 16 kHz mono float32 without ffmpeg"""
+    import soundfile as sf
+
+    audio, sample_rate = sf.read(str(path), dtype='float32', always_2d=True)
+    audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+    return resample_to_16k(np.clip(audio, -1, 1), sample_rate)
+
+def transcribe_audio(duration=5, sample_rate=None):
+    """
+    Record audio from microphone and transcribe it using Whisper.
+
+    Audio stays in memory: it is captured into a float32 buffer, resampled
+    to 16 kHz and handed to the model as an array, so no WAV file or ffmpeg
+    process is involved. ``sample_rate`` is kept for compatibility; the
+    capture rate is chosen by find_input_device().
+    """
+    try:
         try:
-            devices = sd.query_devices()
-            input_device = None
+            audio_data = record_audio(duration)
             
-            # First try to find PulseAudio
-            for device in devices:
-                if 'pulse' in str(device['name']).lower():
-                    input_device = device['index']
-                    break
+            # Transcribe with the resident Whisper model
+            transcribed_text = run_transcription(audio_data)
             
-            # If no PulseAudio, try any input device
-            if input_device is None:
-                for device in devices:
-                    if device['max_input_channels'] > 0:
-                        input_device = device['index']
-                        break
-                    
-            if input_device is None:
-                raise RuntimeError("No input device found")
-
-            # Get device info to use its native sample rate
-            device_info = sd.query_devices(input_device, 'input')
-            if device_info is not None:
-                sample_rate = int(device_info['default_samplerate'])
-
-            # Create a temporary directory that will be automatically cleaned up
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_path = Path(temp_dir) / "temp_recording.wav"
-                
-                # Record audio with explicit device selection
-                print(f"Recording for {duration} seconds using device {input_device} at {sample_rate}Hz...")
-                audio_data = sd.rec(
-                    int(duration * sample_rate),
-                    samplerate=sample_rate,
-                    channels=1,
-                    dtype='float32',
-                    device=input_device,
-                    blocking=True
-                )
-                
-                # Normalize audio data
-                audio_data = audio_data.squeeze()
-                audio_data = np.clip(audio_data, -1, 1)
-                
-                # Save to temporary file
-                sf.write(str(temp_path), audio_data, sample_rate)
-                
-                # Load Whisper model
-                model = whisper.load_model("base")
-                
-                # Transcribe
-                result = model.transcribe(str(temp_path), fp16=False)
-                transcribed_text = result["text"].strip()
-                
-                return transcribed_text
+            return transcribed_text
                 
         except Exception as e:
             raise RuntimeError(f"Error recording audio: {str(e)}")
@@ -96,8 +286,9 @@ def transcribe_audio(duration=5, sample_rate=44100):
     except Exception as e:
         print(f"Error in audio transcription: {str(e)}")
         # Print available audio devices for debugging
-        print("\nAvailable audio devices:")
-        print(sd.query_devices())
+        if sd is not None:
+            print("\nAvailable audio devices:")
+            print(sd.query_devices())
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
         return None
@@ -107,3 +298,4 @@ if __name__ == "__main__":
     print("Testing audio recording and transcription:")
     text = transcribe_audio(duration=5)
     print(f"Transcribed text: {text}")
+    print(f"Timings: {get_transcription_stats()}")
@@ -0,0 +1,188 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+from voice_recon import find_input_device, resample_to_16k, run_transcription
+
+
+class RingBuffer:
+    """
+    Fixed-size float32 ring buffer written by the audio callback thread.
+
+    Samples are addressed by absolute position (total samples written so far),
+    so a reader can ask for ``read(start, end)`` as long as the data has not
+    been overwritten yet.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self._written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def written(self):
+        return self._written
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        with self._lock:
+            start = self._written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self._written += len(samples)
+
+    def read(self, start, end):
+        """Copy samples [start, end) out of the buffer"""
+        with self._lock:
+            if start < self._written - self.capacity:
+                raise RuntimeError("Audio ring buffer overrun: reader fell too far behind")
+            end = min(end, self._written)
+            if end <= start:
+                return np.empty(0, dtype=np.float32)
+            i, j = start % self.capacity, end % self.capacity
+            if i < j:
+                return self._data[i:j].copy()
+            return np.concatenate((self._data[i:], self._data[:j]))
+
+
+class EnergyVAD:
+    """
+    Frame-energy voice activity detector with an adaptive noise floor.
+
+    A frame counts as speech when its RMS level is ``margin_db`` above the
+    running noise estimate (and above ``min_threshold_db``). The noise floor
+    tracks non-speech frames, so it adapts to the room.
+
+    Args:
+        sample_rate (int): Sample rate of the frames being fed
+        frame_ms (int): Analysis frame length
+        margin_db (float): dB above the noise floor that counts as speech
+        min_threshold_db (float): Absolute floor of the speech threshold in dBFS
+    """
+
+    def __init__(self, sample_rate, frame_ms=30, margin_db=10.0, min_threshold_db=-50.0):
+        self.frame_size = int(sample_rate * frame_ms / 1000)
+        self.frame_ms = frame_ms
+        self.margin_db = margin_db
+        self.min_threshold_db = min_threshold_db
+        self.noise_db = None
+
+    def is_speech(self, frame):
+        rms = float(np.sqrt(np.mean(np.square(frame), dtype=np.float64)))
+        level_db = 20 * np.log10(max(rms, 1e-10))
+        if self.noise_db is None:
+            self.noise_db = level_db
+        speech = level_db > max(self.min_threshold_db, self.noise_db + self.margin_db)
+        if not speech:
+            self.noise_db = 0.95 * self.noise_db + 0.05 * level_db
+        return speech
+
+
+def stream_transcribe(
+    on_partial=None,
+    max_duration=20.0,
+    start_timeout=6.0,
+    end_silence=0.8,
+    pause_silence=0.3,
+    min_chunk=2.0,
+    max_chunk=8.0,
+):
+    """
+    Record until the patient stops talking, transcribing chunk by chunk.
+
+    Audio arrives through a ``sounddevice.InputStream`` callback into a ring
+    buffer. An energy VAD ends the capture after ``end_silence`` seconds of
+    trailing silence (or ``start_timeout`` seconds without any speech). While
+    the patient is still speaking, each chunk of at least ``min_chunk``
+    seconds is cut at a short pause (or at ``max_chunk``) and transcribed, so
+    only the last chunk is left to transcribe when they stop.
+
+    Args:
+        on_partial: Callback receiving the transcript so far after each chunk
+        max_duration (float): Hard limit on the recording length in seconds
+
+    Returns:
+        str: Full transcript ('' if nobody spoke)
+    """
+    input_device, sample_rate = find_input_device()
+    ring = RingBuffer(int((max_duration + max_chunk) * sample_rate))
+    vad = EnergyVAD(sample_rate)
+    frame = vad.frame_size
+    arrived = queue.Queue()
+
+    def callback(indata, frames, time_info, status):
+        if status:
+            print(f"Audio stream status: {status}")
+        ring.write(indata[:, 0])
+        arrived.put(frames)
+
+    texts = []
+    chunk_start = None  # absolute sample position where the current chunk starts
+    analysed = 0
+    last_speech = None
+    started_at = time.monotonic()
+
+    def flush(end):
+        nonlocal chunk_start
+        audio = resample_to_16k(np.clip(ring.read(chunk_start, end), -1, 1), sample_rate)
+        chunk_start = end
+        text = run_transcription(audio)
+        if text:
+            texts.append(text)
+            if on_partial:
+                on_partial(" ".join(texts))
+
+    print(f"Streaming capture from device {input_device} at {sample_rate}Hz...")
+    with sd.InputStream(
+        samplerate=sample_rate,
+        channels=1,
+        dtype='float32',
+        device=input_device,
+        blocksize=frame,
+        callback=callback,
+    ):
+        while True:
+            try:
+                arrived.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+            # Run the VAD over every complete frame received so far
+            while analysed + frame <= ring.written:
+                if vad.is_speech(ring.read(analysed, analysed + frame)):
+                    if chunk_start is None:
+                        # Keep a little audio before the first voiced frame
+                        chunk_start = max(0, analysed - int(0.2 * sample_rate))
+                    last_speech = analysed + frame
+                analysed += frame
+
+            elapsed = time.monotonic() - started_at
+            if chunk_start is None:
+                if elapsed > start_timeout:
+                    print("No speech detected")
+                    return ""
+                continue
+
+            silence = (analysed - last_speech) / sample_rate
+            if silence >= end_silence or elapsed >= max_duration:
+                break
+
+            chunk_length = (analysed - chunk_start) / sample_rate
+            if (chunk_length >= min_chunk and silence >= pause_silence) or chunk_length >= max_chunk:
+                flush(analysed)
+
+    # Transcribe what is left, without the trailing silence
+    if last_speech > chunk_start:
+        flush(last_speech)
+    return " ".join(texts)
+
+
+if __name__ == "__main__":
+    print("Hable ahora; la grabación termina sola al hacer silencio.")
+    text = stream_transcribe(on_partial=lambda partial: print(f"... {partial}"))
+    print(f"Transcribed text: {text}")